@@ -5,19 +5,23 @@ LinkedIn Content Machine — AI-powered pipeline:
 3. Gemini: generate LinkedIn post (strategist prompt)
 4. Gemini Imagen: generate image → human approval / regenerate
 """
-import streamlit as st
+import tempfile
+import uuid
+from datetime import date, datetime, timedelta
 from pathlib import Path
 
+import streamlit as st
+
 import sys
 sys.path.insert(0, str(Path(__file__).resolve().parent))
 
-from config import ensure_dirs, TOPICS_EXCEL, GEMINI_API_KEY, TAVILY_API_KEY
-from services.topics import search_trending_topics
-from services.excel_store import save_topics_to_excel, load_topics_from_excel
-from services.content import generate_linkedin_content
-from services.image_gen import generate_post_image
-
-ensure_dirs()
+from config import (
+    ensure_dirs, PREFETCH_TOP_K, TOPICS_DB, TOPICS_EXCEL, GEMINI_API_KEY, TAVILY_API_KEY, METRICS_FILE, TRACE_FILE,
+)
+from services import image_store, metrics, resilience, topic_store
+from services.excel_store import HISTORY_FORMATS
+from services.content import MAX_VARIANTS, SECTION_HEADERS, get_cached_linkedin_content
+from services.image_gen import MAX_CANDIDATES
 
 st.set_page_config(
     page_title="LinkedIn Content Machine",
@@ -26,6 +30,36 @@ st.set_page_config(
     initial_sidebar_state="collapsed",
 )
 
+
+@st.cache_resource(show_spinner=False)
+def init_storage() -> bool:
+    """Once per process, not per rerun: create data dirs and migrate legacy Excel into the store."""
+    ensure_dirs()
+    topic_store.import_excel_if_empty()
+    return True
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def latest_topics():
+    """Latest saved run; cleared after each search, short TTL picks up runs saved elsewhere (batch)."""
+    return topic_store.load_run()
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def past_runs():
+    """Recent search runs for the "Open a past run" picker; cleared with latest_topics."""
+    return topic_store.list_runs()
+
+
+@st.cache_resource(show_spinner=False)
+def job_queue():
+    """One background worker pool per app process, shared by all sessions."""
+    from services.jobs import get_queue
+    return get_queue()
+
+
+init_storage()
+
 st.title("📄 LinkedIn Content Machine-Makonis")
 st.caption("Topics (Tavily web search) → Select → Generate post & image → Approve")
 
@@ -34,12 +68,137 @@ if "topics" not in st.session_state:
     st.session_state.topics = []
 if "selected_topic" not in st.session_state:
     st.session_state.selected_topic = None
+if "selected_topic_id" not in st.session_state:
+    st.session_state.selected_topic_id = None
+if "post_id" not in st.session_state:
+    st.session_state.post_id = None
 if "content" not in st.session_state:
     st.session_state.content = ""
+if "content_topic" not in st.session_state:
+    st.session_state.content_topic = None
 if "image_path" not in st.session_state:
     st.session_state.image_path = None
 if "image_approved" not in st.session_state:
     st.session_state.image_approved = False
+if "image_candidates" not in st.session_state:
+    st.session_state.image_candidates = []
+if "post_variants" not in st.session_state:
+    st.session_state.post_variants = []
+if "job_messages" not in st.session_state:
+    st.session_state.job_messages = []
+if "session_id" not in st.session_state:
+    # Kept in the URL like job IDs, so the performance breakdown survives a refresh
+    st.session_state.session_id = st.query_params.get("session") or uuid.uuid4().hex[:12]
+    st.query_params["session"] = st.session_state.session_id
+metrics.set_session(st.session_state.session_id)
+
+# --- Background jobs: API calls run in the worker pool; IDs live in the URL so a refresh keeps them ---
+JOB_SLOTS = ("search", "post", "image", "prefetch")
+JOB_ACTIVE = ("queued", "running")
+for _slot in JOB_SLOTS:
+    if f"job_{_slot}" not in st.session_state:
+        st.session_state[f"job_{_slot}"] = st.query_params.get(f"job_{_slot}")
+
+
+def submit_job(slot, kind, **params):
+    job_id = job_queue().submit(kind, dict(params, session_id=st.session_state.session_id))
+    st.session_state[f"job_{slot}"] = job_id
+    st.query_params[f"job_{slot}"] = job_id
+
+
+def clear_job(slot):
+    st.session_state[f"job_{slot}"] = None
+    if f"job_{slot}" in st.query_params:
+        del st.query_params[f"job_{slot}"]
+
+
+def apply_job_result(job):
+    result = job["result"] or {}
+    if job["kind"] == "search_topics" and result.get("empty"):
+        # Nothing new: keep the current list (the empty search was not saved)
+        st.session_state.job_messages.append(("warning", f"{result['empty']} Keeping the current list."))
+    elif job["kind"] == "search_topics":
+        st.session_state.topics = result.get("topics", [])
+        latest_topics.clear()
+        past_runs.clear()
+        new_topics = result.get("added", st.session_state.topics)
+        if "added" in result:
+            msg = f"{len(new_topics)} new topic(s) from unseen sources; {len(st.session_state.topics)} in the list"
+        else:
+            msg = f"Found {len(st.session_state.topics)} topics"
+        st.session_state.job_messages.append(("success", f"{msg}. Saved to {TOPICS_DB.name}"))
+        if result.get("warning"):
+            st.session_state.job_messages.append(("warning", f"{result['warning']} — showing raw web headlines."))
+        if st.session_state.get("prefetch") and GEMINI_API_KEY and new_topics:
+            # Speculative: draft the top topics while the editor reads the list
+            submit_job("prefetch", "prefetch_posts", topics=new_topics[:PREFETCH_TOP_K])
+    if job["kind"] == "prefetch_posts" and result.get("drafted"):
+        st.session_state.job_messages.append(
+            ("info", f"Drafts ready for {len(result['drafted'])} top topic(s) — select one to see it instantly.")
+        )
+    if "content" in result:
+        st.session_state.content = result["content"]
+        st.session_state.content_topic = job["params"].get("topic")
+        st.session_state.post_id = result.get("post_id")
+        st.session_state.post_variants = result.get("variants") or []
+    if result.get("hero_copy"):
+        st.session_state.hero_for_image = result["hero_copy"]
+    if result.get("image_error"):
+        st.session_state.job_messages.append(("error", result["image_error"]))
+    if result.get("image_paths"):
+        paths = result["image_paths"]
+        st.session_state.image_candidates = paths
+        st.session_state.image_path = Path(paths[0]) if len(paths) == 1 else None
+        st.session_state.image_approved = False
+
+
+def collect_finished_jobs():
+    """Apply results of jobs that finished since the last run (before any widget is drawn)."""
+    for slot in JOB_SLOTS:
+        job_id = st.session_state[f"job_{slot}"]
+        if not job_id:
+            continue
+        job = job_queue().get(job_id)
+        if job is not None and job["status"] in JOB_ACTIVE:
+            continue
+        clear_job(slot)
+        if job is None:
+            continue
+        if job["status"] == "failed":
+            st.session_state.job_messages.append(("error", job["error"]))
+        else:
+            apply_job_result(job)
+
+
+def render_sections(placeholder, state):
+    """Show post sections as they fill in (… marks a section still being written)."""
+    sections = state.get("sections") or {}
+    done = state.get("done") or []
+    parts = [
+        f"**{label}**{'' if key in done else ' …'}\n\n{sections[key]}"
+        for key, label in SECTION_HEADERS
+        if sections.get(key)
+    ]
+    placeholder.markdown("\n\n".join(parts) if parts else (state.get("text") or ""))
+
+
+@st.fragment(run_every=1.0)
+def job_progress(slot, label):
+    """Polls the job once a second; a full rerun picks up the result when it finishes."""
+    job_id = st.session_state.get(f"job_{slot}")
+    job = job_queue().get(job_id) if job_id else None
+    if job is None or job["status"] not in JOB_ACTIVE:
+        st.rerun()
+    progress = job["progress"] or {}
+    st.caption(f"⏳ {label}… ({progress.get('stage') or job['status']})")
+    if progress.get("sections") or progress.get("text"):
+        render_sections(st.empty(), progress)
+
+
+collect_finished_jobs()
+for level, msg in st.session_state.job_messages:
+    getattr(st, level)(msg)
+st.session_state.job_messages = []
 
 # --- Step 1: Trending topics (Tavily web search + Excel) ---
 st.header("1️⃣ Trending topics (Tavily + web search)")
@@ -53,27 +212,68 @@ recency = st.selectbox(
     format_func=lambda x: {"day": "Today", "week": "This week", "month": "This month"}[x],
     key="recency",
 )
+fan_out = st.checkbox(
+    "Search each niche separately (broader coverage, runs in parallel)",
+    value=False,
+    key="fan_out",
+)
+allow_repeats = st.checkbox(
+    "Allow topics similar to past runs",
+    value=False,
+    key="allow_repeats",
+    help="By default, topics that are near-duplicates of anything already in the topic history are skipped.",
+)
+incremental = st.checkbox(
+    "Only new sources (add to the current list)",
+    value=False,
+    key="incremental",
+    help="Skips articles already processed for this niche and time window; new topics are appended to the list.",
+)
+st.checkbox(
+    f"Prefetch post drafts for the top {PREFETCH_TOP_K} topics",
+    value=False,
+    key="prefetch",
+    help="Drafts are generated in the background (within PREFETCH_TOKEN_BUDGET) so picking one of them is instant.",
+)
 
 if st.button("🔍 Search trending topics", type="primary"):
     if not TAVILY_API_KEY:
         st.error("Set TAVILY_API_KEY in .env")
     else:
-        with st.spinner("Searching web for recent topics…"):
-            try:
-                topics = search_trending_topics(niche=niche, count=int(count), recency=recency)
-                st.session_state.topics = topics
-                save_topics_to_excel(topics)
-                st.success(f"Found {len(topics)} topics (recent: {recency}). Saved to {TOPICS_EXCEL}")
-            except Exception as e:
-                st.exception(e)
-
-if not st.session_state.topics and TOPICS_EXCEL.exists():
-    st.session_state.topics = load_topics_from_excel()
+        submit_job(
+            "search", "search_topics",
+            niche=niche, count=int(count), recency=recency, fan_out=fan_out,
+            dedupe=not allow_repeats, incremental=incremental,
+        )
+if st.session_state.job_search:
+    job_progress("search", "Searching web for recent topics")
+
+if not st.session_state.topics:
+    st.session_state.topics = latest_topics()
     if st.session_state.topics:
-        st.info(f"Loaded {len(st.session_state.topics)} topics from Excel.")
+        st.info(f"Loaded {len(st.session_state.topics)} topics from the last search.")
+
+
+def open_past_run():
+    run_id = st.session_state.past_run
+    if run_id is not None:
+        st.session_state.topics = topic_store.load_run(run_id)
+        st.session_state.past_run = None
+
+
+runs = past_runs()
+if len(runs) > 1:
+    run_labels = {
+        r["id"]: f"{datetime.fromtimestamp(r['created_at']):%d %b %Y %H:%M} · {r['niche'] or 'no niche'} · {r['count']} topic{'s' if r['count'] != 1 else ''}"
+        for r in runs
+    }
+    st.selectbox(
+        "Open a past run", list(run_labels), index=None, format_func=run_labels.get,
+        placeholder="Current list", key="past_run", on_change=open_past_run,
+    )
 
 if st.session_state.topics:
-    st.subheader("Topics (saved in Excel)")
+    st.subheader("Topics (saved)")
     for t in st.session_state.topics:
         idx = t.get("index", t.get("title", ""))
         title = t.get("title", str(t))
@@ -84,13 +284,51 @@ if st.session_state.topics:
                 st.caption(f"Why trending: {reason}")
             if summary:
                 st.write(summary)
+    def build_topics_excel(run_id=st.session_state.topics[0].get("run_id")):
+        # Deferred: pandas/openpyxl load and the workbook is built only when the button is clicked
+        from services.excel_store import export_topics_excel
+        return export_topics_excel(run_id)
+
     st.download_button(
         "📥 Download topics (Excel)",
-        data=Path(TOPICS_EXCEL).read_bytes() if TOPICS_EXCEL.exists() else b"",
+        data=build_topics_excel,
         file_name=TOPICS_EXCEL.name,
         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
     )
 
+with st.expander("📦 Export history"):
+    st.caption(
+        "All stored topics with their latest post, image and approval. The download is served from memory; "
+        "for very large histories use `python batch.py --export` (streams straight to a file)."
+    )
+    hist_cols = st.columns(2)
+    hist_range = hist_cols[0].date_input("Created between", value=(date.today() - timedelta(days=90), date.today()))
+    hist_niche = hist_cols[1].text_input("Niche contains", value="", placeholder="e.g. VLSI")
+    hist_cols = st.columns(2)
+    hist_status = hist_cols[0].selectbox("Approval", ["All", "Approved image", "Not approved"])
+    hist_fmt = hist_cols[1].radio("Format", list(HISTORY_FORMATS), horizontal=True)
+    hist_start, hist_end = (tuple(hist_range) + (None, None))[:2]
+
+    def build_history(
+        fmt=hist_fmt, start=hist_start, end=hist_end or hist_start, niche=hist_niche,
+        approved={"Approved image": True, "Not approved": False}.get(hist_status),
+    ):
+        # Only when the button is clicked: rows stream from SQLite into a file on disk; Streamlit then holds
+        # that one file in memory to serve it (no chunk list + joined copy)
+        from services.excel_store import save_history_export
+        with tempfile.TemporaryDirectory(prefix="history-") as tmp:
+            path = save_history_export(
+                Path(tmp) / f"history.{fmt}", start=start, end=end, niche=niche.strip() or None, approved=approved
+            )
+            return path.read_bytes()
+
+    st.download_button(
+        "📥 Download history",
+        data=build_history,
+        file_name=f"topic_history_{date.today():%Y%m%d}.{hist_fmt}",
+        mime=HISTORY_FORMATS[hist_fmt],
+    )
+
 # --- Step 2: Select topic ---
 st.header("2️⃣ Select a topic")
 options = ["— Select or search again —"] + [
@@ -106,23 +344,106 @@ if choice and choice != "— Select or search again —":
     )
     if selected:
         st.session_state.selected_topic = selected.get("title", str(selected))
+        st.session_state.selected_topic_id = selected.get("id")
         st.info(f"Selected: **{st.session_state.selected_topic}**")
+        if st.session_state.content_topic != st.session_state.selected_topic:
+            draft = get_cached_linkedin_content(st.session_state.selected_topic)
+            if draft:
+                st.session_state.content = draft
+                st.session_state.content_topic = st.session_state.selected_topic
+                if st.session_state.selected_topic_id:
+                    st.session_state.post_id = topic_store.add_post(st.session_state.selected_topic_id, draft)
+                st.caption("Draft ready (prefetched).")
+            elif st.session_state.selected_topic_id:
+                # Cache entries expire; the history keeps every post written for this topic
+                saved = topic_store.latest_post(st.session_state.selected_topic_id)
+                if saved:
+                    st.session_state.content = saved["content"]
+                    st.session_state.content_topic = st.session_state.selected_topic
+                    st.session_state.post_id = saved["id"]
+                    st.caption("Loaded the last saved post for this topic.")
 else:
     st.session_state.selected_topic = None
+    st.session_state.selected_topic_id = None
     st.caption("Search again above if none of the topics fit.")
 
 # --- Step 3: Generate content (Gemini — strategist prompt) ---
 st.header("3️⃣ LinkedIn post (Gemini)")
 if st.session_state.selected_topic:
+    force_new = st.checkbox(
+        "Force new variant (skip cache)",
+        value=False,
+        key="force_new_post",
+        help="Same topic normally returns the cached post instantly. Tick to generate a fresh one.",
+    )
     if st.button("✨ Generate post"):
         if not GEMINI_API_KEY:
             st.error("Set GEMINI_API_KEY in .env")
         else:
-            with st.spinner("Generating post…"):
-                try:
-                    st.session_state.content = generate_linkedin_content(st.session_state.selected_topic)
-                except Exception as e:
-                    st.exception(e)
+            submit_job(
+                "post",
+                "generate_post",
+                topic=st.session_state.selected_topic,
+                topic_id=st.session_state.selected_topic_id,
+                use_cache=not force_new,
+            )
+    v1, v2 = st.columns([1, 2])
+    with v1:
+        n_variants = st.number_input(
+            "Variants", min_value=2, max_value=MAX_VARIANTS, value=3, key="n_variants",
+            help="Several captions from one Gemini call, ranked by format checks.",
+        )
+    with v2:
+        st.write("")
+        if st.button(f"🎲 Generate {int(n_variants)} variants", help="One request instead of repeated regenerations."):
+            if not GEMINI_API_KEY:
+                st.error("Set GEMINI_API_KEY in .env")
+            else:
+                submit_job(
+                    "post",
+                    "generate_variants",
+                    topic=st.session_state.selected_topic,
+                    topic_id=st.session_state.selected_topic_id,
+                    n=int(n_variants),
+                    use_cache=not force_new,
+                )
+    if st.button("⚡ Generate post + image", help="Image starts as soon as the HERO Copy is written."):
+        if not GEMINI_API_KEY:
+            st.error("Set GEMINI_API_KEY in .env")
+        else:
+            submit_job(
+                "post",
+                "post_and_image",
+                topic=st.session_state.selected_topic,
+                topic_id=st.session_state.selected_topic_id,
+                template_description=(st.session_state.get("image_template") or "").strip() or None,
+                count=int(st.session_state.get("n_candidates") or 1),
+                use_cache=not force_new,
+            )
+    if st.session_state.job_post:
+        job_progress("post", "Generating post")
+    same_topic = st.session_state.content_topic == st.session_state.selected_topic
+    variants = st.session_state.post_variants if same_topic else []
+    if variants:
+        st.caption(f"{len(variants)} variants, best first (score = format checks, 100 = all pass):")
+        for rank, v in enumerate(variants, 1):
+            chosen = v["content"] == st.session_state.content
+            title = (
+                f"#{rank} · score {v['score']}/100 · caption {v['caption_words']} words "
+                f"· HERO {v['hero_words']} words{' ✅' if chosen else ''}"
+            )
+            with st.expander(title, expanded=rank == 1):
+                st.caption("; ".join(v["issues"]) if v["issues"] else "All format checks pass.")
+                st.markdown(
+                    "\n\n".join(f"**{label}**\n\n{v[key]}" for key, label in SECTION_HEADERS if v.get(key))
+                )
+                if not chosen and st.button(f"Use #{rank}", key=f"use_variant_{rank}"):
+                    st.session_state.content = v["content"]
+                    st.session_state.hero_for_image = v.get("hero_copy", "")
+                    topic_id = st.session_state.selected_topic_id
+                    if topic_id:
+                        st.session_state.post_id = topic_store.add_post(topic_id, v["content"])
+                    st.rerun()
     if st.session_state.content:
         st.text_area("Post text", value=st.session_state.content, height=280, key="content_display")
 else:
@@ -144,27 +465,52 @@ if st.session_state.selected_topic:
             placeholder="Paste the HERO Copy from the caption above to show on the image.",
             key="hero_for_image",
         )
+    n_candidates = st.number_input(
+        "Candidates per request",
+        min_value=1,
+        max_value=MAX_CANDIDATES,
+        value=1,
+        key="n_candidates",
+        help="Several images from one Imagen call — pick one instead of regenerating.",
+    )
     if st.button("🖼️ Generate image"):
-        with st.spinner("Generating image…"):
-            path, err = generate_post_image(
-                st.session_state.selected_topic,
-                template_description=image_template.strip() or None,
-                hero_copy=hero_for_image.strip() or None,
-            )
-            if err:
-                st.error(err)
-            else:
-                st.session_state.image_path = path
-                st.session_state.image_approved = False
+        submit_job(
+            "image",
+            "generate_image",
+            topic=st.session_state.selected_topic,
+            topic_id=st.session_state.selected_topic_id,
+            post_id=st.session_state.post_id,
+            template_description=image_template.strip() or None,
+            hero_copy=hero_for_image.strip() or None,
+            count=int(n_candidates),
+        )
+    if st.session_state.job_image:
+        job_progress("image", "Generating image")
+    candidates = [p for p in st.session_state.image_candidates if Path(p).exists()]
+    if not st.session_state.image_path and candidates:
+        st.caption(f"{len(candidates)} candidate(s) — pick one:")
+        cols = st.columns(min(len(candidates), 2))
+        for i, cand in enumerate(candidates):
+            with cols[i % len(cols)]:
+                st.image(str(image_store.preview(cand)), use_container_width=True)
+                if st.button(f"Use #{i + 1}", key=f"use_candidate_{i}"):
+                    st.session_state.image_path = Path(cand)
+                    st.session_state.image_approved = False
+                    st.rerun()
     if st.session_state.image_path and Path(st.session_state.image_path).exists():
-        st.image(str(st.session_state.image_path), use_container_width=True)
+        st.image(str(image_store.preview(st.session_state.image_path)), use_container_width=True)
         a, b = st.columns(2)
         with a:
             if st.button("✅ Approve image"):
                 st.session_state.image_approved = True
+                topic_store.set_image_approved(str(st.session_state.image_path))
                 st.success("Image approved.")
         with b:
             if st.button("🔄 Regenerate image"):
+                # Rejected: fall back to the other candidates from the same call, if any
+                st.session_state.image_candidates = [
+                    p for p in candidates if p != str(st.session_state.image_path)
+                ]
                 st.session_state.image_path = None
                 st.rerun()
 else:
@@ -180,10 +526,46 @@ if st.session_state.content:
 if st.session_state.image_path:
     st.write("**Image:**", str(st.session_state.image_path))
 
+with st.expander("⏱️ Session performance"):
+    perf = metrics.session_summary(st.session_state.session_id)
+    if perf["stages"]:
+        rows = [
+            "| Stage | Calls | Seconds | Tokens in/out | Bytes | Retries | Errors |",
+            "|---|---:|---:|---:|---:|---:|---:|",
+        ]
+        for r in perf["stages"]:
+            rows.append(
+                f"| `{r['stage']}` | {r['calls']} | {r['seconds']:.2f} | {r['tokens_in']}/{r['tokens_out']} "
+                f"| {r['bytes']:,} | {r['retries']} | {r['errors']} |"
+            )
+        st.markdown("\n".join(rows))
+        c = perf["counters"]
+        st.caption(
+            f"Cache hits {int(c.get('cache_hits', 0))} / misses {int(c.get('cache_misses', 0))} · "
+            f"API retries {int(c.get('api_retries', 0))} · throttled {int(c.get('api_throttled', 0))}. "
+            "job.* rows include the stages they ran."
+        )
+    else:
+        st.caption("No API work in this session yet.")
+    models = resilience.status()
+    if models:
+        rows = [
+            "| Gemini model | Breaker | Error rate | Calls | Errors | Fallbacks | Hedges (won) | p95 ms |",
+            "|---|---|---:|---:|---:|---:|---:|---:|",
+        ]
+        for m in models:
+            rows.append(
+                f"| `{m['model']}` | {m['state']} | {m['error_rate']:.0%} | {m['calls']} | {m['errors']} "
+                f"| {m['fallbacks']} | {m['hedges']} ({m['hedge_wins']}) | {m['p95_ms'] or '—'} |"
+            )
+        st.markdown("\n".join(rows))
+        st.caption("Model rows cover every session in this app process.")
+    st.caption(f"Full trace: {TRACE_FILE} · Prometheus metrics: {METRICS_FILE}")
+
 with st.expander("Setup (API keys)"):
     st.code("""
 # Copy .env.example to .env and set:
 GEMINI_API_KEY=...      # Topics, LinkedIn post, and images (Gemini)
 TAVILY_API_KEY=tvly-... # Web search for recent topics (day/week/month)
     """)
-    st.caption("Topics are stored in data/topics.xlsx. Run: streamlit run app.py")
+    st.caption("Topics, posts and images are stored in data/topics.sqlite (Excel is an on-demand export). Run: streamlit run app.py")
@@ -0,0 +1,153 @@
+"""
+Headless batch run: trending topics (Tavily + Gemini, or a saved run) → post → image for every topic.
+Usage:
+    python batch.py --count 20 --recency week
+    python batch.py --from-latest --post-concurrency 6 --image-concurrency 2
+    python batch.py --export history.xlsx --since 2026-01-01 --niche VLSI --approved
+"""
+import argparse
+import sys
+import time
+from datetime import date
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from config import (
+    GEMINI_API_KEY,
+    METRICS_FILE,
+    PIPELINE_IMAGE_CONCURRENCY,
+    PIPELINE_POST_CONCURRENCY,
+    TRACE_FILE,
+)
+from services.topics import DEFAULT_NICHES, mark_sources_seen, search_trending_topics
+from services.excel_store import HISTORY_FORMATS, load_topics_from_excel, save_history_export
+from services import metrics, resilience, topic_store
+from services.content import generate_linkedin_content_batch
+from services.pipeline import run_pipeline
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Generate LinkedIn posts and images for a list of topics.")
+    parser.add_argument("--niche", default=DEFAULT_NICHES, help="Niche / industry for trends")
+    parser.add_argument("--count", type=int, default=10, help="Number of topics to search for")
+    parser.add_argument("--recency", default="month", choices=["day", "week", "month"])
+    parser.add_argument("--fan-out", action="store_true", help="One concurrent Tavily query per niche")
+    parser.add_argument(
+        "--allow-repeats", action="store_true", help="Keep topics that are near-duplicates of past runs"
+    )
+    parser.add_argument(
+        "--incremental", action="store_true",
+        help="Only use sources not processed before for this niche/recency; new topics join the existing pool",
+    )
+    parser.add_argument("--from-latest", action="store_true", help="Use the latest saved topic run instead of searching")
+    parser.add_argument("--from-excel", action="store_true", help="Use topics from data/topics.xlsx instead of searching")
+    parser.add_argument("--post-concurrency", type=int, default=PIPELINE_POST_CONCURRENCY)
+    parser.add_argument("--image-concurrency", type=int, default=PIPELINE_IMAGE_CONCURRENCY)
+    parser.add_argument("--no-images", action="store_true", help="Generate posts only")
+    parser.add_argument(
+        "--batch-size", type=int, default=1,
+        help="Draft posts K topics per Gemini call (system prompt sent once per batch) before the image stage",
+    )
+    parser.add_argument("--out", type=Path, default=None, help="JSONL results file (default: output/batch_<ts>.jsonl)")
+    export = parser.add_argument_group("history export (no generation)")
+    export.add_argument("--export", type=Path, default=None, help="Write all stored topics/posts/images to .xlsx or .csv")
+    export.add_argument("--since", type=date.fromisoformat, default=None, help="First day (YYYY-MM-DD)")
+    export.add_argument("--until", type=date.fromisoformat, default=None, help="Last day (YYYY-MM-DD)")
+    export.add_argument("--approved", dest="approved", action="store_const", const=True, default=None,
+                        help="Only topics with an approved image")
+    export.add_argument("--unapproved", dest="approved", action="store_const", const=False,
+                        help="Only topics without an approved image")
+    args = parser.parse_args(argv)
+
+    if args.export:
+        fmt = args.export.suffix.lstrip(".").lower()
+        if fmt not in HISTORY_FORMATS:
+            parser.error(f"--export must end in .{' or .'.join(HISTORY_FORMATS)}")
+        niche = args.niche if args.niche != DEFAULT_NICHES else None
+        start = time.time()
+        path = save_history_export(args.export, start=args.since, end=args.until, niche=niche, approved=args.approved)
+        print(f"Exported history to {path} ({path.stat().st_size / 1024:.0f} KB, {time.time() - start:.1f}s)")
+        return 0
+
+    if not GEMINI_API_KEY:
+        print("GEMINI_API_KEY is not set in .env", file=sys.stderr)
+        return 1
+
+    if args.from_latest:
+        topics = topic_store.load_run()
+    elif args.from_excel:
+        topics = load_topics_from_excel()
+        topic_store.save_run(topics, niche="imported from Excel")
+    else:
+        sources = []
+        topics = search_trending_topics(
+            niche=args.niche, count=args.count, recency=args.recency, fan_out=args.fan_out,
+            dedupe=not args.allow_repeats, incremental=args.incremental, seen_sources=sources,
+        )
+        if args.incremental:
+            # Only the new topics go through the pipeline; they keep their place in the merged pool
+            topic_store.merge_into_run(topics, niche=args.niche, recency=args.recency)
+            mark_sources_seen(args.niche, args.recency, sources)
+        elif topics:
+            # An empty run is not saved: it would become the latest run (--from-latest, the app's list)
+            topic_store.save_run(topics, niche=args.niche, recency=args.recency)
+    if topics and topics[0].get("fallback"):
+        print(f"Warning: {topics[0]['fallback']}; using raw web headlines as topics.", file=sys.stderr)
+    if not topics:
+        if args.incremental:
+            print("No new sources since the last refresh.")
+            return 0
+        if not (args.from_latest or args.from_excel or args.allow_repeats):
+            print("No new topics: every candidate was a near-duplicate of a past topic (try --allow-repeats).")
+            return 0
+        print("No topics to process.", file=sys.stderr)
+        return 1
+
+    start = time.time()
+    total = len(topics)
+    if args.batch_size > 1:
+        # Batched drafts land in the post cache; the pipeline below then streams them back instantly
+        titles = [str(t.get("title", t)) for t in topics]
+        for i in range(0, len(titles), args.batch_size):
+            try:
+                generate_linkedin_content_batch(titles[i:i + args.batch_size])
+            except Exception as e:
+                print(f"Batch {i // args.batch_size + 1} failed ({e}); falling back to per-topic calls", file=sys.stderr)
+        print(f"Drafted {total} posts in batches of {args.batch_size} ({time.time() - start:.1f}s)", flush=True)
+    done = []
+
+    topic_ids = {str(t.get("title", t)): t.get("id") for t in topics}
+
+    def report(row):
+        done.append(row)
+        topic_id = topic_ids.get(row["title"])
+        if topic_id and row["content"]:
+            post_id = topic_store.add_post(topic_id, row["content"])
+            if row["image_path"]:
+                topic_store.add_image(topic_id, row["image_path"], post_id=post_id)
+        status = f"ERROR {row['error']}" if row["error"] else (row["image_path"] or "post only")
+        print(f"[{len(done)}/{total}] {time.time() - start:6.1f}s  {row['title'][:60]}  →  {status}", flush=True)
+
+    results = run_pipeline(
+        topics,
+        post_concurrency=args.post_concurrency,
+        image_concurrency=args.image_concurrency,
+        with_images=not args.no_images,
+        out_path=args.out,
+        on_result=report,
+    )
+    failed = sum(1 for r in results if r["error"])
+    print(f"Done: {total - failed}/{total} succeeded in {time.time() - start:.1f}s")
+    for m in resilience.status():
+        print(
+            f"Gemini {m['model']}: breaker {m['state']}, {m['calls']} calls, {m['errors']} errors, "
+            f"{m['fallbacks']} fallbacks, hedges {m['hedges']} (won {m['hedge_wins']}), p95 {m['p95_ms']}ms"
+        )
+    metrics.export_prometheus()
+    print(f"Trace: {TRACE_FILE}  Metrics: {METRICS_FILE}")
+    return 1 if failed == total else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
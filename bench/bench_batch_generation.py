@@ -0,0 +1,95 @@
+"""
+Batched vs per-topic post generation: wall time and Gemini tokens (from usage_metadata).
+Needs GEMINI_API_KEY (live calls, cache bypassed). Topics come from the latest saved run,
+or a built-in sample list if the store is empty.
+Usage:
+    python bench/bench_batch_generation.py --topics 6 --batch-size 3
+    python bench/bench_batch_generation.py --topics 6 --batch-size 6 --json
+"""
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from config import GEMINI_API_KEY, PIPELINE_POST_CONCURRENCY
+from services import topic_store
+from services.content import generate_linkedin_content, generate_linkedin_content_batch, usage_totals
+
+SAMPLE_TOPICS = [
+    "Agentic AI moves from pilots to production workflows in IT services",
+    "Chiplet-based designs reshape VLSI verification effort",
+    "Edge AI on microcontrollers: what embedded teams need to relearn",
+    "Generative AI copilots and the future of code review",
+    "Why semiconductor supply chains now drive AI roadmaps",
+    "Small language models for on-device enterprise assistants",
+    "Digital transformation budgets shift toward AI operations",
+    "Upskilling engineers for autonomous system safety",
+]
+
+
+def _measure(fn):
+    before = usage_totals()
+    start = time.perf_counter()
+    out = fn()
+    wall = time.perf_counter() - start
+    after = usage_totals()
+    return out, {
+        "wall_s": round(wall, 2),
+        "calls": after["calls"] - before["calls"],
+        "prompt_tokens": after["prompt_tokens"] - before["prompt_tokens"],
+        "output_tokens": after["output_tokens"] - before["output_tokens"],
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--topics", type=int, default=6)
+    parser.add_argument("--batch-size", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=PIPELINE_POST_CONCURRENCY,
+                        help="Parallel per-topic calls (0 = sequential)")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+
+    if not GEMINI_API_KEY:
+        print("GEMINI_API_KEY is not set in .env", file=sys.stderr)
+        return 1
+
+    titles = [t["title"] for t in topic_store.load_run()] or SAMPLE_TOPICS
+    titles = (titles * ((args.topics // len(titles)) + 1))[: args.topics]
+
+    def per_topic():
+        if args.concurrency <= 0:
+            return [generate_linkedin_content(t, use_cache=False) for t in titles]
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            return list(pool.map(lambda t: generate_linkedin_content(t, use_cache=False), titles))
+
+    def batched():
+        out = []
+        for i in range(0, len(titles), args.batch_size):
+            out.extend(generate_linkedin_content_batch(titles[i:i + args.batch_size], use_cache=False))
+        return out
+
+    _, single = _measure(per_topic)
+    records, batch = _measure(batched)
+    batch["fallbacks"] = sum(1 for r in records if not r["batched"])
+
+    report = {"topics": len(titles), "batch_size": args.batch_size, "per_topic": single, "batched": batch}
+    if args.json:
+        print(json.dumps(report))
+    else:
+        print(f"{len(titles)} topics, batch size {args.batch_size}")
+        for name, r in (("per-topic", single), ("batched", batch)):
+            print(
+                f"  {name:>9}: {r['wall_s']:6.2f}s  calls={r['calls']:<3} "
+                f"prompt_tokens={r['prompt_tokens']:<6} output_tokens={r['output_tokens']}"
+                + (f"  fallbacks={r['fallbacks']}" if "fallbacks" in r else "")
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
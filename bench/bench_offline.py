@@ -0,0 +1,190 @@
+"""
+Offline benchmark suite: drives search_trending_topics, generate_linkedin_content, generate_linkedin_variants
+(3 candidates), generate_post_image and run_pipeline against bench/stub_server.py (no keys, no network) and
+reports p50/p95 latency, throughput and memory per scenario. Data and images go to a temporary directory.
+Usage:
+    python bench/bench_offline.py
+    python bench/bench_offline.py --time-scale 0.05 --iterations 20 --concurrency 4 --json > base.json
+    python bench/bench_offline.py --throttle-rate 0.1 --baseline base.json --tolerance 0.25
+Exits 1 if a scenario fails, or if --baseline is given and a p50/p95 regressed beyond the tolerance.
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "bench"))
+
+from stub_server import StubConfig, start_in_thread  # noqa: E402
+
+SCENARIOS = ("search", "post", "variants", "image", "pipeline")
+
+
+def _pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def _configure_env(base_url: str, workdir: Path, time_scale: float, real_limits: bool) -> None:
+    """Must run before config / services are imported: they read the environment at import time."""
+    os.environ.update(
+        TAVILY_API_BASE_URL=base_url,
+        GEMINI_API_BASE_URL=base_url,
+        TAVILY_API_KEY="stub-key",
+        GEMINI_API_KEY="stub-key",
+        DATA_DIR=str(workdir / "data"),
+        OUTPUT_DIR=str(workdir / "output"),
+        RETRY_BASE_DELAY=str(max(0.01, time_scale)),
+    )
+    if not real_limits:
+        # Measure our code, not the configured quotas
+        for name in ("GEMINI_CHAT", "IMAGEN", "TAVILY"):
+            os.environ[f"{name}_RPM"] = "1000000"
+            os.environ[f"{name}_CONCURRENCY"] = "64"
+
+
+def _run(fn, iterations: int, concurrency: int):
+    """Run fn(i) iterations times on `concurrency` threads; returns (latencies, wall, peak_bytes, errors)."""
+    latencies, errors = [], []
+
+    def one(i):
+        start = time.perf_counter()
+        try:
+            fn(i)
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+            return
+        latencies.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        list(pool.map(one, range(iterations)))
+    wall = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return latencies, wall, peak, errors
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Comma-separated subset of {SCENARIOS}")
+    parser.add_argument("--iterations", type=int, default=12, help="Calls per scenario (pipeline: topics per run)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent callers per scenario")
+    parser.add_argument("--time-scale", type=float, default=0.1, help="Stub latency multiplier (1.0 = realistic)")
+    parser.add_argument("--throttle-rate", type=float, default=None, help="Inject 429s with this probability")
+    parser.add_argument("--error-rate", type=float, default=None, help="Inject 503s with this probability")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--real-limits", action="store_true", help="Keep the configured rate limits (API_LIMITS)")
+    parser.add_argument("--baseline", type=Path, default=None, help="Earlier --json report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed p50/p95 slowdown vs baseline (0.25 = 25%%)")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    stub = StubConfig(time_scale=args.time_scale, throttle_rate=args.throttle_rate,
+                      error_rate=args.error_rate, seed=args.seed)
+    server, base_url = start_in_thread(stub)
+    workdir = Path(tempfile.mkdtemp(prefix="lcm-bench-"))
+    _configure_env(base_url, workdir, args.time_scale, args.real_limits)
+
+    import warnings
+    warnings.filterwarnings("ignore")
+    from services.content import generate_linkedin_content, generate_linkedin_variants
+    from services.image_gen import generate_post_image
+    from services.pipeline import run_pipeline
+    from services.topics import search_trending_topics
+
+    topics = [t["title"] for t in json.loads(
+        json.loads((stub.fixtures_dir / "gemini_topics.json").read_text())["candidates"][0]["content"]["parts"][0]["text"]
+    )]
+
+    def image(i):
+        path, err = generate_post_image(topics[i % len(topics)], hero_copy="Production AI is won by evaluation")
+        if err:
+            raise RuntimeError(err)
+
+    def pipeline(i):
+        items = [{"title": f"{topics[j % len(topics)]} ({i}.{j})"} for j in range(args.iterations)]
+        run_pipeline(items, post_concurrency=args.concurrency, image_concurrency=max(1, args.concurrency // 2),
+                     out_path=workdir / f"pipeline_{i}.jsonl")
+
+    runs = {
+        "search": (lambda i: search_trending_topics("AI, VLSI, Embedded", count=10, use_cache=False, dedupe=False),
+                   args.iterations, args.concurrency),
+        "post": (lambda i: generate_linkedin_content(topics[i % len(topics)], use_cache=False),
+                 args.iterations, args.concurrency),
+        # Three ranked captions in one call (compare with three "post" calls)
+        "variants": (lambda i: generate_linkedin_variants(topics[i % len(topics)], n=3, use_cache=False),
+                     args.iterations, args.concurrency),
+        "image": (image, args.iterations, args.concurrency),
+        # One pipeline run over `iterations` topics; repeated 3 times for a latency spread
+        "pipeline": (pipeline, 3, 1),
+    }
+
+    report = {"time_scale": args.time_scale, "concurrency": args.concurrency, "scenarios": {}}
+    failed = False
+    for name in scenarios:
+        fn, iterations, concurrency = runs[name]
+        if name != "pipeline":
+            try:
+                fn(0)  # warm-up: lazy imports, client setup, pooled connections
+            except Exception:
+                pass
+        latencies, wall, peak, errors = _run(fn, iterations, concurrency)
+        units = iterations * (args.iterations if name == "pipeline" else 1)
+        report["scenarios"][name] = {
+            "calls": iterations,
+            "errors": len(errors),
+            "p50_ms": round(_pct(latencies, 50) * 1000, 1) if latencies else None,
+            "p95_ms": round(_pct(latencies, 95) * 1000, 1) if latencies else None,
+            "throughput_per_s": round(units / wall, 2) if wall else None,
+            "peak_alloc_mb": round(peak / 1e6, 1),
+        }
+        if errors:
+            failed = True
+            report["scenarios"][name]["first_error"] = errors[0][:300]
+    report["max_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    report["stub"] = dict(stub.stats)
+    server.shutdown()
+
+    regressions = []
+    if args.baseline:
+        base = json.loads(args.baseline.read_text()).get("scenarios", {})
+        for name, cur in report["scenarios"].items():
+            for key in ("p50_ms", "p95_ms"):
+                old, new = (base.get(name) or {}).get(key), cur.get(key)
+                if old and new and new > old * (1 + args.tolerance):
+                    regressions.append(f"{name} {key}: {old} -> {new}")
+        report["regressions"] = regressions
+
+    if args.json:
+        print(json.dumps(report))
+    else:
+        print(f"stub time scale {args.time_scale}, concurrency {args.concurrency}, data in {workdir}")
+        for name, r in report["scenarios"].items():
+            print(
+                f"  {name:>8}: p50={r['p50_ms']}ms p95={r['p95_ms']}ms "
+                f"throughput={r['throughput_per_s']}/s peak_alloc={r['peak_alloc_mb']}MB errors={r['errors']}"
+                + (f"  ({r['first_error']})" if r.get("first_error") else "")
+            )
+        print(f"  max RSS {report['max_rss_mb']}MB; stub: {report['stub']}")
+        for line in regressions:
+            print(f"  REGRESSION {line}")
+    return 1 if failed or regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+"""
+Startup / rerun timing for the Streamlit app (no API keys needed, no network).
+Measures, each in a fresh interpreter:
+  - import: cold import of config + services modules the app loads at startup
+  - first run: first script execution of app.py (what a new session / container cold start pays)
+  - rerun: p50/p95 of subsequent script reruns (what every widget click pays)
+Usage:
+    python bench/bench_startup.py
+    python bench/bench_startup.py --runs 5 --reruns 30 --json
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+_IMPORT_SNIPPET = """
+import time, sys
+sys.path.insert(0, {root!r})
+t = time.perf_counter()
+import config, services.topic_store, services.content, services.image_gen, services.pipeline
+print(time.perf_counter() - t)
+"""
+
+_APP_SNIPPET = """
+import json, time, sys, warnings
+warnings.filterwarnings("ignore")
+import logging; logging.disable(logging.WARNING)
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file({app!r}, default_timeout=60)
+t = time.perf_counter(); at.run(); first = time.perf_counter() - t
+reruns = []
+for _ in range({reruns}):
+    t = time.perf_counter(); at.run(); reruns.append(time.perf_counter() - t)
+print(json.dumps({{"first": first, "reruns": reruns, "errors": len(at.exception)}}))
+"""
+
+
+def _python(code: str) -> str:
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return out.stdout.strip().splitlines()[-1]
+
+
+def _pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3, help="Fresh interpreters per measurement")
+    parser.add_argument("--reruns", type=int, default=20, help="Reruns per interpreter")
+    parser.add_argument("--json", action="store_true", help="Print machine-readable JSON")
+    args = parser.parse_args(argv)
+
+    imports, firsts, reruns, errors = [], [], [], 0
+    for _ in range(args.runs):
+        imports.append(float(_python(_IMPORT_SNIPPET.format(root=str(ROOT)))))
+        res = json.loads(_python(_APP_SNIPPET.format(app=str(ROOT / "app.py"), reruns=args.reruns)))
+        firsts.append(res["first"])
+        reruns.extend(res["reruns"])
+        errors += res["errors"]
+
+    report = {
+        "import_ms": round(statistics.median(imports) * 1000, 1),
+        "first_run_ms": round(statistics.median(firsts) * 1000, 1),
+        "rerun_p50_ms": round(_pct(reruns, 50) * 1000, 1),
+        "rerun_p95_ms": round(_pct(reruns, 95) * 1000, 1),
+        "app_errors": errors,
+    }
+    if args.json:
+        print(json.dumps(report))
+    else:
+        for k, v in report.items():
+            print(f"{k:>14}: {v}")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,402 @@
+"""
+Local stand-ins for the Tavily search, Gemini generateContent / streamGenerateContent and Imagen :predict
+endpoints, replaying fixture payloads (bench/fixtures) with configurable latency and 429 / 5xx injection.
+Point the app at it with TAVILY_API_BASE_URL and GEMINI_API_BASE_URL (any non-empty API keys work).
+Usage:
+    python bench/stub_server.py --port 8765
+    python bench/stub_server.py --port 8765 --time-scale 0.1 --throttle-rate 0.05
+    python bench/stub_server.py --port 8765 --record   # forward to the real APIs and save fixtures
+Then e.g.:
+    TAVILY_API_BASE_URL=http://127.0.0.1:8765 GEMINI_API_BASE_URL=http://127.0.0.1:8765 streamlit run app.py
+"""
+import argparse
+import base64
+import json
+import math
+import os
+import random
+import re
+import struct
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+FIXTURES_DIR = Path(__file__).resolve().parent / "fixtures"
+
+TAVILY_UPSTREAM = "https://api.tavily.com"
+GEMINI_UPSTREAM = "https://generativelanguage.googleapis.com"
+
+_MODEL_PATH = re.compile(r"^/v1beta/models/(?P<model>[^/:]+):(?P<method>\w+)")
+
+
+def _png(width: int, height: int) -> bytes:
+    """Noise PNG (incompressible, so payload size is close to a real Imagen response)."""
+    raw = b"".join(b"\x00" + os.urandom(width * 3) for _ in range(height))
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", ihdr) + chunk(b"IDAT", zlib.compress(raw, 1)) + chunk(b"IEND", b"")
+
+
+class StubConfig:
+    """Fixtures + latency/fault profile shared by all request handlers."""
+
+    def __init__(
+        self,
+        fixtures_dir: Path = FIXTURES_DIR,
+        profile: Optional[Dict[str, Any]] = None,
+        time_scale: float = 1.0,
+        throttle_rate: Optional[float] = None,
+        error_rate: Optional[float] = None,
+        seed: Optional[int] = None,
+        record: bool = False,
+    ):
+        self.fixtures_dir = Path(fixtures_dir)
+        self.profile = profile or json.loads((self.fixtures_dir / "profile.json").read_text(encoding="utf-8"))
+        for name, p in self.profile.items():
+            if isinstance(p, dict):
+                if throttle_rate is not None:
+                    p["throttle_rate"] = throttle_rate
+                if error_rate is not None:
+                    p["error_rate"] = error_rate
+        self.time_scale = time_scale
+        self.record = record
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.stats: Counter = Counter()
+        self.stats_lock = threading.Lock()
+        self._png: Optional[bytes] = None
+
+    def fixture(self, name: str) -> Dict[str, Any]:
+        return json.loads((self.fixtures_dir / f"{name}.json").read_text(encoding="utf-8"))
+
+    def save_fixture(self, name: str, payload: Dict[str, Any]) -> None:
+        (self.fixtures_dir / f"{name}.json").write_text(json.dumps(payload, indent=2), encoding="utf-8")
+
+    def count(self, key: str, n: int = 1) -> None:
+        with self.stats_lock:
+            self.stats[key] += n
+
+    def latency(self, endpoint: str) -> float:
+        """Seconds to wait before responding: lognormal fitted to the profile's median and p95."""
+        p = self.profile[endpoint]
+        median = p["median_ms"] / 1000.0
+        sigma = math.log(max(p["p95_ms"], p["median_ms"] + 1) / p["median_ms"]) / 1.645
+        with self.rng_lock:
+            return self.rng.lognormvariate(math.log(median), sigma) * self.time_scale
+
+    def fault(self, endpoint: str) -> Optional[int]:
+        """429 / 503 to inject for this request, if any."""
+        p = self.profile[endpoint]
+        with self.rng_lock:
+            roll = self.rng.random()
+        if roll < p.get("throttle_rate", 0.0):
+            return 429
+        if roll < p.get("throttle_rate", 0.0) + p.get("error_rate", 0.0):
+            return 503
+        return None
+
+    def png(self) -> bytes:
+        if self._png is None:
+            p = self.profile["imagen_predict"]
+            self._png = _png(p.get("width", 1024), p.get("height", 576))
+        return self._png
+
+
+def _gemini_response(text: str, prompt_tokens: int, output_tokens: int) -> Dict[str, Any]:
+    return {
+        "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP", "index": 0}],
+        "usageMetadata": {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": output_tokens,
+            "totalTokenCount": prompt_tokens + output_tokens,
+        },
+    }
+
+
+def _response_text(payload: Dict[str, Any]) -> str:
+    parts = ((payload.get("candidates") or [{}])[0].get("content") or {}).get("parts") or []
+    return "".join(p.get("text", "") for p in parts)
+
+
+def _prompt_text(body: Dict[str, Any]) -> str:
+    return "".join(p.get("text", "") for c in body.get("contents", []) for p in c.get("parts", []))
+
+
+def _variant(post: str, i: int) -> str:
+    """
+    Candidate i of a multi-candidate reply, varied so local scoring has something to rank:
+    i % 3 == 1 drops the caption's closing question, i % 3 == 2 adds an emoji to the HERO Copy.
+    """
+    if i % 3 == 1:
+        lines = post.split("\n")
+        questions = [n for n, line in enumerate(lines) if n > 2 and line.rstrip().endswith("?")]
+        if questions:
+            del lines[questions[-1]]
+        return "\n".join(lines)
+    if i % 3 == 2:
+        return re.sub(r"(HERO Copy[^\n]*\n[^\n]+)", r"\1 🚀", post, count=1)
+    return post
+
+
+def _sections(post: str) -> Dict[str, str]:
+    """Split the fixture post into batch JSON fields by its section headers."""
+    keys = {
+        "Conversation Trigger": "conversation_trigger",
+        "LinkedIn Caption": "caption",
+        "HERO Copy": "hero_copy",
+        "Hashtags": "hashtags",
+    }
+    out, current = {}, None
+    for line in post.splitlines():
+        header = next((k for h, k in keys.items() if line.startswith(h)), None)
+        if header:
+            current = header
+            out[current] = ""
+        elif current:
+            out[current] += line + "\n"
+    return {k: v.strip() for k, v in out.items()}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "ApiStub/1.0"
+    config: StubConfig  # set on the server class by make_server
+
+    def log_message(self, format, *args):  # noqa: A002 - quiet by default
+        pass
+
+    # --- plumbing ---
+
+    def _body(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        self.config.count("bytes_in", len(raw))
+        return json.loads(raw or b"{}")
+
+    def _send_json(self, status: int, payload: Any, headers: Optional[Dict[str, str]] = None) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+        self.config.count("bytes_out", len(data))
+
+    def _fail(self, endpoint: str, status: int) -> None:
+        self.config.count(f"{endpoint}.{status}")
+        retry_after = max(1, round(self.config.time_scale))
+        if endpoint == "tavily_search":
+            self._send_json(status, {"detail": {"error": f"stub injected {status}"}}, {"Retry-After": str(retry_after)})
+            return
+        reason = "RESOURCE_EXHAUSTED" if status == 429 else "UNAVAILABLE"
+        self._send_json(
+            status,
+            {"error": {"code": status, "message": f"stub injected {status}", "status": reason}},
+            {"Retry-After": str(retry_after)},
+        )
+
+    def _begin(self, endpoint: str) -> bool:
+        """Count, wait the sampled latency, and inject faults. False if a fault response was sent."""
+        self.config.count(f"{endpoint}.requests")
+        status = self.config.fault(endpoint)
+        delay = self.config.latency(endpoint)
+        time.sleep(delay if status is None else min(delay, 0.05))
+        if status is not None:
+            self._fail(endpoint, status)
+            return False
+        return True
+
+    # --- routes ---
+
+    def do_GET(self):
+        if self.path == "/stats":
+            with self.config.stats_lock:
+                self._send_json(200, dict(self.config.stats))
+            return
+        self._send_json(404, {"error": {"code": 404, "message": "not found"}})
+
+    def do_POST(self):
+        body = self._body()
+        if self.path.split("?")[0] == "/search":
+            return self._tavily(body)
+        m = _MODEL_PATH.match(self.path)
+        if m and m["method"] == "generateContent":
+            return self._generate(body, m["model"])
+        if m and m["method"] == "streamGenerateContent":
+            return self._stream(body, m["model"])
+        if m and m["method"] == "predict":
+            return self._predict(body, m["model"])
+        self._send_json(404, {"error": {"code": 404, "message": f"no stub for {self.path}"}})
+
+    def _tavily(self, body: Dict[str, Any]) -> None:
+        if self.config.record:
+            return self._forward(TAVILY_UPSTREAM + "/search", body, "tavily_search")
+        if not self._begin("tavily_search"):
+            return
+        payload = self.config.fixture("tavily_search")
+        payload["query"] = body.get("query", "")
+        payload["results"] = payload["results"][: int(body.get("max_results") or 20)]
+        self._send_json(200, payload)
+
+    def _gemini_fixture(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """Pick and shape the fixture for this prompt: topic ideas, batched posts (JSON schema), or one post."""
+        prompt = _prompt_text(body)
+        config = body.get("generationConfig") or {}
+        if "topic ideas" in prompt:
+            payload = self.config.fixture("gemini_topics")
+            m = re.search(r"output exactly (\d+)", prompt)
+            topics = json.loads(_response_text(payload))
+            if m:
+                topics = (topics * (int(m.group(1)) // max(len(topics), 1) + 1))[: int(m.group(1))]
+            usage = payload.get("usageMetadata", {})
+            return _gemini_response(
+                json.dumps(topics), usage.get("promptTokenCount", 2000), 60 * len(topics)
+            )
+        payload = self.config.fixture("gemini_post")
+        if config.get("responseSchema") or config.get("response_schema"):
+            listing = re.findall(r"^(\d+)\. ", prompt.split("Inputs:")[-1], flags=re.M)
+            sections = _sections(_response_text(payload))
+            items = [{"topic_index": int(n), **sections} for n in listing]
+            usage = payload.get("usageMetadata", {})
+            return _gemini_response(
+                json.dumps(items),
+                usage.get("promptTokenCount", 1400) + 40 * len(items),
+                usage.get("candidatesTokenCount", 320) * len(items),
+            )
+        n = int(config.get("candidateCount") or config.get("candidate_count") or 1)
+        if n > 1:
+            usage = payload.get("usageMetadata", {})
+            text = _response_text(payload)
+            payload = _gemini_response(
+                text, usage.get("promptTokenCount", 1400), usage.get("candidatesTokenCount", 320) * n
+            )
+            payload["candidates"] = [
+                {"content": {"parts": [{"text": _variant(text, i)}], "role": "model"}, "finishReason": "STOP", "index": i}
+                for i in range(n)
+            ]
+        return payload
+
+    def _generate(self, body: Dict[str, Any], model: str) -> None:
+        if self.config.record:
+            return self._forward(f"{GEMINI_UPSTREAM}{self.path}", body, self._record_name(body))
+        if not self._begin("gemini_generate"):
+            return
+        self._send_json(200, self._gemini_fixture(body))
+
+    def _stream(self, body: Dict[str, Any], model: str) -> None:
+        """REST streaming: a JSON array written element by element with chunked transfer encoding."""
+        if self.config.record:
+            return self._forward(f"{GEMINI_UPSTREAM}/v1beta/models/{model}:generateContent", body, "gemini_post")
+        if not self._begin("gemini_stream"):
+            return
+        p = self.config.profile["gemini_stream"]
+        payload = self._gemini_fixture(body)
+        text = _response_text(payload)
+        size = max(1, int(p.get("chunk_chars", 160)))
+        pieces = [text[i:i + size] for i in range(0, len(text), size)] or [""]
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, piece in enumerate(pieces):
+            event = _gemini_response(piece, 0, 0)
+            if i == len(pieces) - 1:
+                event["usageMetadata"] = payload.get("usageMetadata", {})
+            else:
+                del event["usageMetadata"]
+                del event["candidates"][0]["finishReason"]
+            data = (("[" if i == 0 else ",\r\n") + json.dumps(event)).encode("utf-8")
+            if i == len(pieces) - 1:
+                data += b"]"
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+            self.config.count("bytes_out", len(data))
+            if i < len(pieces) - 1:
+                time.sleep(p.get("chunk_ms", 100) / 1000.0 * self.config.time_scale)
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _predict(self, body: Dict[str, Any], model: str) -> None:
+        if self.config.record:
+            return self._forward(f"{GEMINI_UPSTREAM}{self.path}", body, None)
+        if not self._begin("imagen_predict"):
+            return
+        count = int((body.get("parameters") or {}).get("sampleCount") or 1)
+        b64 = base64.b64encode(self.config.png()).decode("ascii")
+        self._send_json(200, {"predictions": [{"bytesBase64Encoded": b64, "mimeType": "image/png"}] * count})
+
+    # --- record mode ---
+
+    def _record_name(self, body: Dict[str, Any]) -> Optional[str]:
+        prompt = _prompt_text(body)
+        config = body.get("generationConfig") or {}
+        if "topic ideas" in prompt:
+            return "gemini_topics"
+        if config.get("responseSchema") or config.get("response_schema"):
+            return None  # batch responses are synthesized from gemini_post
+        return "gemini_post"
+
+    def _forward(self, url: str, body: Dict[str, Any], fixture: Optional[str]) -> None:
+        """Relay to the real API with the caller's auth headers; save successful JSON as a fixture."""
+        import requests
+        headers = {k: v for k, v in self.headers.items() if k.lower() in ("authorization", "x-goog-api-key")}
+        resp = requests.post(url.split("?")[0], json=body, headers=headers, timeout=120)
+        payload = resp.json()
+        if resp.ok and fixture:
+            self.config.save_fixture(fixture, payload)
+            self.config.count(f"recorded.{fixture}")
+        if resp.ok and "streamGenerateContent" in self.path:
+            # The client expects a streamed JSON array; a single element carries the whole reply
+            payload = [payload]
+        self._send_json(resp.status_code, payload)
+
+
+def make_server(host: str = "127.0.0.1", port: int = 0, config: Optional[StubConfig] = None) -> ThreadingHTTPServer:
+    """HTTP server bound to (host, port); port 0 picks a free one (see server.server_address)."""
+    handler = type("BoundStubHandler", (StubHandler,), {"config": config or StubConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_in_thread(config: Optional[StubConfig] = None, host: str = "127.0.0.1", port: int = 0):
+    """Start a server on a background thread; returns (server, base_url). Stop with server.shutdown()."""
+    server = make_server(host, port, config)
+    threading.Thread(target=server.serve_forever, name="api-stub", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--fixtures", type=Path, default=FIXTURES_DIR)
+    parser.add_argument("--profile", type=Path, default=None, help="Latency/fault profile JSON (default: fixtures/profile.json)")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="Multiply all latencies (0.1 = 10x faster)")
+    parser.add_argument("--throttle-rate", type=float, default=None, help="Override 429 probability for every endpoint")
+    parser.add_argument("--error-rate", type=float, default=None, help="Override 503 probability for every endpoint")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--record", action="store_true", help="Relay to the real APIs and overwrite fixtures")
+    args = parser.parse_args(argv)
+
+    profile = json.loads(args.profile.read_text(encoding="utf-8")) if args.profile else None
+    config = StubConfig(args.fixtures, profile, args.time_scale, args.throttle_rate, args.error_rate, args.seed, args.record)
+    server = make_server(args.host, args.port, config)
+    print(f"API stub on http://{args.host}:{server.server_address[1]} ({'record' if args.record else 'replay'} mode)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -5,23 +5,120 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+# Storage: "local" (this machine) or "shared" (STORAGE_SHARED_DIR, one volume mounted by every app replica)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local").strip().lower()
+# Lock files older than this (seconds) are treated as abandoned by a crashed replica (shared backend)
+STORAGE_LOCK_STALE = float(os.getenv("STORAGE_LOCK_STALE", "300"))
+
 # Paths
 BASE_DIR = Path(__file__).resolve().parent
-DATA_DIR = BASE_DIR / "data"
+STORAGE_SHARED_DIR = Path(os.getenv("STORAGE_SHARED_DIR") or BASE_DIR / "shared")
+_STATE_ROOT = STORAGE_SHARED_DIR if STORAGE_BACKEND == "shared" else BASE_DIR
+DATA_DIR = Path(os.getenv("DATA_DIR") or _STATE_ROOT / "data")
 TOPICS_EXCEL = DATA_DIR / "topics.xlsx"
-OUTPUT_DIR = BASE_DIR / "output"
+TOPICS_DB = DATA_DIR / "topics.sqlite"
+JOBS_DB = DATA_DIR / "jobs.sqlite"
+OUTPUT_DIR = Path(os.getenv("OUTPUT_DIR") or _STATE_ROOT / "output")
+CACHE_DB = DATA_DIR / "cache.sqlite"
+RATELIMIT_DB = DATA_DIR / "ratelimit.sqlite"
+# Traces and metrics describe this process, so they stay on local disk even with shared storage
+LOCAL_DATA_DIR = Path(os.getenv("LOCAL_DATA_DIR") or (BASE_DIR / "data" if STORAGE_BACKEND == "shared" else DATA_DIR))
+TRACE_FILE = LOCAL_DATA_DIR / "trace.jsonl"
+METRICS_FILE = LOCAL_DATA_DIR / "metrics.prom"
 
 # API keys
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "").strip()
 TAVILY_API_KEY = os.getenv("TAVILY_API_KEY", "").strip()
 
+# API base URLs (empty = public endpoints); point both at bench/stub_server.py to run offline
+TAVILY_API_BASE_URL = os.getenv("TAVILY_API_BASE_URL", "").strip()
+GEMINI_API_BASE_URL = os.getenv("GEMINI_API_BASE_URL", "").strip()
+
 # Gemini (chat: topics + content)
 GEMINI_CHAT_MODEL = os.getenv("GEMINI_CHAT_MODEL", "gemini-3-flash-preview")
 
 # Gemini (images: Imagen) — use imagen-4.0-generate-001 for Gemini API
 GEMINI_IMAGE_MODEL = os.getenv("GEMINI_IMAGE_MODEL", "imagen-4.0-generate-001")
 
+# Max pooled keep-alive connections per API host (shared by UI and batch threads)
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "16"))
+
+# Background job workers per app process (topic search, post and image generation)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+
+# Speculative prefetch: draft posts for the top-K listed topics, capped by a token budget (Gemini-reported usage)
+PREFETCH_TOP_K = int(os.getenv("PREFETCH_TOP_K", "3"))
+PREFETCH_TOKEN_BUDGET = int(os.getenv("PREFETCH_TOKEN_BUDGET", "5000"))
+
+# Topic shaping: Tavily snippets are ranked and compressed to this many (estimated) prompt tokens
+TOPIC_PROMPT_TOKEN_BUDGET = int(os.getenv("TOPIC_PROMPT_TOKEN_BUDGET", "2500"))
+
+# Near-duplicate suppression: new topics this similar (estimated Jaccard of title+summary shingles)
+# to any stored topic are dropped; Gemini is asked for a few extra topics to make up for them
+TOPIC_DUPLICATE_THRESHOLD = float(os.getenv("TOPIC_DUPLICATE_THRESHOLD", "0.5"))
+
+# Batch pipeline: concurrent calls per stage (chat and Imagen have separate quotas)
+PIPELINE_POST_CONCURRENCY = int(os.getenv("PIPELINE_POST_CONCURRENCY", "4"))
+PIPELINE_IMAGE_CONCURRENCY = int(os.getenv("PIPELINE_IMAGE_CONCURRENCY", "2"))
+
+# Response cache for generated posts (seconds / max stored responses)
+CONTENT_CACHE_TTL = int(os.getenv("CONTENT_CACHE_TTL", str(7 * 24 * 3600)))
+CONTENT_CACHE_MAX_ENTRIES = int(os.getenv("CONTENT_CACHE_MAX_ENTRIES", "1000"))
+
+# Image store: disk budget for generated images (unapproved ones evicted LRU; 0 = unlimited), UI preview width
+IMAGE_DISK_BUDGET_MB = float(os.getenv("IMAGE_DISK_BUDGET_MB", "500"))
+IMAGE_PREVIEW_WIDTH = int(os.getenv("IMAGE_PREVIEW_WIDTH", "640"))
+
+# Tavily search cache: TTL (seconds) follows the recency window
+TAVILY_CACHE_TTL = {
+    "day": int(os.getenv("TAVILY_CACHE_TTL_DAY", "900")),
+    "week": int(os.getenv("TAVILY_CACHE_TTL_WEEK", "3600")),
+    "month": int(os.getenv("TAVILY_CACHE_TTL_MONTH", str(3 * 3600))),
+    "year": int(os.getenv("TAVILY_CACHE_TTL_YEAR", str(24 * 3600))),
+}
+
+# Max concurrent Tavily searches when fanning out one query per niche
+TAVILY_MAX_CONCURRENCY = int(os.getenv("TAVILY_MAX_CONCURRENCY", "4"))
+
+# Shared rate limits per API key (requests/minute, max in-flight); adapted down on 429/503
+API_LIMITS = {
+    "gemini_chat": {
+        "rpm": int(os.getenv("GEMINI_CHAT_RPM", "60")),
+        "concurrency": int(os.getenv("GEMINI_CHAT_CONCURRENCY", "8")),
+    },
+    "imagen": {
+        "rpm": int(os.getenv("IMAGEN_RPM", "10")),
+        "concurrency": int(os.getenv("IMAGEN_CONCURRENCY", "2")),
+    },
+    "tavily": {
+        "rpm": int(os.getenv("TAVILY_RPM", "100")),
+        "concurrency": int(os.getenv("TAVILY_CONCURRENCY", "4")),
+    },
+}
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "5"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "1.0"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "60"))
+
+# Per-request Gemini chat timeout (seconds); retries are ours (call_with_retry), not the SDK's
+GEMINI_REQUEST_TIMEOUT = float(os.getenv("GEMINI_REQUEST_TIMEOUT", "120"))
+# Gemini chat tail latency: optional hedged requests (duplicate sent after the observed p95 latency)
+GEMINI_HEDGE = os.getenv("GEMINI_HEDGE", "0").strip().lower() in ("1", "true", "yes", "on")
+GEMINI_HEDGE_PERCENTILE = float(os.getenv("GEMINI_HEDGE_PERCENTILE", "95"))
+GEMINI_HEDGE_MIN_DELAY = float(os.getenv("GEMINI_HEDGE_MIN_DELAY", "1.0"))
+# Per-model circuit breaker: open past this error rate over the last WINDOW calls, retry after COOLDOWN seconds;
+# while open, calls go to GEMINI_FALLBACK_MODEL (empty = fail fast)
+GEMINI_FALLBACK_MODEL = os.getenv("GEMINI_FALLBACK_MODEL", "").strip()
+GEMINI_BREAKER_ERROR_RATE = float(os.getenv("GEMINI_BREAKER_ERROR_RATE", "0.5"))
+GEMINI_BREAKER_MIN_CALLS = int(os.getenv("GEMINI_BREAKER_MIN_CALLS", "4"))
+GEMINI_BREAKER_WINDOW = int(os.getenv("GEMINI_BREAKER_WINDOW", "20"))
+GEMINI_BREAKER_COOLDOWN = float(os.getenv("GEMINI_BREAKER_COOLDOWN", "60"))
+
+# Tracing: per-stage spans appended to TRACE_FILE (rotated past TRACE_MAX_BYTES) and counters in METRICS_FILE
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "1").strip().lower() not in ("0", "false", "no", "off")
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(20 * 1024 * 1024)))
+
 
 def ensure_dirs():
     DATA_DIR.mkdir(parents=True, exist_ok=True)
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    LOCAL_DATA_DIR.mkdir(parents=True, exist_ok=True)
@@ -1,12 +1,29 @@
-from .topics import search_trending_topics
-from .excel_store import save_topics_to_excel, load_topics_from_excel
-from .content import generate_linkedin_content
-from .image_gen import generate_post_image
-
-__all__ = [
-    "search_trending_topics",
-    "save_topics_to_excel",
-    "load_topics_from_excel",
-    "generate_linkedin_content",
-    "generate_post_image",
-]
+"""Service layer. Submodules are imported lazily on first attribute access to keep app cold start light."""
+from importlib import import_module
+
+_EXPORTS = {
+    "search_trending_topics": "topics",
+    "save_topics_to_excel": "excel_store",
+    "load_topics_from_excel": "excel_store",
+    "export_topics_excel": "excel_store",
+    "export_history": "excel_store",
+    "generate_linkedin_content": "content",
+    "stream_linkedin_content": "content",
+    "parse_sections": "content",
+    "generate_linkedin_variants": "content",
+    "score_post": "content",
+    "generate_post_image": "image_gen",
+    "generate_post_images": "image_gen",
+    "run_pipeline": "pipeline",
+    "generate_post_and_image": "pipeline",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        value = getattr(import_module(f".{_EXPORTS[name]}", __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
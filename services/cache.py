@@ -0,0 +1,174 @@
+"""Response cache: in-memory LRU in front of a persistent SQLite store, with TTL and size eviction."""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+import sys
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from config import CACHE_DB
+from . import metrics, storage
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache (namespace, accessed);
+"""
+
+
+def make_key(*parts: Any) -> str:
+    """Stable content hash of the given JSON-serializable parts."""
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()[:16]
+
+
+class ResponseCache:
+    """
+    Two-level cache for JSON-serializable values.
+    Memory LRU holds up to memory_entries; the SQLite store keeps up to max_entries per namespace
+    (least recently used evicted first). Entries older than ttl seconds are treated as missing.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        ttl: float,
+        max_entries: int = 1000,
+        memory_entries: int = 128,
+        db_path: Path = CACHE_DB,
+    ):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.db_path = Path(db_path)
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = storage.connect(self.db_path)
+        if not self._ready:
+            conn.executescript(_SCHEMA)
+            self._ready = True
+        return conn
+
+    def _remember(self, key: str, created: float, value: Any) -> None:
+        with self._lock:
+            self._memory[key] = (created, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, key: str, ttl: Optional[float] = None) -> Optional[Any]:
+        """Return cached value or None if missing/expired."""
+        value = self._lookup(key, ttl)
+        metrics.incr("cache_hits" if value is not None else "cache_misses", cache=self.namespace)
+        return value
+
+    def _lookup(self, key: str, ttl: Optional[float]) -> Optional[Any]:
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        with self._lock:
+            hit = self._memory.get(key)
+            if hit is not None:
+                if now - hit[0] <= ttl:
+                    self._memory.move_to_end(key)
+                    return hit[1]
+                del self._memory[key]
+        try:
+            conn = self._connect()
+            try:
+                row = conn.execute(
+                    "SELECT value, created FROM cache WHERE namespace = ? AND key = ?",
+                    (self.namespace, key),
+                ).fetchone()
+                if row is None:
+                    return None
+                if now - row[1] > ttl:
+                    return None
+                with conn:
+                    conn.execute(
+                        "UPDATE cache SET accessed = ? WHERE namespace = ? AND key = ?",
+                        (now, self.namespace, key),
+                    )
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return None
+        value = json.loads(row[0])
+        self._remember(key, row[1], value)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        """Store value in memory and on disk; evict expired and least recently used entries."""
+        now = time.time()
+        self._remember(key, now, value)
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO cache (namespace, key, value, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                        (self.namespace, key, json.dumps(value, ensure_ascii=False), now, now),
+                    )
+                    conn.execute(
+                        "DELETE FROM cache WHERE namespace = ? AND created < ?",
+                        (self.namespace, now - self.ttl),
+                    )
+                    conn.execute(
+                        """DELETE FROM cache WHERE namespace = ? AND key IN (
+                               SELECT key FROM cache WHERE namespace = ?
+                               ORDER BY accessed DESC LIMIT -1 OFFSET ?)""",
+                        (self.namespace, self.namespace, self.max_entries),
+                    )
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            pass
+
+    @contextmanager
+    def single_flight(self, key: str, timeout: float = 120.0) -> Iterator[bool]:
+        """
+        Hold the storage lock for key while computing a missing value, so concurrent identical misses (other
+        threads, processes or replicas on shared storage) wait for the first and then re-check the cache.
+        Yields False if the lock was not obtained within timeout seconds (compute anyway).
+        """
+        # One lock file per key, deleted on release: unrelated misses never wait on each other
+        lock = storage.lock(f"cache-{self.namespace}-{key[:32]}", remove=True)
+        acquired = lock.acquire(timeout)
+        if not acquired:
+            metrics.incr("single_flight_timeouts", cache=self.namespace)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                lock.release()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._memory.pop(key, None)
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key))
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            pass
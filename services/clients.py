@@ -0,0 +1,111 @@
+"""Shared API clients: pooled HTTP sessions, cached Gemini models and Tavily client (safe to share across threads)."""
+import threading
+from functools import lru_cache
+from typing import TYPE_CHECKING, Dict
+
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from config import (
+    GEMINI_API_BASE_URL,
+    GEMINI_API_KEY,
+    GEMINI_CHAT_MODEL,
+    HTTP_POOL_SIZE,
+    TAVILY_API_BASE_URL,
+    TAVILY_API_KEY,
+)
+from . import metrics
+
+if TYPE_CHECKING:  # imported lazily at runtime (startup cost)
+    import requests
+
+_lock = threading.Lock()
+_sessions: Dict[str, "requests.Session"] = {}
+_genai_configured = False
+
+
+def get_http_session(name: str = "default") -> "requests.Session":
+    """
+    Keep-alive session with a connection pool sized for HTTP_POOL_SIZE concurrent requests.
+    One session per API name, so per-API auth headers (e.g. Tavily sets Authorization) never leak across APIs.
+    """
+    session = _sessions.get(name)
+    if session is not None:
+        return session
+    import requests
+    from requests.adapters import HTTPAdapter
+    with _lock:
+        session = _sessions.get(name)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.hooks["response"].append(_count_bytes(name))
+            _sessions[name] = session
+    return session
+
+
+def _count_bytes(api: str):
+    """Response hook: request/response body sizes go to the current span and per-API counters."""
+    def hook(resp, *args, **kwargs):
+        sent = len(resp.request.body or b"") if resp.request is not None else 0
+        received = int(resp.headers.get("Content-Length") or 0) or len(resp.content or b"")
+        metrics.add("bytes_out", sent)
+        metrics.add("bytes_in", received)
+        metrics.incr("http_bytes_sent", sent, api=api)
+        metrics.incr("http_bytes_received", received, api=api)
+        return resp
+    return hook
+
+
+def _configure_genai():
+    """genai.configure resets the SDK's cached transport, so call it once per process."""
+    global _genai_configured
+    import google.generativeai as genai
+    if not _genai_configured:
+        with _lock:
+            if not _genai_configured:
+                if GEMINI_API_BASE_URL:
+                    # Custom endpoints (e.g. the offline stub server) are only reachable over REST
+                    genai.configure(
+                        api_key=GEMINI_API_KEY,
+                        transport="rest",
+                        client_options={"api_endpoint": GEMINI_API_BASE_URL},
+                    )
+                else:
+                    genai.configure(api_key=GEMINI_API_KEY)
+                _genai_configured = True
+    return genai
+
+
+@lru_cache(maxsize=32)
+def get_chat_model(system_instruction: str, model_name: str = GEMINI_CHAT_MODEL):
+    """Cached GenerativeModel per (system prompt, model)."""
+    if not GEMINI_API_KEY:
+        raise ValueError("GEMINI_API_KEY is not set in .env")
+    genai = _configure_genai()
+    return genai.GenerativeModel(model_name, system_instruction=system_instruction)
+
+
+@lru_cache(maxsize=1)
+def get_tavily_client():
+    """Process-wide TavilyClient on its own pooled session."""
+    if not TAVILY_API_KEY:
+        raise ValueError("TAVILY_API_KEY is not set in .env")
+    try:
+        from tavily import TavilyClient
+    except ImportError:
+        raise ImportError("Install tavily-python: pip install tavily-python")
+    try:
+        return TavilyClient(
+            api_key=TAVILY_API_KEY,
+            session=get_http_session("tavily"),
+            api_base_url=TAVILY_API_BASE_URL or None,
+        )
+    except TypeError:
+        # tavily-python < 0.7 has no session / api_base_url arguments
+        client = TavilyClient(api_key=TAVILY_API_KEY)
+        if TAVILY_API_BASE_URL:
+            client.base_url = TAVILY_API_BASE_URL
+        return client
@@ -1,10 +1,25 @@
 """Gemini: generate LinkedIn post from topic (strategist prompt)."""
-from typing import Optional
+import contextvars
+import json
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 import sys
 from pathlib import Path
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
-from config import GEMINI_API_KEY, GEMINI_CHAT_MODEL
+from config import (
+    CONTENT_CACHE_MAX_ENTRIES,
+    CONTENT_CACHE_TTL,
+    GEMINI_API_KEY,
+    GEMINI_CHAT_MODEL,
+)
+from .cache import ResponseCache, make_key, text_hash
+from . import metrics
+from .ratelimit import classify_error
+from .resilience import generate_content, served_model
 
 
 SYSTEM_PROMPT = """You are a B2B thought-leadership content strategist. Based on the topic chosen, craft a draft LinkedIn caption/idea and a creative image context.
@@ -47,30 +62,525 @@ HERO Copy based on the Linkedin caption
 Hashtags
 <relevant hashtags to maximize reach and engagement>"""
 
+GENERATION_CONFIG = {"max_output_tokens": 65536, "temperature": 0.7}
+
+_cache = ResponseCache("content", ttl=CONTENT_CACHE_TTL, max_entries=CONTENT_CACHE_MAX_ENTRIES)
+
+# Running token totals from Gemini usage_metadata (this process)
+_usage = {"calls": 0, "prompt_tokens": 0, "output_tokens": 0}
+_usage_lock = threading.Lock()
+# Per-caller usage collected by track_usage() (None outside a tracked block)
+_tracked: contextvars.ContextVar = contextvars.ContextVar("content_usage", default=None)
+
+# Section headers from SYSTEM_PROMPT → result keys (matched by prefix, case-insensitive)
+SECTION_HEADERS = [
+    ("conversation_trigger", "Conversation Trigger"),
+    ("caption", "LinkedIn Caption"),
+    ("hero_copy", "HERO Copy"),
+    ("hashtags", "Hashtags"),
+]
+
+# A header starts a line with the header text (plus "based on the Linkedin caption" for HERO Copy), optionally
+# wrapped in markdown markup, and either ends the line or is followed by a colon and the section's text
+# ("**Hashtags:** #AI #VLSI"); body lines such as "Hashtags are dead." are not headers
+_HEADER_RE = re.compile(
+    r"^[#*_ \t]*(" + "|".join(re.escape(h) for _, h in SECTION_HEADERS) + r")"
+    r"(?:[ \t]*\(?[ \t]*based on the linkedin caption[ \t]*\)?)?[ \t*_]*(?::[ \t*_]*|$)",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+
+def parse_sections(text: str) -> Dict[str, str]:
+    """
+    Split a generated post into its sections.
+    Returns dict with keys: conversation_trigger, caption, hero_copy, hashtags (missing sections are "").
+    """
+    keys = {h.lower(): k for k, h in SECTION_HEADERS}
+    sections = {k: "" for k, _ in SECTION_HEADERS}
+    matches = list(_HEADER_RE.finditer(text or ""))
+    for i, m in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        body = text[m.end():end].strip().strip("*").strip()
+        sections[keys[m.group(1).lower()]] = body
+    return sections
+
+
+class SectionParser:
+    """
+    Incremental parse_sections for streamed text. A section is complete once the next
+    header arrives (or the stream ends); the trailing partial line is held back until its newline.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.sections = {k: "" for k, _ in SECTION_HEADERS}
+        self.completed: List[str] = []
+
+    def _update(self, text: str, final: bool) -> List[str]:
+        keys = {h.lower(): k for k, h in SECTION_HEADERS}
+        # Mid-stream, the last line may still grow ("Hashtags" → "Hashtags are dead."): only count finished lines
+        settled = text if final else text[: text.rfind("\n") + 1]
+        found = [keys[m.group(1).lower()] for m in _HEADER_RE.finditer(settled)]
+        self.sections = parse_sections(text)
+        done = found if final else found[:-1]
+        new = [k for k in done if k not in self.completed]
+        self.completed.extend(new)
+        return new
+
+    def feed(self, chunk: str) -> List[str]:
+        """Add streamed text; returns keys of sections that just became complete."""
+        self.text += chunk
+        return self._update(self.text[: self.text.rfind("\n") + 1], final=False)
+
+    def close(self) -> List[str]:
+        """End of stream: every section seen so far is complete."""
+        return self._update(self.text, final=True)
+
+
+# --- Local format scoring (rules from SYSTEM_PROMPT; no API call) ---
+
+CAPTION_WORDS = (100, 150)
+HERO_WORDS = (8, 14)
+# Points per check; length checks get partial credit that shrinks with the distance from the range
+SCORE_WEIGHTS = {"caption_length": 30, "hero_length": 25, "closing_question": 20, "no_emojis": 15, "sections": 10}
+
+_EMOJI_RE = re.compile("[\U0001F000-\U0001FAFF\u2600-\u27BF\u2B00-\u2BFF\uFE0F\u200D]")
+
+
+def _length_credit(n: int, bounds: Tuple[int, int]) -> float:
+    low, high = bounds
+    if low <= n <= high:
+        return 1.0
+    distance = low - n if n < low else n - high
+    return max(0.0, 1.0 - distance / (high - low))
+
+
+def score_post(text: str) -> Dict[str, Any]:
+    """
+    Score a generated post (0–100) on format compliance: caption 100–150 words, HERO Copy 8–14 words,
+    no emojis, caption ending with a question, all sections present.
+    Returns {"score", "checks": {name: passed}, "issues": [readable problems], "caption_words", "hero_words"}.
+    """
+    sections = parse_sections(text)
+    caption = sections["caption"]
+    caption_words = len(caption.split())
+    hero_words = len(sections["hero_copy"].split())
+    missing = [label for key, label in SECTION_HEADERS if not sections[key]]
+    emojis = _EMOJI_RE.findall(" ".join(sections[k] for k in ("conversation_trigger", "caption", "hero_copy")))
+    checks = {
+        "caption_length": CAPTION_WORDS[0] <= caption_words <= CAPTION_WORDS[1],
+        "hero_length": HERO_WORDS[0] <= hero_words <= HERO_WORDS[1],
+        "closing_question": caption.rstrip().rstrip("*_\"'”").endswith("?"),
+        "no_emojis": not emojis,
+        "sections": not missing,
+    }
+    credit = {
+        "caption_length": _length_credit(caption_words, CAPTION_WORDS) if caption else 0.0,
+        "hero_length": _length_credit(hero_words, HERO_WORDS) if hero_words else 0.0,
+        "closing_question": float(checks["closing_question"]),
+        "no_emojis": float(checks["no_emojis"]),
+        "sections": 1.0 - len(missing) / len(SECTION_HEADERS),
+    }
+    issues = []
+    if not checks["caption_length"]:
+        issues.append(f"Caption is {caption_words} words ({CAPTION_WORDS[0]}–{CAPTION_WORDS[1]})")
+    if not checks["hero_length"]:
+        issues.append(f"HERO Copy is {hero_words} words ({HERO_WORDS[0]}–{HERO_WORDS[1]})")
+    if not checks["closing_question"]:
+        issues.append("Caption does not end with a question")
+    if emojis:
+        issues.append(f"Contains emojis ({''.join(dict.fromkeys(emojis))})")
+    if missing:
+        issues.append(f"Missing sections: {', '.join(missing)}")
+    return {
+        "score": round(sum(SCORE_WEIGHTS[k] * credit[k] for k in SCORE_WEIGHTS)),
+        "checks": checks,
+        "issues": issues,
+        "caption_words": caption_words,
+        "hero_words": hero_words,
+    }
+
+
+def rank_variants(texts: List[str]) -> List[Dict[str, Any]]:
+    """Parse and score each post; best first (ties keep the model's order). "variant" is the 1-based original index."""
+    scored = [
+        {"variant": i, "content": text, **parse_sections(text), **score_post(text)}
+        for i, text in enumerate(texts, 1)
+    ]
+    return sorted(scored, key=lambda v: -v["score"])
+
+
+def _user_content(topic: str, extra_context: Optional[str]) -> str:
+    user_content = f"Here is the input caption/idea:\n\n{topic}"
+    if extra_context:
+        user_content += f"\n\nAdditional context: {extra_context}"
+    return user_content
+
+
+def _cache_key(topic: str, extra_context: Optional[str]) -> str:
+    return make_key(
+        GEMINI_CHAT_MODEL,
+        text_hash(SYSTEM_PROMPT),
+        topic.strip(),
+        (extra_context or "").strip(),
+        GENERATION_CONFIG,
+    )
+
+
+def _cacheable() -> bool:
+    """
+    Whether the last generate_content answer may be cached. Cache keys name GEMINI_CHAT_MODEL, so a post
+    written by GEMINI_FALLBACK_MODEL (breaker open) is not stored to be served later as the main model's.
+    """
+    model = served_model()
+    if model == GEMINI_CHAT_MODEL:
+        return True
+    metrics.incr("content_cache_skips", cache="content", model=model or "none")
+    return False
+
+
+def _record_usage(resp: Any, to_span: bool = True) -> Tuple[int, int]:
+    """Add usage_metadata to the process totals (and to the current span unless to_span=False)."""
+    tokens_in, tokens_out = metrics.add_usage(resp) if to_span else metrics.usage_tokens(resp)
+    with _usage_lock:
+        _usage["calls"] += 1
+        _usage["prompt_tokens"] += tokens_in
+        _usage["output_tokens"] += tokens_out
+    tracked = _tracked.get()
+    if tracked is not None:
+        tracked["calls"] += 1
+        tracked["prompt_tokens"] += tokens_in
+        tracked["output_tokens"] += tokens_out
+    return tokens_in, tokens_out
+
+
+@contextmanager
+def track_usage() -> Iterator[Dict[str, int]]:
+    """Collect the calls and tokens of post generation done inside the block (this thread/context only)."""
+    totals = {"calls": 0, "prompt_tokens": 0, "output_tokens": 0}
+    token = _tracked.set(totals)
+    try:
+        yield totals
+    finally:
+        _tracked.reset(token)
+
+
+def usage_totals() -> Dict[str, int]:
+    """Gemini calls and prompt/output tokens used by this process's post generation."""
+    with _usage_lock:
+        return dict(_usage)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 chars/token) for budgeting, no API call."""
+    return max(1, len(text or "") // 4)
+
+
+def get_cached_linkedin_content(topic: str, extra_context: Optional[str] = None) -> Optional[str]:
+    """Return the cached post for this topic/context, or None (no API call)."""
+    return _cache.get(_cache_key(topic, extra_context))
+
 
 def generate_linkedin_content(
     topic: str,
     extra_context: Optional[str] = None,
+    use_cache: bool = True,
 ) -> str:
     """
     Generate LinkedIn Caption + HERO Copy for the given topic/idea.
     Returns structured output: Conversation Trigger, LinkedIn Caption, HERO Copy.
+    Identical requests are served from cache; use_cache=False forces a new variant (and caches it).
+    """
+    with metrics.span("content.generate", cache="miss") as sp:
+        key = _cache_key(topic, extra_context)
+        if use_cache:
+            cached = _cache.get(key)
+            if cached:
+                sp["cache"] = "hit"
+                return cached
+
+        if not GEMINI_API_KEY:
+            raise ValueError("GEMINI_API_KEY is not set in .env")
+
+        if not use_cache:
+            return _generate_post(topic, extra_context, key, sp)
+        # Identical misses (double clicks, other replicas) wait for the first call instead of repeating it
+        with _cache.single_flight(key):
+            cached = _cache.get(key)
+            if cached:
+                sp["cache"] = "shared"
+                return cached
+            return _generate_post(topic, extra_context, key, sp)
+
+
+def _generate_post(topic: str, extra_context: Optional[str], key: str, sp: Dict[str, Any]) -> str:
+    prompt = _user_content(topic, extra_context)
+    resp = generate_content(SYSTEM_PROMPT, prompt, op="post", generation_config=GENERATION_CONFIG)
+    _record_usage(resp)
+    text = (resp.text or "").strip()
+    sp["bytes_out"] = len(prompt.encode("utf-8"))
+    sp["bytes_in"] = len(text.encode("utf-8"))
+    if text and _cacheable():
+        _cache.set(key, text)
+    return text
+
+
+def stream_linkedin_content(
+    topic: str,
+    extra_context: Optional[str] = None,
+    use_cache: bool = True,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Streaming generate_linkedin_content. Yields one event per chunk:
+    {"delta": new text, "text": text so far, "sections": parse_sections so far,
+     "completed": section keys that just became complete, "done": all complete section keys}.
+    A cached post is yielded as a single event with every section complete.
+    Recorded as a "content.stream" span with time to first chunk (first_chunk_ms).
     """
+    start, t0 = time.time(), time.perf_counter()
+    key = _cache_key(topic, extra_context)
+    parser = SectionParser()
+    if use_cache:
+        cached = _cache.get(key)
+        if cached:
+            metrics.record("content.stream", start, time.perf_counter() - t0, cache="hit")
+            completed = parser.feed(cached) + parser.close()
+            yield {
+                "delta": cached,
+                "text": cached,
+                "sections": parser.sections,
+                "completed": completed,
+                "done": list(parser.completed),
+            }
+            return
+
     if not GEMINI_API_KEY:
         raise ValueError("GEMINI_API_KEY is not set in .env")
 
-    import google.generativeai as genai
-    genai.configure(api_key=GEMINI_API_KEY)
-    model = genai.GenerativeModel(
-        GEMINI_CHAT_MODEL,
-        system_instruction=SYSTEM_PROMPT,
+    prompt = _user_content(topic, extra_context)
+    # Time until the stream opens (rate-limit wait, retries and breaker fallback included)
+    with metrics.span("content.stream_open"):
+        resp = generate_content(
+            SYSTEM_PROMPT, prompt, op="post_stream", generation_config=GENERATION_CONFIG, stream=True
+        )
+    cacheable = _cacheable()
+    first_chunk = None
+    for chunk in resp:
+        try:
+            delta = chunk.text or ""
+        except ValueError:
+            # Chunks without text parts (e.g. finish reason only)
+            continue
+        if not delta:
+            continue
+        if first_chunk is None:
+            first_chunk = time.perf_counter() - t0
+        completed = parser.feed(delta)
+        yield {
+            "delta": delta,
+            "text": parser.text,
+            "sections": parser.sections,
+            "completed": completed,
+            "done": list(parser.completed),
+        }
+
+    # Generator: the current span belongs to the consumer, so tokens go on the content.stream record instead
+    tokens_in, tokens_out = _record_usage(resp, to_span=False)
+    completed = parser.close()
+    text = parser.text.strip()
+    metrics.record(
+        "content.stream",
+        start,
+        time.perf_counter() - t0,
+        cache="miss",
+        first_chunk_ms=round((first_chunk or 0) * 1000, 1),
+        tokens_in=tokens_in,
+        tokens_out=tokens_out,
+        bytes_out=len(prompt.encode("utf-8")),
+        bytes_in=len(text.encode("utf-8")),
     )
-    user_content = f"Here is the input caption/idea:\n\n{topic}"
-    if extra_context:
-        user_content += f"\n\nAdditional context: {extra_context}"
+    if text and cacheable:
+        _cache.set(key, text)
+    yield {
+        "delta": "",
+        "text": text,
+        "sections": parser.sections,
+        "completed": completed,
+        "done": list(parser.completed),
+    }
+
+
+# --- Batched generation: K topics in one request with structured (JSON schema) output ---
+
+SECTION_KEYS = [k for k, _ in SECTION_HEADERS]
+
+BATCH_RESPONSE_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "topic_index": {"type": "integer"},
+            **{k: {"type": "string"} for k in SECTION_KEYS},
+        },
+        "required": ["topic_index", *SECTION_KEYS],
+    },
+}
 
-    resp = model.generate_content(
-        user_content,
-        generation_config={"max_output_tokens": 65536, "temperature": 0.7},
+
+def format_post(record: Dict[str, str]) -> str:
+    """Render section fields in the SYSTEM_PROMPT output format (inverse of parse_sections)."""
+    headers = {
+        "conversation_trigger": "Conversation Trigger",
+        "caption": "LinkedIn Caption",
+        "hero_copy": "HERO Copy based on the Linkedin caption",
+        "hashtags": "Hashtags",
+    }
+    return "\n\n".join(f"{headers[k]}\n{record.get(k, '').strip()}" for k in SECTION_KEYS)
+
+
+def _post_record(topic: str, text: str, batched: bool) -> Dict[str, Any]:
+    return {"topic": topic, "content": text, "batched": batched, **parse_sections(text)}
+
+
+def generate_linkedin_content_batch(
+    topics: List[str],
+    use_cache: bool = True,
+) -> List[Dict[str, Any]]:
+    """
+    Generate posts for several topics in a single Gemini call (system prompt sent once, JSON-schema output).
+    Returns one record per topic, in order: topic, content (SYSTEM_PROMPT format), conversation_trigger,
+    caption, hero_copy, hashtags, batched. Topics whose item is missing or incomplete in the batch
+    response are retried one by one with generate_linkedin_content.
+    """
+    results: List[Optional[Dict[str, Any]]] = [None] * len(topics)
+    todo = []
+    for i, topic in enumerate(topics):
+        cached = _cache.get(_cache_key(topic, None)) if use_cache else None
+        if cached:
+            results[i] = _post_record(topic, cached, batched=False)
+        else:
+            todo.append(i)
+
+    if todo:
+        if not GEMINI_API_KEY:
+            raise ValueError("GEMINI_API_KEY is not set in .env")
+        listing = "\n".join(f"{n}. {topics[i]}" for n, i in enumerate(todo, 1))
+        prompt = (
+            "Write one complete post for EACH of the following input captions/ideas, following all rules above.\n"
+            "Return a JSON array with one object per input: topic_index (the number below), "
+            "conversation_trigger, caption, hero_copy, hashtags.\n\n"
+            f"Inputs:\n{listing}"
+        )
+        items: Dict[int, Dict[str, Any]] = {}
+        cacheable = False
+        try:
+            with metrics.span("content.batch", topics=len(todo)):
+                resp = generate_content(
+                    SYSTEM_PROMPT,
+                    prompt,
+                    op="post_batch",
+                    generation_config={
+                        **GENERATION_CONFIG,
+                        "response_mime_type": "application/json",
+                        "response_schema": BATCH_RESPONSE_SCHEMA,
+                    },
+                )
+                _record_usage(resp)
+                cacheable = _cacheable()
+                parsed = json.loads(resp.text or "[]")
+                for item in parsed if isinstance(parsed, list) else []:
+                    if isinstance(item, dict) and isinstance(item.get("topic_index"), int):
+                        items[item["topic_index"]] = item
+        except ValueError:
+            # Unparseable batch: every topic falls through to the single-topic path below
+            pass
+
+        for n, i in enumerate(todo, 1):
+            item = items.get(n)
+            if item and all(str(item.get(k) or "").strip() for k in SECTION_KEYS):
+                text = format_post(item)
+                if cacheable:
+                    _cache.set(_cache_key(topics[i], None), text)
+                results[i] = _post_record(topics[i], text, batched=True)
+            else:
+                text = generate_linkedin_content(topics[i], use_cache=use_cache)
+                results[i] = _post_record(topics[i], text, batched=False)
+    return results  # type: ignore[return-value]
+
+
+# --- Variant mode: several candidate posts from one request, ranked by score_post ---
+
+MAX_VARIANTS = 4
+
+VARIANT_RESPONSE_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {k: {"type": "string"} for k in SECTION_KEYS},
+        "required": SECTION_KEYS,
+    },
+}
+
+
+def _candidate_text(candidate: Any) -> str:
+    parts = getattr(getattr(candidate, "content", None), "parts", None) or []
+    return "".join(getattr(p, "text", "") or "" for p in parts).strip()
+
+
+def _variant_texts(prompt: str, n: int) -> List[str]:
+    """n posts from one call: candidate_count, or a JSON array of posts for models without multiple candidates."""
+    try:
+        resp = generate_content(
+            SYSTEM_PROMPT, prompt, op="post_variants", generation_config={**GENERATION_CONFIG, "candidate_count": n}
+        )
+        _record_usage(resp)
+        return [t for t in (_candidate_text(c) for c in resp.candidates) if t]
+    except Exception as e:
+        if classify_error(e)[0] != 400:
+            raise
+    resp = generate_content(
+        SYSTEM_PROMPT,
+        f"{prompt}\n\nWrite {n} clearly different variants of the complete post, following all rules above. "
+        "Return a JSON array with one object per variant: conversation_trigger, caption, hero_copy, hashtags.",
+        op="post_variants",
+        generation_config={
+            **GENERATION_CONFIG,
+            "response_mime_type": "application/json",
+            "response_schema": VARIANT_RESPONSE_SCHEMA,
+        },
     )
-    return (resp.text or "").strip()
+    _record_usage(resp)
+    parsed = json.loads(resp.text or "[]")
+    return [format_post(item) for item in parsed if isinstance(item, dict)] if isinstance(parsed, list) else []
+
+
+def generate_linkedin_variants(
+    topic: str,
+    n: int = 3,
+    extra_context: Optional[str] = None,
+    use_cache: bool = True,
+) -> List[Dict[str, Any]]:
+    """
+    Variant mode of generate_linkedin_content: n candidate posts (max MAX_VARIANTS) from a single Gemini call,
+    each parsed into sections and scored locally with score_post. Returns them best first as dicts with
+    variant, content, the section keys, score, checks, issues, caption_words, hero_words.
+    Identical requests are served from cache; use_cache=False forces new variants.
+    """
+    n = max(1, min(int(n), MAX_VARIANTS))
+    with metrics.span("content.variants", variants=n, cache="miss") as sp:
+        key = make_key("variants", _cache_key(topic, extra_context), n)
+        texts = _cache.get(key) if use_cache else None
+        if texts:
+            sp["cache"] = "hit"
+        else:
+            if not GEMINI_API_KEY:
+                raise ValueError("GEMINI_API_KEY is not set in .env")
+            prompt = _user_content(topic, extra_context)
+            texts = _variant_texts(prompt, n)[:n]
+            sp["bytes_out"] = len(prompt.encode("utf-8"))
+            sp["bytes_in"] = sum(len(t.encode("utf-8")) for t in texts)
+            if texts and _cacheable():
+                _cache.set(key, texts)
+        ranked = rank_variants(texts or [])
+        sp["best_score"] = ranked[0]["score"] if ranked else None
+        return ranked
@@ -1,28 +1,158 @@
-"""Store and load trending topics in Excel."""
+"""Store and load trending topics in Excel (export format; primary storage is services.topic_store)."""
+import csv
+import tempfile
+import time
+from datetime import date, datetime, time as dtime, timedelta
+from io import BytesIO, StringIO
 from pathlib import Path
-from typing import List, Dict, Any
-
-import pandas as pd
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Union
 
 import sys
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
-from config import TOPICS_EXCEL, ensure_dirs
+from config import TOPICS_EXCEL
+from . import metrics, storage
 
 
+@metrics.timed("excel.save")
 def save_topics_to_excel(topics: List[Dict[str, Any]]) -> Path:
-    """Save topics to Excel. Creates data dir and file if needed."""
-    ensure_dirs()
+    """Save topics to Excel (written atomically: readers on other replicas never see a partial file)."""
+    import pandas as pd
     df = pd.DataFrame(topics)
     if "index" not in df.columns and df.shape[0] > 0:
         df.insert(0, "index", range(1, len(df) + 1))
-    df.to_excel(TOPICS_EXCEL, index=False, sheet_name="Trending Topics")
-    return TOPICS_EXCEL
+    buf = BytesIO()
+    df.to_excel(buf, index=False, sheet_name="Trending Topics")
+    return storage.write_bytes(TOPICS_EXCEL, buf.getvalue())
 
 
+@metrics.timed("excel.load")
 def load_topics_from_excel() -> List[Dict[str, Any]]:
     """Load topics from Excel. Returns empty list if file missing."""
     if not TOPICS_EXCEL.exists():
         return []
+    import pandas as pd
     df = pd.read_excel(TOPICS_EXCEL, sheet_name="Trending Topics")
     df = df.astype(str).where(df.notna(), "")
     return df.to_dict("records")
+
+
+@metrics.timed("excel.export")
+def export_topics_excel(run_id: Optional[int] = None) -> bytes:
+    """Build the topics workbook on demand from the topic store (default: latest run)."""
+    import pandas as pd
+    from .topic_store import load_run
+    topics = load_run(run_id)
+    df = pd.DataFrame(
+        [{k: t[k] for k in ("index", "title", "reason", "summary")} for t in topics],
+        columns=["index", "title", "reason", "summary"],
+    )
+    buf = BytesIO()
+    df.to_excel(buf, index=False, sheet_name="Trending Topics")
+    metrics.annotate(rows=len(topics), size=buf.tell())
+    return buf.getvalue()
+
+
+# Full-history export: rows stream from the topic store into a write-only workbook or CSV, never a DataFrame
+HISTORY_FORMATS = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv",
+}
+HISTORY_COLUMNS = [
+    "created", "niche", "recency", "run_id", "index", "title", "reason", "summary",
+    "post", "posts", "image", "approved",
+]
+_CHUNK_BYTES = 1024 * 1024
+DateLike = Union[date, datetime, float, None]
+
+
+def _epoch(day: DateLike, end: bool = False) -> Optional[float]:
+    """date / datetime / epoch seconds → epoch seconds (local time); a plain date as `end` includes that day."""
+    if day is None or isinstance(day, (int, float)):
+        return day
+    if isinstance(day, datetime):
+        return day.timestamp()
+    return datetime.combine(day + timedelta(days=1) if end else day, dtime.min).timestamp()
+
+
+def _history_rows(start: DateLike, end: DateLike, niche: Optional[str], approved: Optional[bool]) -> Iterator[list]:
+    from .topic_store import iter_history
+    for r in iter_history(_epoch(start), _epoch(end, end=True), niche, approved):
+        r["created"] = time.strftime("%Y-%m-%d %H:%M", time.localtime(r["created_at"]))
+        yield [r[c] for c in HISTORY_COLUMNS]
+
+
+def _csv_chunks(rows: Iterable[list]) -> Iterator[bytes]:
+    buf = StringIO()
+    buf.write("\ufeff")  # BOM: Excel otherwise reads UTF-8 CSV as ANSI
+    writer = csv.writer(buf)
+    writer.writerow(HISTORY_COLUMNS)
+    for row in rows:
+        writer.writerow(row)
+        if buf.tell() >= _CHUNK_BYTES:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue().encode("utf-8")
+
+
+def _xlsx_chunks(rows: Iterable[list]) -> Iterator[bytes]:
+    # Write-only mode streams each appended row to a temp file instead of keeping cell objects
+    from openpyxl import Workbook
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Topic History")
+    ws.append(HISTORY_COLUMNS)
+    for row in rows:
+        ws.append([ILLEGAL_CHARACTERS_RE.sub("", v) if isinstance(v, str) else v for v in row])
+    with tempfile.TemporaryFile() as f:
+        wb.save(f)
+        f.seek(0)
+        while True:
+            chunk = f.read(_CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
+
+
+def export_history(
+    fmt: str = "xlsx",
+    start: DateLike = None,
+    end: DateLike = None,
+    niche: Optional[str] = None,
+    approved: Optional[bool] = None,
+) -> Iterator[bytes]:
+    """
+    Every stored topic with its latest post, image and approval, as xlsx or csv chunks produced lazily.
+    Filters: start / end dates (inclusive), niche substring, approved True / False (None = all).
+    Memory stays constant in the size of the history; recorded as an "excel.history" span.
+    """
+    if fmt not in HISTORY_FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r} (use {', '.join(HISTORY_FORMATS)})")
+    t_start, t0 = time.time(), time.perf_counter()
+    counts = {"rows": 0, "size": 0}
+
+    def counted(rows: Iterator[list]) -> Iterator[list]:
+        for row in rows:
+            counts["rows"] += 1
+            yield row
+
+    rows = counted(_history_rows(start, end, niche, approved))
+    error = None
+    try:
+        for chunk in (_xlsx_chunks if fmt == "xlsx" else _csv_chunks)(rows):
+            counts["size"] += len(chunk)
+            yield chunk
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"[:300]
+        raise
+    finally:
+        metrics.record(
+            "excel.history", t_start, time.perf_counter() - t0, error,
+            format=fmt, rows=counts["rows"], bytes_out=counts["size"],
+        )
+
+
+def save_history_export(path: Union[str, Path], fmt: Optional[str] = None, **filters: Any) -> Path:
+    """Stream export_history to path (format from the suffix unless given), written atomically."""
+    path = Path(path)
+    return storage.write_stream(path, export_history(fmt or path.suffix.lstrip(".").lower(), **filters))
@@ -1,40 +1,35 @@
 """Image generation: Gemini Imagen from topic (REST API, no google-genai)."""
 import base64
-import time
-from io import BytesIO
 from pathlib import Path
-from typing import Optional, Tuple
-
-import requests
+from typing import List, Optional, Tuple
 
 import sys
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 from config import (
+    GEMINI_API_BASE_URL,
     GEMINI_API_KEY,
     GEMINI_IMAGE_MODEL,
-    OUTPUT_DIR,
     ensure_dirs,
 )
+from . import image_store, metrics
+from .clients import get_http_session
+from .ratelimit import call_with_retry
 
-IMAGEN_PREDICT_URL = "https://generativelanguage.googleapis.com/v1beta/models/{model}:predict"
+IMAGEN_PREDICT_URL = (
+    (GEMINI_API_BASE_URL or "https://generativelanguage.googleapis.com").rstrip("/")
+    + "/v1beta/models/{model}:predict"
+)
 
+# Imagen returns at most 4 samples per predict call
+MAX_CANDIDATES = 4
 
-def generate_post_image(
-    topic: str,
-    style: str = "professional, clean, LinkedIn-style graphic",
-    template_description: Optional[str] = None,
-    hero_copy: Optional[str] = None,
-) -> Tuple[Optional[Path], Optional[str]]:
-    """
-    Generate an image for the LinkedIn post using Gemini Imagen (REST API).
-    If template_description is provided, the image will follow that layout/style.
-    If hero_copy is provided, use it as the headline text on the image (when template allows).
-    Returns (local_file_path, None) on success, or (None, error_message).
-    """
-    if not GEMINI_API_KEY:
-        return None, "GEMINI_API_KEY is not set in .env"
 
-    ensure_dirs()
+def _build_prompt(
+    topic: str,
+    style: str,
+    template_description: Optional[str],
+    hero_copy: Optional[str],
+) -> str:
     prompt = (
         f"Create a single, professional image suitable for a LinkedIn post. "
         f"Topic/theme: {topic}. Style: {style}. "
@@ -50,6 +45,28 @@ def generate_post_image(
     if not (hero_copy and hero_copy.strip()):
         prompt += "No text overlay in the image. "
     prompt += "High quality, suitable for business audience."
+    return prompt
+
+
+@metrics.timed("image.generate")
+def generate_post_images(
+    topic: str,
+    style: str = "professional, clean, LinkedIn-style graphic",
+    template_description: Optional[str] = None,
+    hero_copy: Optional[str] = None,
+    count: int = 1,
+) -> Tuple[List[Path], Optional[str]]:
+    """
+    Generate up to `count` candidate images (max 4) in a single Imagen predict call.
+    Returns ([paths...], None) on success, or ([], error_message).
+    """
+    if not GEMINI_API_KEY:
+        return [], "GEMINI_API_KEY is not set in .env"
+
+    import requests
+    ensure_dirs()
+    count = max(1, min(int(count), MAX_CANDIDATES))
+    prompt = _build_prompt(topic, style, template_description, hero_copy)
 
     try:
         url = IMAGEN_PREDICT_URL.format(model=GEMINI_IMAGE_MODEL)
@@ -60,39 +77,63 @@ def generate_post_image(
         payload = {
             "instances": [{"prompt": prompt}],
             "parameters": {
-                "sampleCount": 1,
+                "sampleCount": count,
                 "aspectRatio": "16:9",
             },
         }
-        resp = requests.post(url, json=payload, headers=headers, timeout=60)
-        resp.raise_for_status()
-        data = resp.json()
-
-        predictions = data.get("predictions") or []
-        if not predictions:
-            return None, "No predictions in Imagen response"
 
-        pred = predictions[0]
-        # Response may have bytesBase64Encoded at top level or under "image"
-        b64 = pred.get("bytesBase64Encoded") or (pred.get("image") or {}).get("bytesBase64Encoded")
-        if not b64:
-            return None, "No image bytes in Imagen response"
+        def predict():
+            resp = get_http_session("imagen").post(url, json=payload, headers=headers, timeout=60)
+            resp.raise_for_status()
+            return resp.json()
 
-        image_bytes = base64.b64decode(b64)
-        if not image_bytes:
-            return None, "Empty image data"
+        with metrics.span("imagen.predict", count=count):
+            data = call_with_retry("imagen", predict, api_key=GEMINI_API_KEY)
 
-        safe_name = "".join(
-            c if c.isalnum() or c in " -_" else "_" for c in topic[:50]
-        )
-        fpath = OUTPUT_DIR / f"linkedin_image_{safe_name}_{int(time.time())}.png"
+        predictions = data.get("predictions") or []
+        if not predictions:
+            return [], "No predictions in Imagen response"
 
-        from PIL import Image
-        img = Image.open(BytesIO(image_bytes))
-        img.save(str(fpath), format="PNG")
-        return fpath, None
+        paths = []
+        for pred in predictions[:count]:
+            # Response may have bytesBase64Encoded at top level or under "image"
+            b64 = pred.get("bytesBase64Encoded") or (pred.get("image") or {}).get("bytesBase64Encoded")
+            if not b64:
+                continue
+            image_bytes = base64.b64decode(b64)
+            if not image_bytes:
+                continue
+            path = image_store.save_image(image_bytes)
+            if path not in paths:
+                paths.append(path)
+        if not paths:
+            return [], "No image bytes in Imagen response"
+        return paths, None
     except requests.HTTPError as e:
-        body = e.response.text if e.response else str(e)
-        return None, f"Imagen API error: {e.response.status_code} {body}"
+        if e.response is None:
+            return [], f"Imagen API error: {e}"
+        return [], f"Imagen API error: {e.response.status_code} {e.response.text}"
     except Exception as e:
-        return None, str(e)
+        return [], str(e)
+
+
+def generate_post_image(
+    topic: str,
+    style: str = "professional, clean, LinkedIn-style graphic",
+    template_description: Optional[str] = None,
+    hero_copy: Optional[str] = None,
+) -> Tuple[Optional[Path], Optional[str]]:
+    """
+    Generate an image for the LinkedIn post using Gemini Imagen (REST API).
+    If template_description is provided, the image will follow that layout/style.
+    If hero_copy is provided, use it as the headline text on the image (when template allows).
+    Returns (local_file_path, None) on success, or (None, error_message).
+    """
+    paths, err = generate_post_images(
+        topic,
+        style=style,
+        template_description=template_description,
+        hero_copy=hero_copy,
+        count=1,
+    )
+    return (paths[0] if paths else None), err
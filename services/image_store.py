@@ -0,0 +1,208 @@
+"""
+Managed image store: generated images are saved under content-hash names (identical bytes are stored once)
+with a cached WebP preview for the UI. Files are tracked in data/topics.sqlite next to the image history;
+when the store exceeds IMAGE_DISK_BUDGET_MB, the least recently used unapproved images are deleted.
+Files are written atomically through services.storage, so replicas sharing OUTPUT_DIR can save and evict.
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from io import BytesIO
+from pathlib import Path
+from typing import Dict, Optional
+
+import sys
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from config import IMAGE_DISK_BUDGET_MB, IMAGE_PREVIEW_WIDTH, OUTPUT_DIR
+from . import metrics, storage
+
+IMAGES_DIR = OUTPUT_DIR / "images"
+PREVIEWS_DIR = OUTPUT_DIR / "previews"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS image_files (
+    digest TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_image_files_accessed ON image_files (accessed_at);
+CREATE INDEX IF NOT EXISTS idx_image_files_path ON image_files (path);
+"""
+
+_PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
+# Images used within this many seconds are never evicted (candidates still on screen)
+EVICT_GRACE = 15 * 60
+# Access times are refreshed at most this often per image (a preview is shown on every rerun)
+TOUCH_INTERVAL = 60
+
+_lock = threading.Lock()
+_ready = False
+
+
+def _connect() -> sqlite3.Connection:
+    global _ready
+    from .topic_store import _connect as store_connect
+    conn = store_connect()
+    if not _ready:
+        with _lock:
+            if not _ready:
+                conn.executescript(_SCHEMA)
+                IMAGES_DIR.mkdir(parents=True, exist_ok=True)
+                PREVIEWS_DIR.mkdir(parents=True, exist_ok=True)
+                _ready = True
+    return conn
+
+
+def digest_of(image_bytes: bytes) -> str:
+    return hashlib.sha256(image_bytes).hexdigest()[:32]
+
+
+def _preview_path(digest: str, width: int) -> Path:
+    return PREVIEWS_DIR / f"{digest}_{width}.webp"
+
+
+def _make_preview(src: Path, dest: Path, width: int) -> Optional[Path]:
+    """Downscaled WebP copy of src (None if Pillow cannot read it)."""
+    try:
+        from PIL import Image
+        with Image.open(src) as img:
+            img = img.convert("RGB")
+            if img.width > width:
+                img = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+            buf = BytesIO()
+            img.save(buf, format="WEBP", quality=80, method=4)
+    except Exception:
+        return None
+    storage.write_bytes(dest, buf.getvalue())
+    return dest
+
+
+def _to_png(image_bytes: bytes) -> bytes:
+    """PNG bytes pass through; anything else (e.g. JPEG) is converted once with PIL."""
+    if image_bytes.startswith(_PNG_MAGIC):
+        return image_bytes
+    from PIL import Image
+    buf = BytesIO()
+    with Image.open(BytesIO(image_bytes)) as img:
+        img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+@metrics.timed("image.write")
+def save_image(image_bytes: bytes) -> Path:
+    """
+    Store image bytes as OUTPUT_DIR/images/<sha256>.png and build its preview.
+    Identical bytes map to the same file, so a repeat is a lookup instead of a write.
+    Enforces the disk budget afterwards. Returns the full-size path.
+    """
+    digest = digest_of(image_bytes)
+    path = IMAGES_DIR / f"{digest}.png"
+    now = time.time()
+    with closing(_connect()) as conn:
+        row = conn.execute("SELECT path FROM image_files WHERE digest = ?", (digest,)).fetchone()
+        if row and Path(row["path"]).exists():
+            metrics.annotate(size=len(image_bytes), deduplicated=True)
+            with conn:
+                conn.execute("UPDATE image_files SET accessed_at = ? WHERE digest = ?", (now, digest))
+            return Path(row["path"])
+        png = _to_png(image_bytes)
+        metrics.annotate(size=len(png), deduplicated=False, reencoded=png is not image_bytes)
+        storage.write_bytes(path, png)
+        size = len(png)
+        preview = _make_preview(path, _preview_path(digest, IMAGE_PREVIEW_WIDTH), IMAGE_PREVIEW_WIDTH)
+        if preview is not None:
+            size += preview.stat().st_size
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO image_files (digest, path, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (digest, str(path), size, now, now),
+            )
+    enforce_budget(keep=digest)
+    return path
+
+
+def preview(path, width: int = IMAGE_PREVIEW_WIDTH) -> Path:
+    """
+    WebP preview of a stored image for display (built on first use if missing) and marks the image as
+    recently used. Images outside the store, or unreadable ones, are returned as-is.
+    """
+    path = Path(path)
+    if path.parent != IMAGES_DIR:
+        return path
+    digest = path.stem
+    dest = _preview_path(digest, width)
+    if not dest.exists():
+        with metrics.span("image.preview", width=width):
+            if _make_preview(path, dest, width) is None:
+                return path
+    now = time.time()
+    with closing(_connect()) as conn, conn:
+        conn.execute(
+            "UPDATE image_files SET accessed_at = ? WHERE digest = ? AND accessed_at < ?",
+            (now, digest, now - TOUCH_INTERVAL),
+        )
+    return dest
+
+
+def _delete_files(digest: str, path: str) -> None:
+    for p in [Path(path), *PREVIEWS_DIR.glob(f"{digest}_*.webp")]:
+        try:
+            p.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def usage() -> Dict[str, int]:
+    """{"files": n, "bytes": total} for the managed store (full-size images plus previews)."""
+    with closing(_connect()) as conn:
+        row = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM image_files").fetchone()
+    return {"files": row[0], "bytes": row[1]}
+
+
+def enforce_budget(budget_mb: float = IMAGE_DISK_BUDGET_MB, keep: Optional[str] = None) -> int:
+    """
+    Delete least recently used unapproved images until the store fits budget_mb (0 disables).
+    Approved images, images used in the last EVICT_GRACE seconds and the `keep` digest are kept.
+    Returns the number of images deleted.
+    """
+    if budget_mb <= 0:
+        return 0
+    budget = int(budget_mb * 1024 * 1024)
+    lock = storage.lock("image-evict")
+    if not lock.acquire(timeout=0):
+        return 0  # another process or replica is already evicting
+    try:
+        return _evict(budget, keep)
+    finally:
+        lock.release()
+
+
+def _evict(budget: int, keep: Optional[str]) -> int:
+    with closing(_connect()) as conn:
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM image_files").fetchone()[0]
+        if total <= budget:
+            return 0
+        victims = conn.execute(
+            "SELECT digest, path, size FROM image_files "
+            "WHERE accessed_at < ? AND digest != ? "
+            "AND path NOT IN (SELECT path FROM images WHERE approved = 1) "
+            "ORDER BY accessed_at",
+            (time.time() - EVICT_GRACE, keep or ""),
+        ).fetchall()
+        evicted = []
+        for row in victims:
+            if total <= budget:
+                break
+            _delete_files(row["digest"], row["path"])
+            evicted.append(row["digest"])
+            total -= row["size"]
+        if evicted:
+            with conn:
+                conn.executemany("DELETE FROM image_files WHERE digest = ?", [(d,) for d in evicted])
+            metrics.incr("images_evicted", len(evicted))
+    return len(evicted)
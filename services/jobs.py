@@ -0,0 +1,395 @@
+"""
+Background jobs: a local worker pool over a persistent SQLite job table.
+Topic search, post and image generation run as jobs with IDs, so the UI thread never blocks;
+the UI polls status/progress/result by ID (which survives page refreshes).
+Each process heartbeats its active jobs; any process re-queues jobs whose heartbeat went stale (owner crashed,
+container recreated, replica gone) and fails them after MAX_ATTEMPTS lost runs.
+A run only writes while it still owns the job; once reclaimed, its progress() raises JobLost and it stops.
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import sys
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from config import JOB_WORKERS, JOBS_DB
+from . import metrics, storage
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress TEXT,
+    result TEXT,
+    error TEXT,
+    owner TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    heartbeat_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at);
+"""
+# Columns added after the first release (ALTER TABLE for existing job tables)
+_MIGRATIONS = {"heartbeat_at": "REAL", "attempts": "INTEGER NOT NULL DEFAULT 0"}
+
+ACTIVE = ("queued", "running")
+# Owners refresh heartbeat_at this often; jobs not refreshed for HEARTBEAT_TIMEOUT seconds are reclaimed
+HEARTBEAT_INTERVAL = 10.0
+HEARTBEAT_TIMEOUT = 60.0
+# Runs a job may lose to dead workers before it is failed instead of re-queued
+MAX_ATTEMPTS = 2
+
+# Handlers: (params, progress) -> JSON-serializable result. progress(dict) stores partial state.
+Handler = Callable[[Dict[str, Any], Callable[[Dict[str, Any]], None]], Any]
+_HANDLERS: Dict[str, Handler] = {}
+
+
+class JobLost(Exception):
+    """Raised from progress() when another process has reclaimed the job; this run stops without writing."""
+
+
+def job_handler(kind: str):
+    """Register a handler for a job kind."""
+    def register(fn: Handler) -> Handler:
+        _HANDLERS[kind] = fn
+        return fn
+    return register
+
+
+def _owner() -> str:
+    # The random part tells a restarted process apart from its predecessor (e.g. PID 1 in a container)
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    """Worker pool for this process; job state lives in SQLite so any replica/process can read it."""
+
+    def __init__(self, workers: int = JOB_WORKERS, db_path: Path = JOBS_DB):
+        self.db_path = Path(db_path)
+        self.owner = _owner()
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="job")
+        with closing(self._connect()) as conn:
+            conn.executescript(_SCHEMA)
+            columns = {r["name"] for r in conn.execute("PRAGMA table_info(jobs)")}
+            for name, decl in _MIGRATIONS.items():
+                if name not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {decl}")
+        self._recover()
+        threading.Thread(target=self._tick, name="job-heartbeat", daemon=True).start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = storage.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _tick(self) -> None:
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            try:
+                with closing(self._connect()) as conn, conn:
+                    conn.execute(
+                        f"UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND status IN ({','.join('?' * len(ACTIVE))})",
+                        (time.time(), self.owner, *ACTIVE),
+                    )
+                self._recover()
+            except sqlite3.Error:
+                pass
+
+    def _abandoned(self, row: sqlite3.Row) -> bool:
+        """True if the job's owner is gone: heartbeat stale, or a dead process on this host."""
+        if row["owner"] == self.owner:
+            return False
+        last = row["heartbeat_at"] or row["started_at"] or row["created_at"]
+        if time.time() - last > HEARTBEAT_TIMEOUT:
+            return True
+        host, _, rest = row["owner"].partition(":")
+        pid = rest.partition(":")[0]
+        return host == socket.gethostname() and pid.isdigit() and int(pid) != os.getpid() and not _pid_alive(int(pid))
+
+    def _reclaim(self, row: sqlite3.Row) -> None:
+        """Re-queue an abandoned job on this process, or fail it once it has lost MAX_ATTEMPTS runs."""
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            if row["attempts"] >= MAX_ATTEMPTS:
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ? AND owner = ?",
+                    (f"Job abandoned: its worker stopped responding {row['attempts']} times; please retry",
+                     now, row["id"], row["owner"]),
+                )
+                return
+            claimed = conn.execute(
+                "UPDATE jobs SET status = 'queued', owner = ?, started_at = NULL, heartbeat_at = ? "
+                "WHERE id = ? AND owner = ?",
+                (self.owner, now, row["id"], row["owner"]),
+            ).rowcount
+        if claimed:
+            self._pool.submit(self._run, row["id"])
+
+    def _recover(self) -> None:
+        """Reclaim queued/running jobs whose owner has died (any host: replicas and recreated containers too)."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                f"SELECT * FROM jobs WHERE status IN ({','.join('?' * len(ACTIVE))})", ACTIVE
+            ).fetchall()
+        for row in rows:
+            if self._abandoned(row):
+                self._reclaim(row)
+
+    def submit(self, kind: str, params: Dict[str, Any]) -> str:
+        """Queue a job; returns its ID immediately."""
+        if kind not in _HANDLERS:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = uuid.uuid4().hex
+        with closing(self._connect()) as conn, conn:
+            now = time.time()
+            conn.execute(
+                "INSERT INTO jobs (id, kind, params, status, owner, created_at, heartbeat_at) "
+                "VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                (job_id, kind, json.dumps(params, ensure_ascii=False), self.owner, now, now),
+            )
+        self._pool.submit(self._run, job_id)
+        return job_id
+
+    def _update(self, job_id: str, attempt: int, **fields: Any) -> bool:
+        """Write fields for this process's run `attempt` of the job; False if the job has been reclaimed since."""
+        cols = ", ".join(f"{k} = ?" for k in fields)
+        with closing(self._connect()) as conn, conn:
+            return conn.execute(
+                f"UPDATE jobs SET {cols} WHERE id = ? AND owner = ? AND attempts = ?",
+                (*fields.values(), job_id, self.owner, attempt),
+            ).rowcount > 0
+
+    def _run(self, job_id: str) -> None:
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            started = conn.execute(
+                "UPDATE jobs SET status = 'running', started_at = ?, heartbeat_at = ?, attempts = attempts + 1 "
+                "WHERE id = ? AND status = 'queued' AND owner = ?",
+                (now, now, job_id, self.owner),
+            ).rowcount
+        job = self.get(job_id) if started else None
+        if job is None:
+            return
+        attempt = job["attempts"]
+        last = [0.0]
+
+        def progress(state: Dict[str, Any], force: bool = False) -> None:
+            # Throttle writes: UI polls about once a second
+            now = time.time()
+            if force or now - last[0] >= 0.3:
+                last[0] = now
+                state_json = json.dumps(state, ensure_ascii=False, default=str)
+                if not self._update(job_id, attempt, progress=state_json, heartbeat_at=now):
+                    raise JobLost(job_id)
+
+        try:
+            # Spans recorded by the handler are attributed to the UI session that submitted the job
+            with metrics.session(job["params"].get("session_id")), metrics.span(f"job.{job['kind']}"):
+                result = _HANDLERS[job["kind"]](job["params"], progress)
+            self._update(
+                job_id,
+                attempt,
+                status="done",
+                result=json.dumps(result, ensure_ascii=False, default=str),
+                finished_at=time.time(),
+            )
+        except JobLost:
+            # Reclaimed after a stale heartbeat: the new owner's run writes the result
+            metrics.incr("jobs_lost", kind=job["kind"])
+        except Exception as e:
+            self._update(job_id, attempt, status="failed", error=f"{type(e).__name__}: {e}", finished_at=time.time())
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Job as dict (params/progress/result decoded), or None if unknown. An active job whose owner is gone
+        is reclaimed first, so pollers see it re-queued here or failed rather than "running" forever.
+        """
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is not None and row["status"] in ACTIVE and self._abandoned(row):
+            self._reclaim(row)
+            with closing(self._connect()) as conn:
+                row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        for key in ("params", "progress", "result"):
+            job[key] = json.loads(job[key]) if job[key] else None
+        return job
+
+    def list(self, status: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        with closing(self._connect()) as conn:
+            if status:
+                rows = conn.execute(
+                    "SELECT id, kind, status, error, created_at, finished_at FROM jobs WHERE status = ? "
+                    "ORDER BY created_at DESC LIMIT ?",
+                    (status, limit),
+                ).fetchall()
+            else:
+                rows = conn.execute(
+                    "SELECT id, kind, status, error, created_at, finished_at FROM jobs "
+                    "ORDER BY created_at DESC LIMIT ?",
+                    (limit,),
+                ).fetchall()
+        return [dict(r) for r in rows]
+
+
+_queue: Optional[JobQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_queue() -> JobQueue:
+    """Process-wide job queue (started on first use)."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+    return _queue
+
+
+# --- Job kinds ---
+
+@job_handler("search_topics")
+def _search_topics(params: Dict[str, Any], progress) -> Dict[str, Any]:
+    from .topics import mark_sources_seen, search_trending_topics
+    from . import topic_store
+    progress({"stage": "searching"}, force=True)
+    sources: List[Dict[str, str]] = []
+    topics = search_trending_topics(
+        niche=params["niche"],
+        count=int(params.get("count", 10)),
+        recency=params.get("recency", "month"),
+        fan_out=bool(params.get("fan_out", False)),
+        dedupe=bool(params.get("dedupe", True)),
+        incremental=bool(params.get("incremental", False)),
+        seen_sources=sources,
+    )
+    # Raw Tavily headlines stand in when Gemini shaping failed; say so instead of passing them off as shaped
+    warning = next((t["fallback"] for t in topics if t.get("fallback")), None)
+    if params.get("incremental"):
+        # New topics join the current pool for this niche; existing indices stay put
+        run_id = topic_store.merge_into_run(topics, niche=params["niche"], recency=params.get("recency", ""))
+        # Only once the topics are stored: a failed merge (or fallback headlines) leaves the sources for next time
+        mark_sources_seen(params["niche"], params.get("recency", "month"), sources)
+        return {
+            "run_id": run_id,
+            "topics": topic_store.load_run(run_id) if run_id else [],
+            "added": topics,
+            "warning": warning,
+        }
+    if not topics:
+        # Not saved: an empty run would become the latest and replace the editor's current list
+        reason = (
+            "every candidate was a near-duplicate of a past topic (tick \"Allow topics similar to past runs\")"
+            if params.get("dedupe", True) else "the web search returned nothing usable"
+        )
+        return {"run_id": None, "topics": [], "empty": f"No new topics: {reason}.", "warning": warning}
+    run_id = topic_store.save_run(topics, niche=params["niche"], recency=params.get("recency", ""))
+    return {"run_id": run_id, "topics": topics, "warning": warning}
+
+
+def _post_progress(progress):
+    return lambda ev: progress({"text": ev["text"], "sections": ev["sections"], "done": ev["done"]})
+
+
+@job_handler("generate_post")
+def _generate_post(params: Dict[str, Any], progress) -> Dict[str, Any]:
+    from .content import stream_linkedin_content
+    from . import topic_store
+    report = _post_progress(progress)
+    text = ""
+    for ev in stream_linkedin_content(params["topic"], use_cache=params.get("use_cache", True)):
+        report(ev)
+        text = ev["text"]
+    post_id = topic_store.add_post(params["topic_id"], text) if params.get("topic_id") and text else None
+    return {"content": text, "post_id": post_id}
+
+
+@job_handler("generate_variants")
+def _generate_variants(params: Dict[str, Any], progress) -> Dict[str, Any]:
+    from .content import generate_linkedin_variants
+    from . import topic_store
+    progress({"stage": f"generating {params.get('n', 3)} variants"}, force=True)
+    variants = generate_linkedin_variants(
+        params["topic"], n=int(params.get("n", 3)), use_cache=params.get("use_cache", True)
+    )
+    if not variants:
+        raise RuntimeError("Gemini returned no variants")
+    # The best-scoring variant becomes the current post; the editor can switch to another one
+    text = variants[0]["content"]
+    post_id = topic_store.add_post(params["topic_id"], text) if params.get("topic_id") else None
+    return {"content": text, "post_id": post_id, "hero_copy": variants[0]["hero_copy"], "variants": variants}
+
+
+@job_handler("generate_image")
+def _generate_image(params: Dict[str, Any], progress) -> Dict[str, Any]:
+    from .image_gen import generate_post_images
+    from . import topic_store
+    progress({"stage": "generating image"}, force=True)
+    paths, err = generate_post_images(
+        params["topic"],
+        template_description=params.get("template_description"),
+        hero_copy=params.get("hero_copy"),
+        count=int(params.get("count", 1)),
+    )
+    if err:
+        raise RuntimeError(err)
+    if params.get("topic_id"):
+        for p in paths:
+            topic_store.add_image(params["topic_id"], str(p), post_id=params.get("post_id"))
+    return {"image_paths": [str(p) for p in paths]}
+
+
+@job_handler("post_and_image")
+def _post_and_image(params: Dict[str, Any], progress) -> Dict[str, Any]:
+    from .pipeline import generate_post_and_image
+    from . import topic_store
+    out = generate_post_and_image(
+        params["topic"],
+        template_description=params.get("template_description"),
+        image_count=int(params.get("count", 1)),
+        use_cache=params.get("use_cache", True),
+        on_event=_post_progress(progress),
+    )
+    post_id = None
+    if params.get("topic_id") and out["content"]:
+        post_id = topic_store.add_post(params["topic_id"], out["content"])
+        for p in out["image_paths"]:
+            topic_store.add_image(params["topic_id"], str(p), post_id=post_id)
+    return {
+        "content": out["content"],
+        "post_id": post_id,
+        "hero_copy": out["hero_copy"],
+        "image_paths": [str(p) for p in out["image_paths"]],
+        "image_error": out["image_error"],
+    }
+
+
+@job_handler("prefetch_posts")
+def _prefetch_posts(params: Dict[str, Any], progress) -> Dict[str, Any]:
+    from .pipeline import prefetch_drafts
+    progress({"stage": "prefetching drafts"}, force=True)
+    kwargs = {k: int(params[k]) for k in ("top_k", "token_budget") if params.get(k) is not None}
+    return prefetch_drafts(params["topics"], **kwargs)
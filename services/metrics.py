@@ -0,0 +1,282 @@
+"""
+Tracing and metrics: timing spans per service call plus counters (tokens, bytes, retries, cache hits/misses).
+Finished spans are appended to a JSONL trace (TRACE_FILE) and kept in memory for per-session summaries;
+counters and span totals are exported in Prometheus text format (METRICS_FILE, refreshed as spans finish).
+Work started from the UI carries the browser session ID, so the app can show that session's breakdown.
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from config import METRICS_FILE, TRACE_ENABLED, TRACE_FILE, TRACE_MAX_BYTES, ensure_dirs
+
+# Spans kept in memory for session summaries (oldest dropped first)
+MAX_SPANS = 5000
+# Prometheus file is rewritten at most this often (seconds)
+EXPORT_INTERVAL = 5.0
+
+# (session id, current span id, current span attributes) of the running code path
+_ctx: contextvars.ContextVar = contextvars.ContextVar("metrics_ctx", default=(None, None, None))
+
+_lock = threading.Lock()
+_spans: deque = deque(maxlen=MAX_SPANS)
+_counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = defaultdict(float)
+_gauges: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+_span_totals: Dict[str, List[float]] = defaultdict(lambda: [0, 0.0, 0])  # name -> [count, seconds, errors]
+_session_counters: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+_last_export = [0.0]
+
+
+def current_session() -> Optional[str]:
+    return _ctx.get()[0]
+
+
+def set_session(session_id: Optional[str]) -> None:
+    """Attribute everything recorded from here on in the current thread/context to session_id."""
+    _ctx.set((session_id, None, None))
+
+
+@contextmanager
+def session(session_id: Optional[str]) -> Iterator[None]:
+    """Attribute everything recorded inside the block (and in bind()-ed threads) to session_id."""
+    _, span_id, attrs = _ctx.get()
+    token = _ctx.set((session_id, span_id, attrs))
+    try:
+        yield
+    finally:
+        _ctx.reset(token)
+
+
+def bind(fn: Callable) -> Callable:
+    """Wrap fn to run in the caller's session/span context (for thread pool submissions)."""
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.copy().run(fn, *args, **kwargs)
+
+
+def incr(name: str, value: float = 1, **labels: Any) -> None:
+    """Add to a counter (e.g. incr("cache_hits", cache="content"))."""
+    key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+    sid = current_session()
+    with _lock:
+        _counters[key] += value
+        if sid:
+            _session_counters[sid][name] += value
+
+
+def set_gauge(name: str, value: float, **labels: Any) -> None:
+    """Set a gauge to its current value (e.g. set_gauge("breaker_state", 2, model="...")); process-wide."""
+    key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+    with _lock:
+        _gauges[key] = value
+
+
+def add(key: str, value: float) -> None:
+    """Accumulate a numeric attribute on the current span (no-op outside a span)."""
+    attrs = _ctx.get()[2]
+    if attrs is not None:
+        attrs[key] = attrs.get(key, 0) + value
+
+
+def annotate(**attrs: Any) -> None:
+    """Set attributes on the current span (no-op outside a span)."""
+    current = _ctx.get()[2]
+    if current is not None:
+        current.update(attrs)
+
+
+def usage_tokens(resp: Any) -> Tuple[int, int]:
+    """(prompt, output) tokens from a Gemini response's usage_metadata (0, 0 if absent)."""
+    meta = getattr(resp, "usage_metadata", None)
+    if meta is None:
+        return 0, 0
+    return getattr(meta, "prompt_token_count", 0) or 0, getattr(meta, "candidates_token_count", 0) or 0
+
+
+def add_usage(resp: Any) -> Tuple[int, int]:
+    """Add a Gemini response's token usage to the current span; returns (prompt, output) tokens."""
+    tokens_in, tokens_out = usage_tokens(resp)
+    add("tokens_in", tokens_in)
+    add("tokens_out", tokens_out)
+    return tokens_in, tokens_out
+
+
+@contextmanager
+def span(name: str, **attrs: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Time a block. Yields the span's attribute dict (set extra attributes inside the block); numeric
+    attributes tokens_in / tokens_out / bytes_in / bytes_out also feed the matching counters.
+    """
+    sid, parent, _ = _ctx.get()
+    span_id = uuid.uuid4().hex[:16]
+    token = _ctx.set((sid, span_id, attrs))
+    start = time.time()
+    t0 = time.perf_counter()
+    error = None
+    try:
+        yield attrs
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"[:300]
+        raise
+    finally:
+        duration = time.perf_counter() - t0
+        _ctx.reset(token)
+        _finish({
+            "ts": start,
+            "name": name,
+            "span_id": span_id,
+            "parent_id": parent,
+            "session": sid,
+            "duration_ms": round(duration * 1000, 2),
+            "error": error,
+            **attrs,
+        })
+
+
+def record(name: str, start: float, seconds: float, error: Optional[str] = None, **attrs: Any) -> None:
+    """Record an already-timed span (for generators, where a context-managed span cannot stay open)."""
+    sid, parent, _ = _ctx.get()
+    _finish({
+        "ts": start,
+        "name": name,
+        "span_id": uuid.uuid4().hex[:16],
+        "parent_id": parent,
+        "session": sid,
+        "duration_ms": round(seconds * 1000, 2),
+        "error": error,
+        **attrs,
+    })
+
+
+def timed(name: str) -> Callable:
+    """Decorator form of span() for whole functions."""
+    def wrap(fn: Callable) -> Callable:
+        @wraps(fn)
+        def inner(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+
+def _finish(record: Dict[str, Any]) -> None:
+    for key in ("tokens_in", "tokens_out", "bytes_in", "bytes_out"):
+        if isinstance(record.get(key), (int, float)) and record[key]:
+            incr(key, record[key], span=record["name"])
+    with _lock:
+        _spans.append(record)
+        totals = _span_totals[record["name"]]
+        totals[0] += 1
+        totals[1] += record["duration_ms"] / 1000
+        totals[2] += 1 if record["error"] else 0
+    if TRACE_ENABLED:
+        _write_trace(record)
+        if time.time() - _last_export[0] >= EXPORT_INTERVAL:
+            export_prometheus()
+
+
+def _write_trace(record: Dict[str, Any]) -> None:
+    line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+    try:
+        with _lock:
+            ensure_dirs()
+            if TRACE_FILE.exists() and TRACE_FILE.stat().st_size > TRACE_MAX_BYTES:
+                os.replace(TRACE_FILE, TRACE_FILE.with_suffix(TRACE_FILE.suffix + ".1"))
+            with open(TRACE_FILE, "a", encoding="utf-8") as f:
+                f.write(line)
+    except OSError:
+        pass
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _labels(pairs) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def prometheus_text() -> str:
+    """Counters, gauges and per-span totals in Prometheus text exposition format."""
+    with _lock:
+        counters = sorted(_counters.items())
+        gauges = sorted(_gauges.items())
+        totals = sorted((k, list(v)) for k, v in _span_totals.items())
+    lines = []
+    seen = set()
+    for (name, labels), value in counters:
+        metric = f"lcm_{name}_total"
+        if metric not in seen:
+            seen.add(metric)
+            lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric}{_labels(labels)} {_number(value)}")
+    for (name, labels), value in gauges:
+        metric = f"lcm_{name}"
+        if metric not in seen:
+            seen.add(metric)
+            lines.append(f"# TYPE {metric} gauge")
+        lines.append(f"{metric}{_labels(labels)} {_number(value)}")
+    if totals:
+        lines.append("# TYPE lcm_span_seconds summary")
+        for name, (count, seconds, _) in totals:
+            lines.append(f"lcm_span_seconds_sum{_labels([('span', name)])} {seconds:.6f}")
+            lines.append(f"lcm_span_seconds_count{_labels([('span', name)])} {count}")
+        lines.append("# TYPE lcm_span_errors_total counter")
+        for name, (_, _, errors) in totals:
+            lines.append(f"lcm_span_errors_total{_labels([('span', name)])} {errors}")
+    return "\n".join(lines) + "\n"
+
+
+def export_prometheus(path: Path = METRICS_FILE) -> None:
+    """Rewrite the Prometheus text file atomically (scrape it with node_exporter's textfile collector)."""
+    _last_export[0] = time.time()
+    try:
+        ensure_dirs()
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        tmp.write_text(prometheus_text(), encoding="utf-8")
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
+def session_summary(session_id: str) -> Dict[str, Any]:
+    """
+    Per-stage breakdown for one session: {"stages": [{stage, calls, seconds, errors, tokens_in, tokens_out,
+    bytes, retries}], "counters": {retries, cache_hits, cache_misses, ...}}. Stages are sorted by total time
+    (nested stages overlap their parents, e.g. job.* spans include everything the job did).
+    """
+    stages: Dict[str, Dict[str, Any]] = {}
+    with _lock:
+        spans = [s for s in _spans if s.get("session") == session_id]
+        counters = dict(_session_counters.get(session_id, {}))
+    for s in spans:
+        row = stages.setdefault(s["name"], {
+            "stage": s["name"], "calls": 0, "seconds": 0.0, "errors": 0,
+            "tokens_in": 0, "tokens_out": 0, "bytes": 0, "retries": 0,
+        })
+        row["calls"] += 1
+        row["seconds"] += s["duration_ms"] / 1000
+        row["errors"] += 1 if s.get("error") else 0
+        row["tokens_in"] += s.get("tokens_in") or 0
+        row["tokens_out"] += s.get("tokens_out") or 0
+        row["bytes"] += (s.get("bytes_in") or 0) + (s.get("bytes_out") or 0)
+        row["retries"] += s.get("retries") or 0
+    rows = sorted(stages.values(), key=lambda r: -r["seconds"])
+    for r in rows:
+        r["seconds"] = round(r["seconds"], 2)
+    return {"stages": rows, "counters": counters}
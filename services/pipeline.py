@@ -0,0 +1,241 @@
+"""Batch pipeline: topics → post → image for many topics at once, with a bounded pool per stage."""
+import json
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import sys
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from config import (
+    OUTPUT_DIR,
+    PIPELINE_IMAGE_CONCURRENCY,
+    PIPELINE_POST_CONCURRENCY,
+    PREFETCH_TOKEN_BUDGET,
+    PREFETCH_TOP_K,
+    ensure_dirs,
+)
+from . import metrics
+from .content import (
+    SYSTEM_PROMPT,
+    estimate_tokens,
+    generate_linkedin_content,
+    get_cached_linkedin_content,
+    parse_sections,
+    stream_linkedin_content,
+    track_usage,
+)
+from .image_gen import generate_post_image, generate_post_images
+
+
+def _stream_post(
+    topic: str,
+    on_hero: Callable[[str], None],
+    extra_context: Optional[str] = None,
+    use_cache: bool = True,
+    on_event: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> str:
+    """Stream the post and call on_hero(hero_copy) the moment the HERO Copy section is complete."""
+    text = ""
+    hero_sent = False
+    for ev in stream_linkedin_content(topic, extra_context=extra_context, use_cache=use_cache):
+        if on_event:
+            on_event(ev)
+        text = ev["text"]
+        if not hero_sent and "hero_copy" in ev["completed"]:
+            hero_sent = True
+            on_hero(ev["sections"]["hero_copy"])
+    if not hero_sent:
+        on_hero(parse_sections(text)["hero_copy"])
+    return text
+
+
+@metrics.timed("pipeline.post_and_image")
+def generate_post_and_image(
+    topic: str,
+    extra_context: Optional[str] = None,
+    template_description: Optional[str] = None,
+    image_count: int = 1,
+    use_cache: bool = True,
+    on_event: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Post + image in one pipelined step: Imagen starts as soon as the streamed HERO Copy
+    is complete, while the caption/hashtags are still being generated.
+    on_event receives each stream event (see stream_linkedin_content).
+    Returns dict with content, hero_copy, image_paths, image_error.
+    """
+    result: Dict[str, Any] = {"content": "", "hero_copy": "", "image_paths": [], "image_error": None}
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="image") as pool:
+        futures = []
+
+        def start_image(hero: str) -> None:
+            result["hero_copy"] = hero
+            futures.append(pool.submit(
+                metrics.bind(generate_post_images),
+                topic,
+                template_description=template_description,
+                hero_copy=hero or None,
+                count=image_count,
+            ))
+
+        result["content"] = _stream_post(
+            topic, start_image, extra_context=extra_context, use_cache=use_cache, on_event=on_event
+        )
+        paths, err = futures[0].result()
+    result["image_paths"] = paths
+    result["image_error"] = err
+    return result
+
+
+@metrics.timed("pipeline.run")
+def run_pipeline(
+    topics: List[Dict[str, Any]],
+    post_concurrency: int = PIPELINE_POST_CONCURRENCY,
+    image_concurrency: int = PIPELINE_IMAGE_CONCURRENCY,
+    with_images: bool = True,
+    out_path: Optional[Path] = None,
+    on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Generate post (+ image) for every topic. Each stage has its own thread pool, so
+    posts and images for different topics overlap; an image starts as soon as its post's
+    HERO Copy has streamed in.
+    Each finished item is appended to out_path (JSONL) and passed to on_result as it completes.
+    Returns results in topic order: dicts with index, title, content, hero_copy, image_path, error.
+    """
+    ensure_dirs()
+    if out_path is None:
+        out_path = OUTPUT_DIR / f"batch_{int(time.time())}.jsonl"
+    results: List[Dict[str, Any]] = [
+        {
+            "index": t.get("index", i),
+            "title": str(t.get("title", t)),
+            "content": "",
+            "hero_copy": "",
+            "image_path": None,
+            "error": None,
+        }
+        for i, t in enumerate(topics, 1)
+    ]
+
+    with open(out_path, "a", encoding="utf-8") as out, \
+            ThreadPoolExecutor(max_workers=max(1, post_concurrency), thread_name_prefix="post") as post_pool, \
+            ThreadPoolExecutor(max_workers=max(1, image_concurrency), thread_name_prefix="image") as image_pool:
+
+        def finish(item: Dict[str, Any]) -> None:
+            row = dict(item, image_path=str(item["image_path"]) if item["image_path"] else None)
+            out.write(json.dumps(row, ensure_ascii=False) + "\n")
+            out.flush()
+            if on_result:
+                on_result(row)
+
+        def post_stage(i: int):
+            item = results[i]
+            image_future = []
+
+            def start_image(hero: str) -> None:
+                item["hero_copy"] = hero
+                if with_images:
+                    image_future.append(
+                        image_pool.submit(metrics.bind(generate_post_image), item["title"], hero_copy=hero or None)
+                    )
+
+            text = _stream_post(item["title"], start_image)
+            return text, (image_future[0] if image_future else None)
+
+        pending = {}
+        for i in range(len(results)):
+            pending[post_pool.submit(metrics.bind(post_stage), i)] = ("post", i)
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                stage, i = pending.pop(fut)
+                item = results[i]
+                try:
+                    value = fut.result()
+                except Exception as e:
+                    item["error"] = f"{stage}: {e}"
+                    finish(item)
+                    continue
+                if stage == "post":
+                    item["content"], image_future = value
+                    if image_future is not None:
+                        # Image was started from the stream as soon as HERO Copy was complete
+                        pending[image_future] = ("image", i)
+                    else:
+                        finish(item)
+                else:
+                    path, err = value
+                    item["image_path"] = path
+                    if err:
+                        item["error"] = f"image: {err}"
+                    finish(item)
+    return results
+
+
+@metrics.timed("pipeline.prefetch")
+def prefetch_drafts(
+    topics: List[Dict[str, Any]],
+    top_k: int = PREFETCH_TOP_K,
+    token_budget: int = PREFETCH_TOKEN_BUDGET,
+    concurrency: int = PIPELINE_POST_CONCURRENCY,
+) -> Dict[str, Any]:
+    """
+    Speculatively draft posts for the first top_k topics so selecting one is instant
+    (drafts land in the post cache). Topics already cached are skipped. The budget is charged with the
+    tokens each draft actually used (usage_metadata); a draft starts only if tokens spent plus the expected
+    cost of the drafts in flight and this one fit. The first draft runs alone to measure that cost.
+    Returns dict with drafted / skipped / over_budget titles
+    and tokens_used.
+    """
+    # Expected cost per draft: a first guess (system prompt + input + ~200-token post), then the mean of actuals
+    first_guess = estimate_tokens(SYSTEM_PROMPT) + 250
+    costs: List[int] = []
+    spent = 0
+    drafted: List[str] = []
+    skipped: List[str] = []
+    todo: deque = deque()
+    for t in topics[:max(0, top_k)]:
+        title = str(t.get("title", t))
+        if get_cached_linkedin_content(title):
+            skipped.append(title)
+        else:
+            todo.append(title)
+
+    def draft(title: str) -> int:
+        with track_usage() as usage:
+            text = generate_linkedin_content(title)
+        used = usage["prompt_tokens"] + usage["output_tokens"]
+        if usage["calls"] and not used:
+            # No usage_metadata in the response: fall back to the length estimate
+            used = estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(title) + estimate_tokens(text)
+        return used
+
+    workers = max(1, min(concurrency, len(todo) or 1))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch") as pool:
+        pending: Dict[Any, str] = {}
+        while todo or pending:
+            expected = sum(costs) / len(costs) if costs else first_guess
+            # Until one draft has finished, its cost is a guess: run a single draft to calibrate
+            limit = workers if costs else 1
+            while todo and len(pending) < limit and spent + expected * (len(pending) + 1) <= token_budget:
+                title = todo.popleft()
+                pending[pool.submit(metrics.bind(draft), title)] = title
+            if not pending:
+                break  # the next draft would not fit the budget
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                title = pending.pop(fut)
+                try:
+                    used = fut.result()
+                except Exception:
+                    continue
+                spent += used
+                if used:
+                    costs.append(used)  # cache hits (another session drafted it) cost nothing
+                drafted.append(title)
+    metrics.annotate(tokens_used=spent, over_budget=len(todo))
+    return {"drafted": drafted, "skipped": skipped, "over_budget": list(todo), "tokens_used": spent}
@@ -0,0 +1,283 @@
+"""
+Rate limiting + retry shared across threads and processes (SQLite-backed).
+Per API key: a token bucket (requests/sec) plus a concurrency limit, both adapted AIMD-style —
+halved on 429/503 (and paused for Retry-After), grown additively on success up to the configured max.
+"""
+import hashlib
+import random
+import sqlite3
+import time
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional, Tuple
+
+import sys
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from config import (
+    API_LIMITS,
+    RATELIMIT_DB,
+    RETRY_BASE_DELAY,
+    RETRY_MAX_ATTEMPTS,
+    RETRY_MAX_DELAY,
+)
+from . import metrics, storage
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+THROTTLE_STATUS = {429, 503}
+LEASE_TTL = 300.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL,
+    rate REAL NOT NULL,
+    concurrency REAL NOT NULL,
+    blocked_until REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS leases (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_leases_name ON leases (name, expires);
+"""
+_ready = False
+
+
+class RateLimitError(Exception):
+    """Raised when an API keeps throttling after all retries."""
+
+
+def _connect() -> sqlite3.Connection:
+    global _ready
+    conn = storage.connect(RATELIMIT_DB, isolation_level=None)
+    if not _ready:
+        conn.executescript(_SCHEMA)
+        _ready = True
+    return conn
+
+
+def _limits(api: str) -> dict:
+    return API_LIMITS.get(api) or {"rpm": 60, "concurrency": 4}
+
+
+def _burst(lim: dict, rate: float) -> float:
+    """Bucket capacity: up to `concurrency` requests back to back, at most 5 seconds' worth of the rate."""
+    return max(1.0, min(float(lim["concurrency"]), rate * 5))
+
+
+def bucket_name(api: str, api_key: str = "") -> str:
+    """Buckets are per API and per key, so two keys for the same API do not share quota."""
+    return f"{api}:{hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:8]}"
+
+
+def acquire(api: str, api_key: str = "", timeout: float = 600.0) -> int:
+    """Block until a token and a concurrency slot are free. Returns a lease id for release()."""
+    name = bucket_name(api, api_key)
+    lim = _limits(api)
+    max_rate = lim["rpm"] / 60.0
+    deadline = time.time() + timeout
+    conn = _connect()
+    try:
+        while True:
+            now = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT tokens, updated, rate, concurrency, blocked_until FROM buckets WHERE name = ?",
+                    (name,),
+                ).fetchone()
+                if row is None:
+                    # Start full so the first fan-out after a cold start is not spaced out by the refill rate
+                    row = (_burst(lim, max_rate), now, max_rate, float(lim["concurrency"]), 0.0)
+                    conn.execute(
+                        "INSERT INTO buckets (name, tokens, updated, rate, concurrency, blocked_until) VALUES (?, ?, ?, ?, ?, ?)",
+                        (name, *row),
+                    )
+                tokens, updated, rate, concurrency, blocked_until = row
+                burst = _burst(lim, rate)
+                tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+                conn.execute("DELETE FROM leases WHERE name = ? AND expires < ?", (name, now))
+                in_flight = conn.execute("SELECT COUNT(*) FROM leases WHERE name = ?", (name,)).fetchone()[0]
+
+                if now < blocked_until:
+                    wait = blocked_until - now
+                elif in_flight >= max(1, int(concurrency)):
+                    wait = 0.1
+                elif tokens < 1.0:
+                    wait = (1.0 - tokens) / rate
+                else:
+                    tokens -= 1.0
+                    cur = conn.execute(
+                        "INSERT INTO leases (name, expires) VALUES (?, ?)", (name, now + LEASE_TTL)
+                    )
+                    conn.execute(
+                        "UPDATE buckets SET tokens = ?, updated = ? WHERE name = ?", (tokens, now, name)
+                    )
+                    conn.execute("COMMIT")
+                    return cur.lastrowid
+                conn.execute("UPDATE buckets SET tokens = ?, updated = ? WHERE name = ?", (tokens, now, name))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            if now + wait > deadline:
+                raise RateLimitError(f"Timed out waiting for {api} rate limit")
+            time.sleep(min(wait, 1.0) * random.uniform(0.8, 1.2))
+    finally:
+        conn.close()
+
+
+def release(api: str, lease_id: int, api_key: str = "", throttled: bool = False, retry_after: Optional[float] = None) -> None:
+    """Free the slot and adapt: multiplicative decrease on throttling, additive increase on success."""
+    name = bucket_name(api, api_key)
+    lim = _limits(api)
+    max_rate = lim["rpm"] / 60.0
+    max_conc = float(lim["concurrency"])
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM leases WHERE id = ?", (lease_id,))
+            row = conn.execute(
+                "SELECT tokens, rate, concurrency, blocked_until FROM buckets WHERE name = ?", (name,)
+            ).fetchone()
+            if row is not None:
+                tokens, rate, concurrency, blocked_until = row
+                if throttled:
+                    rate = max(max_rate / 20, rate / 2)
+                    concurrency = max(1.0, concurrency / 2)
+                    tokens = min(tokens, 0.0)
+                    blocked_until = max(blocked_until, now + (retry_after or 0.0))
+                else:
+                    rate = min(max_rate, rate + max_rate / 20)
+                    concurrency = min(max_conc, concurrency + 1.0 / max(concurrency, 1.0))
+                conn.execute(
+                    "UPDATE buckets SET tokens = ?, rate = ?, concurrency = ?, blocked_until = ? WHERE name = ?",
+                    (tokens, rate, concurrency, blocked_until, name),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_error(exc: Exception) -> Tuple[Optional[int], Optional[float]]:
+    """(HTTP status, Retry-After seconds) for errors raised by requests, google-api-core or tavily."""
+    response = getattr(exc, "response", None)
+    if response is not None and getattr(response, "status_code", None):
+        return response.status_code, _parse_retry_after(response.headers.get("Retry-After"))
+    code = getattr(exc, "code", None)
+    if isinstance(code, int):
+        return code, None
+    if type(exc).__name__ == "UsageLimitExceededError":
+        return 429, None
+    # tavily.errors.TimeoutError is not the builtin TimeoutError; match by name like the requests exceptions
+    if isinstance(exc, (ConnectionError, TimeoutError)) or type(exc).__name__ in (
+        "ConnectionError", "Timeout", "ReadTimeout", "TimeoutError",
+    ):
+        return 503, None
+    return None, None
+
+
+class LeasedStream:
+    """
+    A streaming response that keeps its concurrency lease while the body is read. The lease is released
+    once the stream is exhausted, fails or is closed; an error raised mid-stream is reported to the limiter
+    like a failed call (429/503 halve the rate). Other attributes (usage_metadata, …) are the response's.
+    """
+
+    def __init__(self, response: Any, api: str, lease: int, api_key: str = ""):
+        self._response = response
+        self._api = api
+        self._lease: Optional[int] = lease
+        self._api_key = api_key
+
+    def __iter__(self) -> Iterator[Any]:
+        error: Optional[Exception] = None
+        try:
+            for chunk in self._response:
+                yield chunk
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._release(error)
+
+    def _release(self, error: Optional[Exception] = None) -> None:
+        if self._lease is None:
+            return
+        lease, self._lease = self._lease, None
+        status, retry_after = classify_error(error) if error is not None else (None, None)
+        throttled = status in THROTTLE_STATUS
+        release(self._api, lease, self._api_key, throttled=throttled, retry_after=retry_after)
+        if throttled:
+            metrics.incr("api_throttled", api=self._api)
+        if error is not None:
+            metrics.incr("api_errors", api=self._api, status=status or "other")
+
+    def close(self) -> None:
+        """Give the slot back without reading the rest of the stream."""
+        self._release()
+
+    def __del__(self) -> None:
+        if self.__dict__.get("_lease") is not None:
+            self._release()
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self._response, name)
+
+
+def call_with_retry(
+    api: str, fn: Callable[..., Any], *args, api_key: str = "", streaming: bool = False, **kwargs
+) -> Any:
+    """
+    Run fn under the shared limiter for `api`; retry 429/5xx with exponential backoff (honours Retry-After).
+    Non-retryable errors are raised immediately; the last error is raised after RETRY_MAX_ATTEMPTS.
+    streaming=True: fn returns a stream read after this returns; it comes back as a LeasedStream holding
+    the concurrency slot until it is read or closed (errors while reading are not retried).
+    """
+    for attempt in range(RETRY_MAX_ATTEMPTS):
+        waited = time.perf_counter()
+        lease = acquire(api, api_key)
+        waited = time.perf_counter() - waited
+        metrics.add("ratelimit_wait_ms", round(waited * 1000, 1))
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            status, retry_after = classify_error(e)
+            throttled = status in THROTTLE_STATUS
+            release(api, lease, api_key, throttled=throttled, retry_after=retry_after)
+            if throttled:
+                metrics.incr("api_throttled", api=api)
+            if status not in RETRYABLE_STATUS or attempt == RETRY_MAX_ATTEMPTS - 1:
+                metrics.incr("api_errors", api=api, status=status or "other")
+                raise
+            metrics.incr("api_retries", api=api)
+            metrics.add("retries", 1)
+            delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)) * random.uniform(0.5, 1.0)
+            time.sleep(max(delay, retry_after or 0.0))
+            continue
+        if streaming:
+            return LeasedStream(result, api, lease, api_key)
+        release(api, lease, api_key)
+        return result
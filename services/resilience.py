@@ -0,0 +1,290 @@
+"""
+Gemini chat calls with tail-latency hedging and a per-model circuit breaker.
+Hedging (GEMINI_HEDGE): when a call is still running after the observed p95 latency for its model and
+operation, an identical request is sent and whichever finishes first wins (the other result is dropped).
+Circuit breaker: a model whose recent calls fail above GEMINI_BREAKER_ERROR_RATE is skipped for
+GEMINI_BREAKER_COOLDOWN seconds (calls go to GEMINI_FALLBACK_MODEL, or fail fast), then a single probe
+call decides whether it closes again. status() reports breaker state and hedge statistics per model.
+"""
+import contextvars
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional
+
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from config import (
+    GEMINI_API_KEY,
+    GEMINI_BREAKER_COOLDOWN,
+    GEMINI_BREAKER_ERROR_RATE,
+    GEMINI_BREAKER_MIN_CALLS,
+    GEMINI_BREAKER_WINDOW,
+    GEMINI_CHAT_MODEL,
+    GEMINI_FALLBACK_MODEL,
+    GEMINI_HEDGE,
+    GEMINI_HEDGE_MIN_DELAY,
+    GEMINI_HEDGE_PERCENTILE,
+    GEMINI_REQUEST_TIMEOUT,
+)
+from . import metrics
+from .clients import get_chat_model
+from .ratelimit import RETRYABLE_STATUS, call_with_retry, classify_error
+
+# Successful call latencies kept per (model, operation); hedging starts once HEDGE_MIN_SAMPLES are known
+LATENCY_WINDOW = 200
+HEDGE_MIN_SAMPLES = 20
+HEDGE_WORKERS = 32
+
+_STATE_VALUE = {"closed": 0, "half_open": 1, "open": 2}
+
+_lock = threading.Lock()
+_breakers: Dict[str, "CircuitBreaker"] = {}
+_latencies: Dict[tuple, deque] = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+_stats: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+_executor: Optional[ThreadPoolExecutor] = None
+# Model that answered the last generate_content call in this context (see served_model)
+_served: contextvars.ContextVar = contextvars.ContextVar("served_model", default=None)
+
+
+class CircuitOpenError(Exception):
+    """Raised when every candidate model's breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    closed → open when the error rate over the last `window` calls (at least min_calls) reaches error_rate;
+    open → half_open after cooldown seconds, letting one probe call through; the probe closes or re-opens it.
+    Only throttling / server / timeout errors count as failures; bad requests say nothing about the model.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        error_rate: float = GEMINI_BREAKER_ERROR_RATE,
+        min_calls: int = GEMINI_BREAKER_MIN_CALLS,
+        window: int = GEMINI_BREAKER_WINDOW,
+        cooldown: float = GEMINI_BREAKER_COOLDOWN,
+    ):
+        self.model = model
+        self.error_rate = error_rate
+        self.min_calls = max(1, min_calls)
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.opened_at = 0.0
+        self._outcomes: deque = deque(maxlen=max(1, window))
+        self._probing = False
+        self._lock = threading.Lock()
+        metrics.set_gauge("breaker_state", 0, model=model)
+
+    def _set(self, state: str) -> None:
+        if state == "open":
+            self.opened_at = time.time()
+        self.state = state
+        metrics.incr("breaker_transitions", model=self.model, state=state)
+        metrics.set_gauge("breaker_state", _STATE_VALUE[state], model=self.model)
+
+    def allow(self) -> bool:
+        """True if a call may go to this model now (in half_open, only the single probe)."""
+        with self._lock:
+            if self.state == "open" and time.time() - self.opened_at >= self.cooldown:
+                self._set("half_open")
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record(self, ok: Optional[bool]) -> None:
+        """Outcome of an allowed call: True success, False model failure, None neither (e.g. a bad request)."""
+        with self._lock:
+            if self.state == "half_open" and self._probing:
+                self._probing = False
+                if ok is not None:
+                    self._outcomes.clear()
+                    self._set("closed" if ok else "open")
+                return
+            if ok is None:
+                return
+            self._outcomes.append(ok)
+            if (
+                self.state == "closed"
+                and len(self._outcomes) >= self.min_calls
+                and self.recent_error_rate() >= self.error_rate
+            ):
+                self._set("open")
+
+    def recent_error_rate(self) -> float:
+        return self._outcomes.count(False) / len(self._outcomes) if self._outcomes else 0.0
+
+
+def get_breaker(model: str) -> CircuitBreaker:
+    with _lock:
+        breaker = _breakers.get(model)
+        if breaker is None:
+            breaker = _breakers[model] = CircuitBreaker(model)
+    return breaker
+
+
+def _percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def hedge_delay(model: str, op: str) -> Optional[float]:
+    """Seconds to wait before hedging a call (the observed percentile latency), or None while too few samples."""
+    with _lock:
+        samples = list(_latencies[(model, op)])
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return None
+    return max(GEMINI_HEDGE_MIN_DELAY, _percentile(samples, GEMINI_HEDGE_PERCENTILE))
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="gemini-hedge")
+    return _executor
+
+
+def _attempt(model: str, op: str, system_instruction: str, prompt: Any, kwargs: Dict[str, Any]) -> Any:
+    t0 = time.perf_counter()
+    resp = call_with_retry(
+        "gemini_chat",
+        get_chat_model(system_instruction, model).generate_content,
+        prompt,
+        api_key=GEMINI_API_KEY,
+        # The SDK's own retry would keep retrying 429/503 for minutes, hidden from the limiter and the breaker
+        request_options={"retry": None, "timeout": GEMINI_REQUEST_TIMEOUT},
+        streaming=bool(kwargs.get("stream")),
+        **kwargs,
+    )
+    if not kwargs.get("stream"):
+        with _lock:
+            _latencies[(model, op)].append(time.perf_counter() - t0)
+    return resp
+
+
+def _hedged(model: str, op: str, system_instruction: str, prompt: Any, kwargs: Dict[str, Any]) -> Any:
+    """
+    One call, plus a duplicate if it outlives the hedge delay; the first successful response wins.
+    No hedging while the model is erroring: slow calls are then retries, and duplicates would add to the load.
+    """
+    healthy = get_breaker(model).recent_error_rate() < GEMINI_BREAKER_ERROR_RATE / 2
+    delay = hedge_delay(model, op) if GEMINI_HEDGE and healthy and not kwargs.get("stream") else None
+    if delay is None:
+        return _attempt(model, op, system_instruction, prompt, kwargs)
+    primary = _pool().submit(metrics.bind(_attempt), model, op, system_instruction, prompt, kwargs)
+    if wait([primary], timeout=delay).done:
+        return primary.result()
+    hedge = _pool().submit(metrics.bind(_attempt), model, op, system_instruction, prompt, kwargs)
+    with _lock:
+        _stats[model]["hedges"] += 1
+    metrics.incr("gemini_hedges", model=model, op=op)
+    pending = {primary, hedge}
+    error: Optional[BaseException] = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            if fut.exception() is None:
+                won = fut is hedge
+                if won:
+                    with _lock:
+                        _stats[model]["hedge_wins"] += 1
+                    metrics.incr("gemini_hedge_wins", model=model, op=op)
+                metrics.annotate(hedged=True, hedge_won=won)
+                return fut.result()
+            error = error or fut.exception()
+    raise error
+
+
+def generate_content(
+    system_instruction: str,
+    prompt: Any,
+    op: str = "chat",
+    model: str = GEMINI_CHAT_MODEL,
+    **kwargs: Any,
+) -> Any:
+    """
+    GenerativeModel.generate_content under the shared rate limiter, with hedging and the circuit breaker.
+    `op` groups latencies for the hedge delay (e.g. "post", "topics"); kwargs go to generate_content.
+    Streaming calls (stream=True) are never hedged. If the model's breaker is open or the call fails with
+    a throttling/server error, GEMINI_FALLBACK_MODEL is tried; raises CircuitOpenError if no model is available.
+    served_model() then tells the caller which model answered.
+    """
+    if not GEMINI_API_KEY:
+        raise ValueError("GEMINI_API_KEY is not set in .env")
+    candidates = [model]
+    if GEMINI_FALLBACK_MODEL and GEMINI_FALLBACK_MODEL != model:
+        candidates.append(GEMINI_FALLBACK_MODEL)
+    _served.set(None)
+    last_error: Optional[Exception] = None
+    for name in candidates:
+        breaker = get_breaker(name)
+        if not breaker.allow():
+            metrics.incr("breaker_rejections", model=name)
+            continue
+        if name != model:
+            with _lock:
+                _stats[model]["fallbacks"] += 1
+            metrics.incr("gemini_fallbacks", model=model, fallback=name)
+        with _lock:
+            _stats[name]["calls"] += 1
+        try:
+            resp = _hedged(name, op, system_instruction, prompt, kwargs)
+        except Exception as e:
+            status, _ = classify_error(e)
+            failed = status in RETRYABLE_STATUS
+            breaker.record(False if failed else None)
+            with _lock:
+                _stats[name]["errors"] += 1
+            if not failed:
+                # Bad request, blocked prompt, missing key…: another model would fail the same way
+                raise
+            last_error = e
+            continue
+        breaker.record(True)
+        metrics.annotate(model=name)
+        _served.set(name)
+        return resp
+    if last_error is not None:
+        raise last_error
+    raise CircuitOpenError(f"Circuit open for {', '.join(candidates)}; retry in up to {GEMINI_BREAKER_COOLDOWN:.0f}s")
+
+
+def served_model() -> Optional[str]:
+    """Model that answered this context's last generate_content call (None if it failed or none was made)."""
+    return _served.get()
+
+
+def status() -> List[Dict[str, Any]]:
+    """
+    Per model used by this process: breaker state, recent error rate, calls, errors, fallbacks (calls
+    diverted away from it), hedges sent, hedge wins and p95 latency over all operations.
+    """
+    with _lock:
+        models = sorted(set(_breakers) | set(_stats))
+        stats = {m: dict(_stats.get(m, {})) for m in models}
+        samples = {m: [x for (name, _), xs in _latencies.items() if name == m for x in xs] for m in models}
+        breakers = {m: _breakers.get(m) for m in models}
+    rows = []
+    for m in models:
+        b = breakers[m]
+        s = stats[m]
+        rows.append({
+            "model": m,
+            "state": b.state if b else "closed",
+            "error_rate": round(b.recent_error_rate(), 2) if b else 0.0,
+            "calls": s.get("calls", 0),
+            "errors": s.get("errors", 0),
+            "fallbacks": s.get("fallbacks", 0),
+            "hedges": s.get("hedges", 0),
+            "hedge_wins": s.get("hedge_wins", 0),
+            "p95_ms": round(_percentile(samples[m], 95) * 1000) if samples[m] else None,
+        })
+    return rows
@@ -0,0 +1,134 @@
+"""
+Rank and compress Tavily snippets into a token budget before the topic-shaping prompt.
+Sentences are scored with BM25 against the niche terms (vectorized with numpy), near-duplicate
+sentences are dropped, and the best ones are packed per source until the budget is used.
+"""
+import re
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+_WORD_RE = re.compile(r"[a-z0-9][a-z0-9+#.-]*[a-z0-9+#]|[a-z0-9]")
+_SENT_RE = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9\"'(])|\n+")
+
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in into is it its of on or that the their this to was were "
+    "will with we you your our they than then there these those what which who how why can more most also".split()
+)
+
+# Data-backed signals the strategist prompt asks for; weighted below the niche terms
+SIGNAL_TERMS = "statistics data report survey percent growth forecast trend billion million market adoption"
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+DUPLICATE_JACCARD = 0.6
+
+
+def tokenize(text: str) -> List[str]:
+    return [w for w in _WORD_RE.findall((text or "").lower()) if w not in _STOPWORDS]
+
+
+def split_sentences(text: str) -> List[str]:
+    return [s.strip() for s in _SENT_RE.split(text or "") if len(s.strip()) > 20]
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def bm25_scores(docs: Sequence[List[str]], query: Dict[str, float]) -> np.ndarray:
+    """BM25 score of every tokenized doc against weighted query terms (one matrix op per term set)."""
+    terms = list(query)
+    if not docs or not terms:
+        return np.zeros(len(docs))
+    index = {t: j for j, t in enumerate(terms)}
+    tf = np.zeros((len(docs), len(terms)), dtype=np.float32)
+    for i, doc in enumerate(docs):
+        for w in doc:
+            j = index.get(w)
+            if j is not None:
+                tf[i, j] += 1
+    lengths = np.array([len(d) for d in docs], dtype=np.float32)
+    avg = max(float(lengths.mean()), 1.0)
+    df = (tf > 0).sum(axis=0)
+    idf = np.log1p((len(docs) - df + 0.5) / (df + 0.5))
+    weights = np.array([query[t] for t in terms], dtype=np.float32)
+    denom = tf + BM25_K1 * (1 - BM25_B + BM25_B * lengths[:, None] / avg)
+    return ((tf * (BM25_K1 + 1) / denom) * idf * weights).sum(axis=1)
+
+
+def _duplicate_mask(docs: Sequence[List[str]], order: np.ndarray) -> np.ndarray:
+    """True for sentences whose token set overlaps an earlier-kept (higher ranked) one above DUPLICATE_JACCARD."""
+    vocab: Dict[str, int] = {}
+    rows, cols = [], []
+    for i, doc in enumerate(docs):
+        for w in set(doc):
+            rows.append(i)
+            cols.append(vocab.setdefault(w, len(vocab)))
+    m = np.zeros((len(docs), max(len(vocab), 1)), dtype=np.float32)
+    m[rows, cols] = 1.0
+    inter = m @ m.T
+    sizes = m.sum(axis=1)
+    jaccard = inter / np.maximum(sizes[:, None] + sizes[None, :] - inter, 1.0)
+    dup = np.zeros(len(docs), dtype=bool)
+    kept: List[int] = []
+    for i in order:
+        if sizes[i] == 0 or (kept and jaccard[i, kept].max() >= DUPLICATE_JACCARD):
+            dup[i] = True
+        else:
+            kept.append(i)
+    return dup
+
+
+def build_research_context(
+    results: List[Dict[str, str]],
+    niche: str,
+    token_budget: int,
+) -> str:
+    """
+    Compress search results into "Title: …\\nSnippet: …" blocks that fit token_budget.
+    Sentences are ranked by BM25 against the niche (plus data-signal terms); near-duplicates are dropped.
+    Sources appear in order of their best sentence. Returns "" if nothing usable.
+    """
+    sentences: List[str] = []
+    source_of: List[int] = []
+    titles: List[str] = []
+    for r in results:
+        title = (r.get("title") or "").strip()
+        content = (r.get("content") or "").strip()
+        if not title or len(content) <= 20:
+            continue
+        titles.append(title)
+        for sent in split_sentences(content):
+            sentences.append(sent)
+            source_of.append(len(titles) - 1)
+    if not sentences:
+        return ""
+
+    query = {t: 2.0 for t in tokenize(niche)}
+    for t in tokenize(SIGNAL_TERMS):
+        query.setdefault(t, 0.5)
+    docs = [tokenize(f"{titles[source_of[i]]} {s}") for i, s in enumerate(sentences)]
+    scores = bm25_scores(docs, query)
+    # Earlier sentences of a snippet carry the lede; tiny tiebreak keeps Tavily's order otherwise
+    scores = scores - np.arange(len(sentences)) * 1e-6
+    order = np.argsort(-scores, kind="stable")
+    dup = _duplicate_mask([tokenize(s) for s in sentences], order)
+
+    picked: Dict[int, List[int]] = {}
+    used = 0
+    for i in order:
+        if dup[i]:
+            continue
+        src = source_of[i]
+        cost = estimate_tokens(sentences[i]) + (0 if src in picked else estimate_tokens(titles[src]) + 8)
+        if used + cost > token_budget:
+            continue
+        used += cost
+        picked.setdefault(src, []).append(int(i))
+
+    blocks = []
+    for src, idxs in picked.items():
+        snippet = " ".join(sentences[i] for i in sorted(idxs))
+        blocks.append(f"Title: {titles[src]}\nSnippet: {snippet}")
+    return "\n\n---\n\n".join(blocks)
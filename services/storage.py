@@ -0,0 +1,226 @@
+"""
+Storage backends for persisted state: SQLite databases (topics, posts, image index, caches, jobs, rate limits),
+files (images, previews, exports) and named locks. Choose with STORAGE_BACKEND:
+local  — DATA_DIR / OUTPUT_DIR on this machine; SQLite in WAL mode, flock-based locks.
+shared — STORAGE_SHARED_DIR, one directory mounted by every replica (EFS/NFSv4/SMB volume, or any local
+         directory for testing); SQLite in rollback-journal mode (WAL needs shared memory, which network
+         filesystems do not provide) and O_EXCL lock files, so replicas on different hosts exclude each other.
+Both write files atomically (temp file + fsync + rename): readers never see a half-written image or export.
+"""
+import os
+import socket
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, Optional, Set, Union
+
+import sys
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from config import DATA_DIR, OUTPUT_DIR, STORAGE_BACKEND, STORAGE_LOCK_STALE, ensure_dirs
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to lock files
+    fcntl = None
+
+
+class LockTimeout(Exception):
+    """Raised when a named lock is still held by someone else after the timeout."""
+
+
+class FileLock:
+    """
+    Cross-process (and cross-thread) lock on a file. flock=True uses fcntl.flock (released by the OS if the
+    holder dies); otherwise the lock is a file created with O_EXCL, treated as abandoned after `stale` seconds.
+    O_EXCL lock files are always deleted on release; remove=True deletes flock files too (for per-key locks
+    that would otherwise pile up), and an acquirer that locked a file just unlinked by the holder retries.
+    """
+
+    def __init__(self, path: Path, flock: bool = True, stale: float = STORAGE_LOCK_STALE, remove: bool = False):
+        self.path = path
+        self.flock = flock and fcntl is not None
+        self.stale = stale
+        self.remove = remove
+        self._fd: Optional[int] = None
+        self._token = b""
+
+    def _try(self) -> bool:
+        if self.flock:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                return False
+            if self.remove and not self._still_linked(fd):
+                # Locked the previous holder's file after it was unlinked; the lock now lives on a new file
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+                return False
+            self._fd = fd
+            return True
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            try:
+                if time.time() - self.path.stat().st_mtime > self.stale:
+                    self.path.unlink()  # holder died without releasing
+            except FileNotFoundError:
+                pass
+            return False
+        self._token = f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}:{time.time()}\n".encode()
+        os.write(fd, self._token)
+        self._fd = fd
+        return True
+
+    def _still_linked(self, fd: int) -> bool:
+        try:
+            st, cur = os.fstat(fd), os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        return (st.st_dev, st.st_ino) == (cur.st_dev, cur.st_ino)
+
+    def acquire(self, timeout: float = 30.0) -> bool:
+        """Wait up to timeout seconds; True if the lock is now held."""
+        deadline = time.monotonic() + timeout
+        delay = 0.01
+        while not self._try():
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(delay)
+            delay = min(delay * 2, 0.25)
+        return True
+
+    def release(self) -> None:
+        if self._fd is None:
+            return
+        fd, self._fd = self._fd, None
+        if self.flock:
+            if self.remove:
+                # Unlink while still holding the lock, so no one can lock this file and then find it gone
+                try:
+                    self.path.unlink()
+                except FileNotFoundError:
+                    pass
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+        else:
+            os.close(fd)
+            try:
+                # Held past `stale`, the lock may have been taken over; never delete the new holder's file
+                if self.path.read_bytes() == self._token:
+                    self.path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def __enter__(self) -> "FileLock":
+        if not self.acquire():
+            raise LockTimeout(f"Timed out waiting for lock {self.path.name}")
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+class LocalStorage:
+    """This machine's DATA_DIR / OUTPUT_DIR (one app process or several on the same host)."""
+
+    name = "local"
+    journal_mode = "WAL"
+    flock = True
+
+    def __init__(self, data_dir: Path = DATA_DIR, output_dir: Path = OUTPUT_DIR):
+        self.data_dir = Path(data_dir)
+        self.output_dir = Path(output_dir)
+        self.locks_dir = self.data_dir / "locks"
+        self._initialized: Set[str] = set()
+        self._init_lock = threading.Lock()
+
+    def connect(self, path: Path, **kwargs) -> sqlite3.Connection:
+        """SQLite connection to a database under this storage (journal mode set on first use per process)."""
+        path = Path(path)
+        key = str(path)
+        if key not in self._initialized:
+            ensure_dirs()
+            path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(key, timeout=30, **kwargs)
+        if key not in self._initialized:
+            with self._init_lock:
+                if key not in self._initialized:
+                    conn.execute(f"PRAGMA journal_mode={self.journal_mode}")
+                    self._initialized.add(key)
+        return conn
+
+    def write_bytes(self, path: Path, data: bytes) -> Path:
+        """Atomic write: concurrent readers see the old file or the complete new one, never a partial file."""
+        return self.write_stream(path, [data])
+
+    def write_stream(self, path: Path, chunks: Iterable[bytes]) -> Path:
+        """Atomic write of a file produced chunk by chunk (memory bounded by the largest chunk)."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{socket.gethostname()}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+        return path
+
+    def write_text(self, path: Path, text: str) -> Path:
+        return self.write_bytes(path, text.encode("utf-8"))
+
+    def lock(self, name: str, remove: bool = False) -> FileLock:
+        """
+        Named lock shared by every thread, process (and, for shared storage, replica) using this storage.
+        remove=True deletes the lock file on release (use for names that are not reused, e.g. per cache key).
+        """
+        self.locks_dir.mkdir(parents=True, exist_ok=True)
+        safe = "".join(c if c.isalnum() or c in "-_." else "_" for c in name)[:120]
+        return FileLock(self.locks_dir / f"{safe}.lock", flock=self.flock, remove=remove)
+
+
+class SharedDirStorage(LocalStorage):
+    """A directory every replica mounts (STORAGE_SHARED_DIR); safe without host-local shared memory."""
+
+    name = "shared"
+    journal_mode = "DELETE"
+    flock = False
+
+
+_storage: Optional[LocalStorage] = None
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> LocalStorage:
+    """Process-wide storage backend selected by STORAGE_BACKEND."""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                if STORAGE_BACKEND not in ("local", "shared"):
+                    raise ValueError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND!r} (use 'local' or 'shared')")
+                _storage = SharedDirStorage() if STORAGE_BACKEND == "shared" else LocalStorage()
+    return _storage
+
+
+def connect(path: Union[str, Path], **kwargs) -> sqlite3.Connection:
+    return get_storage().connect(Path(path), **kwargs)
+
+
+def write_bytes(path: Union[str, Path], data: bytes) -> Path:
+    return get_storage().write_bytes(Path(path), data)
+
+
+def write_stream(path: Union[str, Path], chunks: Iterable[bytes]) -> Path:
+    return get_storage().write_stream(Path(path), chunks)
+
+
+def lock(name: str, remove: bool = False) -> FileLock:
+    return get_storage().lock(name, remove=remove)
@@ -0,0 +1,168 @@
+"""
+Near-duplicate topic index: MinHash signatures + LSH bands over every stored topic (title and summary).
+Lives next to the topic history in data/topics.sqlite; a lookup is one indexed band query plus a
+signature comparison against the few candidates, so it stays fast with tens of thousands of topics.
+"""
+import hashlib
+import sqlite3
+import threading
+import zlib
+from contextlib import closing
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from config import TOPIC_DUPLICATE_THRESHOLD
+from .snippets import tokenize
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS topic_minhash (
+    topic_id INTEGER PRIMARY KEY REFERENCES topics (id),
+    sig BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS topic_lsh (
+    bucket INTEGER NOT NULL,
+    topic_id INTEGER NOT NULL,
+    PRIMARY KEY (bucket, topic_id)
+) WITHOUT ROWID;
+"""
+
+# 32 bands x 3 rows: pairs at Jaccard 0.5 collide in some band ~99% of the time, at 0.2 ~23%
+NUM_PERM = 96
+BANDS = 32
+ROWS = NUM_PERM // BANDS
+SHINGLE_CHARS = 5
+
+_PRIME = (1 << 31) - 1
+_rng = np.random.RandomState(20240601)
+_A = _rng.randint(1, _PRIME, size=NUM_PERM).astype(np.uint64)
+_B = _rng.randint(0, _PRIME, size=NUM_PERM).astype(np.uint64)
+
+_lock = threading.Lock()
+_ready = False
+
+
+def _text(title: str, summary: str = "") -> str:
+    return " ".join(tokenize(f"{title} {summary}"))
+
+
+def signature(title: str, summary: str = "") -> np.ndarray:
+    """MinHash signature (uint32[NUM_PERM]) of the character shingles of the normalized title + summary."""
+    text = _text(title, summary)
+    if len(text) <= SHINGLE_CHARS:
+        shingles = {text}
+    else:
+        shingles = {text[i:i + SHINGLE_CHARS] for i in range(len(text) - SHINGLE_CHARS + 1)}
+    h = np.fromiter((zlib.crc32(s.encode()) & _PRIME for s in shingles), dtype=np.uint64, count=len(shingles))
+    return ((h[:, None] * _A[None, :] + _B[None, :]) % _PRIME).min(axis=0).astype(np.uint32)
+
+
+def _buckets(sig: np.ndarray) -> List[int]:
+    """One signed 64-bit bucket key per band (band number is part of the key)."""
+    keys = []
+    for b in range(BANDS):
+        digest = hashlib.blake2b(sig[b * ROWS:(b + 1) * ROWS].tobytes(), digest_size=8, person=b"band%04d" % b)
+        keys.append(int.from_bytes(digest.digest(), "big", signed=True))
+    return keys
+
+
+def _connect() -> sqlite3.Connection:
+    """Topic store connection with the index tables present; indexes any topics saved before the index existed."""
+    global _ready
+    from .topic_store import _connect as store_connect
+    conn = store_connect()
+    if not _ready:
+        with _lock:
+            if not _ready:
+                conn.executescript(_SCHEMA)
+                rows = conn.execute(
+                    "SELECT id, title, summary FROM topics "
+                    "WHERE id NOT IN (SELECT topic_id FROM topic_minhash)"
+                ).fetchall()
+                with conn:
+                    index_topics(conn, ((r["id"], r["title"], r["summary"]) for r in rows))
+                _ready = True
+    return conn
+
+
+def index_topics(conn: sqlite3.Connection, rows: Iterable[Tuple[int, str, str]]) -> int:
+    """Add (topic_id, title, summary) rows to the index using the caller's connection/transaction."""
+    n = 0
+    for topic_id, title, summary in rows:
+        sig = signature(title, summary)
+        conn.execute("INSERT OR REPLACE INTO topic_minhash (topic_id, sig) VALUES (?, ?)", (topic_id, sig.tobytes()))
+        conn.executemany(
+            "INSERT OR IGNORE INTO topic_lsh (bucket, topic_id) VALUES (?, ?)",
+            [(k, topic_id) for k in _buckets(sig)],
+        )
+        n += 1
+    return n
+
+
+def add_topics(topics: List[Dict[str, Any]]) -> int:
+    """Index stored topics (dicts with "id", "title", "summary")."""
+    rows = [(t["id"], str(t.get("title", "")), str(t.get("summary", ""))) for t in topics if t.get("id")]
+    with closing(_connect()) as conn, conn:
+        return index_topics(conn, rows)
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Estimated Jaccard similarity of two signatures."""
+    return float(np.mean(a == b))
+
+
+def find_similar(
+    title: str,
+    summary: str = "",
+    threshold: float = TOPIC_DUPLICATE_THRESHOLD,
+    conn: Optional[sqlite3.Connection] = None,
+) -> List[Tuple[int, float]]:
+    """Stored topics whose estimated similarity is >= threshold, as [(topic_id, score)] best first."""
+    sig = signature(title, summary)
+    keys = _buckets(sig)
+    own = conn is None
+    conn = conn or _connect()
+    try:
+        rows = conn.execute(
+            f"SELECT m.topic_id, m.sig FROM topic_minhash m WHERE m.topic_id IN "
+            f"(SELECT DISTINCT topic_id FROM topic_lsh WHERE bucket IN ({','.join('?' * len(keys))}))",
+            keys,
+        ).fetchall()
+    finally:
+        if own:
+            conn.close()
+    if not rows:
+        return []
+    sigs = np.frombuffer(b"".join(r[1] for r in rows), dtype=np.uint32).reshape(len(rows), NUM_PERM)
+    scores = (sigs == sig[None, :]).mean(axis=1)
+    hits = [(int(rows[i][0]), float(scores[i])) for i in np.flatnonzero(scores >= threshold)]
+    return sorted(hits, key=lambda h: -h[1])
+
+
+def filter_new(
+    topics: List[Dict[str, Any]],
+    threshold: float = TOPIC_DUPLICATE_THRESHOLD,
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Split candidate topics into (new, duplicates): a duplicate is near an already-stored topic
+    or near an earlier candidate in the same list. Duplicates get "duplicate_of" (stored topic id, or None).
+    """
+    kept: List[Dict[str, Any]] = []
+    kept_sigs: List[np.ndarray] = []
+    dropped: List[Dict[str, Any]] = []
+    with closing(_connect()) as conn:
+        for t in topics:
+            title, summary = str(t.get("title", "")), str(t.get("summary", ""))
+            hits = find_similar(title, summary, threshold, conn=conn)
+            sig = signature(title, summary)
+            if hits:
+                dropped.append({**t, "duplicate_of": hits[0][0]})
+            elif any(similarity(sig, s) >= threshold for s in kept_sigs):
+                dropped.append({**t, "duplicate_of": None})
+            else:
+                kept.append(t)
+                kept_sigs.append(sig)
+    return kept, dropped
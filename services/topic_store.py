@@ -0,0 +1,337 @@
+"""Topic store (SQLite): append-only history of search runs, topics, generated posts and images."""
+import re
+import sqlite3
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+import sys
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from config import TOPICS_DB, TOPICS_EXCEL
+from . import metrics, storage
+from .cache import text_hash
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    niche TEXT NOT NULL DEFAULT '',
+    recency TEXT NOT NULL DEFAULT '',
+    count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_runs_created ON runs (created_at);
+
+CREATE TABLE IF NOT EXISTS topics (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    idx INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    reason TEXT NOT NULL DEFAULT '',
+    summary TEXT NOT NULL DEFAULT '',
+    niche TEXT NOT NULL DEFAULT '',
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_topics_run ON topics (run_id, idx);
+CREATE INDEX IF NOT EXISTS idx_topics_niche ON topics (niche, created_at);
+CREATE INDEX IF NOT EXISTS idx_topics_title ON topics (title);
+CREATE INDEX IF NOT EXISTS idx_topics_created ON topics (created_at);
+
+CREATE TABLE IF NOT EXISTS posts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    topic_id INTEGER NOT NULL REFERENCES topics (id),
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_posts_topic ON posts (topic_id, created_at);
+
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    topic_id INTEGER NOT NULL REFERENCES topics (id),
+    post_id INTEGER REFERENCES posts (id),
+    path TEXT NOT NULL,
+    approved INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_images_topic ON images (topic_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_images_path ON images (path);
+
+CREATE TABLE IF NOT EXISTS seen_sources (
+    niche TEXT NOT NULL,
+    time_range TEXT NOT NULL,
+    url TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    seen_at REAL NOT NULL,
+    PRIMARY KEY (niche, time_range, url)
+);
+CREATE INDEX IF NOT EXISTS idx_seen_hash ON seen_sources (niche, time_range, content_hash);
+CREATE INDEX IF NOT EXISTS idx_seen_at ON seen_sources (seen_at);
+"""
+
+# Seen sources are forgotten after twice their search window (older results cannot come back anyway)
+SEEN_RETENTION = {"day": 2 * 86400, "week": 14 * 86400, "month": 62 * 86400, "year": 730 * 86400}
+_ready = False
+
+
+def _connect() -> sqlite3.Connection:
+    global _ready
+    conn = storage.connect(TOPICS_DB)
+    conn.row_factory = sqlite3.Row
+    if not _ready:
+        conn.executescript(_SCHEMA)
+        _ready = True
+    return conn
+
+
+def _topic_dict(row: sqlite3.Row) -> Dict[str, Any]:
+    return {
+        "id": row["id"],
+        "run_id": row["run_id"],
+        "index": row["idx"],
+        "title": row["title"],
+        "reason": row["reason"],
+        "summary": row["summary"],
+    }
+
+
+@metrics.timed("store.save_run")
+def save_run(topics: List[Dict[str, Any]], niche: str = "", recency: str = "") -> int:
+    """Append a search run and its topics. Sets "id" on each topic dict; returns the run id."""
+    now = time.time()
+    with closing(_connect()) as conn, conn:
+        run_id = conn.execute(
+            "INSERT INTO runs (created_at, niche, recency, count) VALUES (?, ?, ?, ?)",
+            (now, niche, recency, len(topics)),
+        ).lastrowid
+        for i, t in enumerate(topics, 1):
+            idx = t.get("index", i)
+            t["id"] = conn.execute(
+                """INSERT INTO topics (run_id, idx, title, reason, summary, niche, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                (
+                    run_id,
+                    int(idx) if str(idx).isdigit() else i,
+                    str(t.get("title", t)),
+                    str(t.get("reason", "")),
+                    str(t.get("summary", "")),
+                    niche,
+                    now,
+                ),
+            ).lastrowid
+            t["run_id"] = run_id
+    from .topic_index import add_topics
+    add_topics(topics)
+    return run_id
+
+
+@metrics.timed("store.merge_run")
+def merge_into_run(topics: List[Dict[str, Any]], niche: str = "", recency: str = "") -> Optional[int]:
+    """
+    Append topics to the latest run with the same niche and recency (or start one), keeping the
+    existing topics' indices: new ones are numbered after the current maximum. The run becomes the latest.
+    Sets "id", "run_id" and "index" on each topic dict; returns the run id (None if nothing to merge into).
+    """
+    with closing(_connect()) as conn:
+        row = conn.execute(
+            "SELECT id FROM runs WHERE niche = ? AND recency = ? ORDER BY created_at DESC, id DESC LIMIT 1",
+            (niche, recency),
+        ).fetchone()
+    if row is None:
+        return save_run(topics, niche=niche, recency=recency) if topics else None
+    run_id = row["id"]
+    now = time.time()
+    with closing(_connect()) as conn, conn:
+        start = conn.execute("SELECT COALESCE(MAX(idx), 0) FROM topics WHERE run_id = ?", (run_id,)).fetchone()[0]
+        for i, t in enumerate(topics, start + 1):
+            t["id"] = conn.execute(
+                """INSERT INTO topics (run_id, idx, title, reason, summary, niche, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                (run_id, i, str(t.get("title", t)), str(t.get("reason", "")), str(t.get("summary", "")), niche, now),
+            ).lastrowid
+            t["run_id"] = run_id
+            t["index"] = i
+        conn.execute(
+            "UPDATE runs SET created_at = ?, count = (SELECT COUNT(*) FROM topics WHERE run_id = ?) WHERE id = ?",
+            (now, run_id, run_id),
+        )
+    if topics:
+        from .topic_index import add_topics
+        add_topics(topics)
+    return run_id
+
+
+def _source_key(niche: str) -> str:
+    return " ".join(niche.lower().split())
+
+
+def _content_hash(content: str) -> str:
+    return text_hash(re.sub(r"\s+", " ", (content or "").strip().lower()))
+
+
+def unseen_sources(niche: str, time_range: str, results: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """Search results whose URL and content hash were not yet processed for this niche and time window."""
+    key = _source_key(niche)
+    with closing(_connect()) as conn, conn:
+        conn.execute(
+            "DELETE FROM seen_sources WHERE time_range = ? AND seen_at < ?",
+            (time_range, time.time() - SEEN_RETENTION.get(time_range, SEEN_RETENTION["month"])),
+        )
+        fresh = []
+        for r in results:
+            seen = conn.execute(
+                "SELECT 1 FROM seen_sources WHERE niche = ? AND time_range = ? AND url = ? "
+                "UNION ALL SELECT 1 FROM seen_sources WHERE niche = ? AND time_range = ? AND content_hash = ? LIMIT 1",
+                (key, time_range, r.get("url", ""), key, time_range, _content_hash(r.get("content", ""))),
+            ).fetchone()
+            if not seen:
+                fresh.append(r)
+    return fresh
+
+
+def mark_sources_seen(niche: str, time_range: str, results: List[Dict[str, str]]) -> None:
+    key = _source_key(niche)
+    now = time.time()
+    with closing(_connect()) as conn, conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO seen_sources (niche, time_range, url, content_hash, seen_at) VALUES (?, ?, ?, ?, ?)",
+            [(key, time_range, r.get("url", ""), _content_hash(r.get("content", "")), now) for r in results],
+        )
+
+
+def load_run(run_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Topics of the given run (default: latest), ordered by index."""
+    with closing(_connect()) as conn:
+        if run_id is None:
+            row = conn.execute("SELECT id FROM runs ORDER BY created_at DESC, id DESC LIMIT 1").fetchone()
+            if row is None:
+                return []
+            run_id = row["id"]
+        rows = conn.execute("SELECT * FROM topics WHERE run_id = ? ORDER BY idx", (run_id,)).fetchall()
+    return [_topic_dict(r) for r in rows]
+
+
+def list_runs(limit: int = 20) -> List[Dict[str, Any]]:
+    """Most recent runs first: id, created_at, niche, recency, count."""
+    with closing(_connect()) as conn:
+        rows = conn.execute(
+            "SELECT id, created_at, niche, recency, count FROM runs ORDER BY created_at DESC, id DESC LIMIT ?",
+            (limit,),
+        ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def add_post(topic_id: int, content: str) -> int:
+    """
+    Record a post for the topic; returns its id. If the topic's latest post has the same content (a cached
+    draft shown again, e.g. re-selecting the topic), that post's id is returned instead of adding a duplicate.
+    """
+    with closing(_connect()) as conn, conn:
+        row = conn.execute(
+            "SELECT id, content FROM posts WHERE topic_id = ? ORDER BY created_at DESC, id DESC LIMIT 1", (topic_id,)
+        ).fetchone()
+        if row is not None and row["content"] == content:
+            return row["id"]
+        return conn.execute(
+            "INSERT INTO posts (topic_id, content, created_at) VALUES (?, ?, ?)",
+            (topic_id, content, time.time()),
+        ).lastrowid
+
+
+def latest_post(topic_id: int) -> Optional[Dict[str, Any]]:
+    """The topic's most recent post (id, topic_id, content, created_at), or None."""
+    with closing(_connect()) as conn:
+        row = conn.execute(
+            "SELECT * FROM posts WHERE topic_id = ? ORDER BY created_at DESC, id DESC LIMIT 1", (topic_id,)
+        ).fetchone()
+    return dict(row) if row else None
+
+
+def add_image(topic_id: int, path: str, post_id: Optional[int] = None, approved: bool = False) -> int:
+    with closing(_connect()) as conn, conn:
+        return conn.execute(
+            "INSERT INTO images (topic_id, post_id, path, approved, created_at) VALUES (?, ?, ?, ?, ?)",
+            (topic_id, post_id, str(path), int(approved), time.time()),
+        ).lastrowid
+
+
+def set_image_approved(path: str, approved: bool = True) -> None:
+    with closing(_connect()) as conn, conn:
+        conn.execute("UPDATE images SET approved = ? WHERE path = ?", (int(approved), str(path)))
+
+
+_HISTORY_SELECT = """
+SELECT t.id, t.run_id, t.idx, t.title, t.reason, t.summary, t.niche, t.created_at,
+       r.recency,
+       (SELECT content FROM posts p WHERE p.topic_id = t.id ORDER BY p.created_at DESC, p.id DESC LIMIT 1) AS post,
+       (SELECT COUNT(*) FROM posts p WHERE p.topic_id = t.id) AS posts,
+       (SELECT path FROM images i WHERE i.topic_id = t.id
+        ORDER BY i.approved DESC, i.created_at DESC, i.id DESC LIMIT 1) AS image,
+       EXISTS (SELECT 1 FROM images i WHERE i.topic_id = t.id AND i.approved = 1) AS approved
+FROM topics t JOIN runs r ON r.id = t.run_id
+"""
+
+
+def iter_history(
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    niche: Optional[str] = None,
+    approved: Optional[bool] = None,
+    batch_size: int = 500,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Every stored topic with its latest post and image (approved image first), in insertion order.
+    Filters: created_at in [start, end) (epoch seconds), niche contains the text (case-insensitive),
+    approved True (has an approved image) / False (has none). Rows are read in keyset-paginated batches,
+    so memory stays bounded by batch_size and no read transaction is held open while the caller works.
+    """
+    where = ["t.id > ?"]
+    params: List[Any] = []
+    if start is not None:
+        where.append("t.created_at >= ?")
+        params.append(start)
+    if end is not None:
+        where.append("t.created_at < ?")
+        params.append(end)
+    if niche:
+        where.append("t.niche LIKE ? ESCAPE '\\'")
+        params.append("%" + re.sub(r"([\\%_])", r"\\\1", niche.strip()) + "%")
+    if approved is not None:
+        where.append(("" if approved else "NOT ") + "EXISTS (SELECT 1 FROM images i WHERE i.topic_id = t.id AND i.approved = 1)")
+    sql = f"{_HISTORY_SELECT} WHERE {' AND '.join(where)} ORDER BY t.id LIMIT ?"
+    last_id = 0
+    while True:
+        with closing(_connect()) as conn:
+            rows = conn.execute(sql, (last_id, *params, batch_size)).fetchall()
+        for row in rows:
+            yield {
+                "topic_id": row["id"],
+                "run_id": row["run_id"],
+                "index": row["idx"],
+                "created_at": row["created_at"],
+                "niche": row["niche"],
+                "recency": row["recency"],
+                "title": row["title"],
+                "reason": row["reason"],
+                "summary": row["summary"],
+                "post": row["post"] or "",
+                "posts": row["posts"],
+                "image": row["image"] or "",
+                "approved": bool(row["approved"]),
+            }
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1]["id"]
+
+
+def import_excel_if_empty() -> int:
+    """One-time migration: if the store has no runs yet, import data/topics.xlsx as the first run."""
+    with closing(_connect()) as conn:
+        if conn.execute("SELECT 1 FROM runs LIMIT 1").fetchone():
+            return 0
+    if not TOPICS_EXCEL.exists():
+        return 0
+    from .excel_store import load_topics_from_excel
+    topics = load_topics_from_excel()
+    if topics:
+        save_run(topics, niche="imported from Excel")
+    return len(topics)
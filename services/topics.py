@@ -1,17 +1,35 @@
 """Trending topics: Tavily web research + Gemini to shape topics per strategist brief (Agentic AI, Gen AI, AI, Embedded, VLSI)."""
 import json
 import re
-from typing import List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
 
 import sys
 from pathlib import Path
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
-from config import TAVILY_API_KEY, GEMINI_API_KEY, GEMINI_CHAT_MODEL
+from config import (
+    TAVILY_API_KEY,
+    TAVILY_CACHE_TTL,
+    TAVILY_MAX_CONCURRENCY,
+    TOPIC_PROMPT_TOKEN_BUDGET,
+    GEMINI_API_KEY,
+)
+from . import metrics
+from .cache import ResponseCache, make_key
+from .clients import get_tavily_client
+from .ratelimit import call_with_retry
+from .resilience import generate_content
+from .snippets import build_research_context
 
 DEFAULT_NICHES = (
     "AI, Gen AI, Agentic AI, VLSI, Embedded Systems, IT Services and Industry"
 )
 
+# Tavily bills basic search per request, so always ask for the max and let count only shape the Gemini step
+TAVILY_MAX_RESULTS = 20
+
+_search_cache = ResponseCache("tavily", ttl=max(TAVILY_CACHE_TTL.values()), max_entries=500)
+
 TOPIC_STRATEGIST_SYSTEM = """You are a social media content strategist and growth marketer.
 Use Tavily-powered web research to gather recent, credible, and high-engagement information related to Agentic AI, Gen AI, AI, Embedded System, VLSI.
 
@@ -32,88 +50,231 @@ Content Scope (rotate across topics):
 Tone: enterprise credibility, strategic clarity, future-readiness. Avoid speculative or clickbait-only claims; prioritize data-backed insights."""
 
 
+def _field(r: Any, name: str) -> str:
+    return str(getattr(r, name, None) or (r.get(name) if isinstance(r, dict) else None) or "")
+
+
+@metrics.timed("tavily.search")
+def _tavily_search(
+    query: str,
+    topic: str,
+    time_range: str,
+    max_results: int = TAVILY_MAX_RESULTS,
+    search_depth: str = "basic",
+    use_cache: bool = True,
+) -> List[Dict[str, str]]:
+    """
+    One Tavily search. Raw results (title, url, content) are cached on disk per
+    (query, topic, depth, time_range, max_results); TTL is shorter for more recent windows.
+    """
+    key = make_key(query, topic, search_depth, time_range, max_results)
+    ttl = TAVILY_CACHE_TTL.get(time_range, TAVILY_CACHE_TTL["month"])
+    if not use_cache:
+        return _tavily_fetch(key, query, topic, time_range, max_results, search_depth)
+    cached = _search_cache.get(key, ttl=ttl)
+    if cached is not None:
+        metrics.annotate(cache="hit", results=len(cached))
+        return cached
+    # Concurrent identical searches (other sessions or replicas) share one Tavily call
+    with _search_cache.single_flight(key):
+        cached = _search_cache.get(key, ttl=ttl)
+        if cached is not None:
+            metrics.annotate(cache="shared", results=len(cached))
+            return cached
+        return _tavily_fetch(key, query, topic, time_range, max_results, search_depth)
+
+
+def _tavily_fetch(
+    key: str, query: str, topic: str, time_range: str, max_results: int, search_depth: str
+) -> List[Dict[str, str]]:
+    client = get_tavily_client()
+    response = call_with_retry(
+        "tavily",
+        client.search,
+        api_key=TAVILY_API_KEY,
+        query=query,
+        search_depth=search_depth,
+        topic=topic,
+        time_range=time_range,
+        max_results=max_results,
+    )
+    raw = getattr(response, "results", []) or []
+    if isinstance(response, dict):
+        raw = response.get("results", [])
+    results = [
+        {"title": _field(r, "title"), "url": _field(r, "url"), "content": _field(r, "content")}
+        for r in raw
+    ]
+    _search_cache.set(key, results)
+    metrics.annotate(cache="miss", results=len(results))
+    return results
+
+
+def split_niches(niche: str) -> List[str]:
+    """'AI, Gen AI, VLSI' → ['AI', 'Gen AI', 'VLSI'] (order kept, duplicates dropped)."""
+    seen = set()
+    out = []
+    for part in niche.split(","):
+        part = part.strip()
+        if part and part.lower() not in seen:
+            seen.add(part.lower())
+            out.append(part)
+    return out
+
+
+def _merge_results(result_lists: List[List[Dict[str, str]]]) -> List[Dict[str, str]]:
+    """Round-robin across lists so every domain is represented near the top; de-duplicate by URL."""
+    merged = []
+    seen = set()
+    longest = max((len(r) for r in result_lists), default=0)
+    for i in range(longest):
+        for results in result_lists:
+            if i >= len(results):
+                continue
+            r = results[i]
+            key = r["url"] or r["title"].lower()
+            if key and key not in seen:
+                seen.add(key)
+                merged.append(r)
+    return merged
+
+
+def _fan_out_search(niche: str, time_range: str, use_cache: bool = True) -> List[Dict[str, str]]:
+    """One Tavily query per niche, run concurrently (at most TAVILY_MAX_CONCURRENCY at a time)."""
+    queries = [
+        f"latest trends statistics expert opinions {domain} LinkedIn published last {time_range}"
+        for domain in split_niches(niche)
+    ] or [f"latest trends statistics expert opinions {DEFAULT_NICHES} published last {time_range}"]
+    workers = max(1, min(TAVILY_MAX_CONCURRENCY, len(queries)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tavily") as pool:
+        futures = [pool.submit(metrics.bind(_tavily_search), q, "general", time_range, use_cache=use_cache) for q in queries]
+    result_lists = []
+    errors = []
+    for fut in futures:
+        try:
+            result_lists.append(fut.result())
+        except Exception as e:
+            errors.append(e)
+    if errors and not result_lists:
+        raise errors[0]
+    return _merge_results(result_lists)
+
+
+def _time_range(recency: str) -> str:
+    return recency if recency in ("day", "week", "month", "year") else "month"
+
+
+def mark_sources_seen(niche: str, recency: str, sources: List[Dict[str, str]]) -> None:
+    """Record sources returned via search_trending_topics(seen_sources=...) as processed for niche/recency."""
+    if sources:
+        from . import topic_store
+        topic_store.mark_sources_seen(niche, _time_range(recency), sources)
+
+
+@metrics.timed("topics.search")
 def search_trending_topics(
     niche: str = DEFAULT_NICHES,
     count: int = 10,
     recency: str = "month",
+    use_cache: bool = True,
+    fan_out: bool = False,
+    dedupe: bool = True,
+    incremental: bool = False,
+    seen_sources: Optional[List[Dict[str, str]]] = None,
 ) -> List[Dict[str, Any]]:
     """
     Use Tavily for web research, then Gemini to shape topics per strategist brief.
+    Tavily results are cached (see TAVILY_CACHE_TTL); use_cache=False forces a fresh web search.
+    fan_out=True runs one concurrent query per comma-separated niche instead of one combined query.
+    dedupe=True drops topics that are near-duplicates of any stored topic (see topic_index), so fewer
+    than `count` may come back when a niche has little new.
+    incremental=True only sends results whose URL/content were not processed before for this niche and
+    time window to Gemini (at most one topic per new result); returns [] without a Gemini call if nothing is new.
+    Merge the returned topics into the existing pool with topic_store.merge_into_run. Sources are only
+    marked as processed when Gemini shaped the topics (raw-headline fallbacks leave them for the next
+    refresh); pass a seen_sources list to receive them instead and call mark_sources_seen after the merge.
     Returns list of dicts with keys: title, reason, summary.
     """
     if not TAVILY_API_KEY:
         raise ValueError("TAVILY_API_KEY is not set in .env")
 
-    try:
-        from tavily import TavilyClient
-    except ImportError:
-        raise ImportError("Install tavily-python: pip install tavily-python")
-
-    client = TavilyClient(api_key=TAVILY_API_KEY)
-    time_range = recency if recency in ("day", "week", "month", "year") else "month"
+    time_range = _time_range(recency)
 
-    # Query 1: credible sources + domains (Agentic AI, Gen AI, AI, Embedded, VLSI)
-    query1 = (
-        f"credible blogs industry reports expert opinions {niche} "
-        f"statistics trends LinkedIn trending published last {time_range}"
-    )
-    response1 = client.search(
-        query=query1,
-        search_depth="basic",
-        topic="general",
-        time_range=time_range,
-        max_results=min(count + 5, 20),
-    )
-    results = getattr(response1, "results", []) or []
-    if isinstance(response1, dict):
-        results = response1.get("results", [])
-
-    # Query 2: domains + trends (if we want more)
-    if len(results) < count:
-        query2 = (
-            f"trends and data {niche} "
-            f"digital transformation semiconductor embedded systems AI workforce "
-            f"published or updated last {time_range}"
+    if fan_out:
+        results = _fan_out_search(niche, time_range, use_cache=use_cache)
+    else:
+        # Query 1: credible sources + domains (Agentic AI, Gen AI, AI, Embedded, VLSI)
+        query1 = (
+            f"credible blogs industry reports expert opinions {niche} "
+            f"statistics trends LinkedIn trending published last {time_range}"
         )
-        try:
-            response2 = client.search(
-                query=query2,
-                search_depth="basic",
-                topic="news",
-                time_range=time_range,
-                max_results=min(count + 5, 20),
+        results = list(_tavily_search(query1, "general", time_range, use_cache=use_cache))
+
+        # Query 2: domains + trends (if we want more)
+        if len(results) < count:
+            query2 = (
+                f"trends and data {niche} "
+                f"digital transformation semiconductor embedded systems AI workforce "
+                f"published or updated last {time_range}"
             )
-            res2 = getattr(response2, "results", []) or []
-            if isinstance(response2, dict):
-                res2 = response2.get("results", [])
-            seen_urls = {getattr(r, "url", None) or (r.get("url") if isinstance(r, dict) else "") for r in results}
-            for r in res2:
-                url = getattr(r, "url", None) or (r.get("url") if isinstance(r, dict) else "")
-                if url and url not in seen_urls:
-                    results.append(r)
-                    seen_urls.add(url)
-        except Exception:
-            pass
-
-    # Build raw context for Gemini
-    raw = []
-    for r in results:
-        title = (getattr(r, "title", None) or (r.get("title") if isinstance(r, dict) else None) or "").strip()
-        content = (getattr(r, "content", None) or (r.get("content") if isinstance(r, dict) else None) or "").strip()
-        if title and len(content) > 20:
-            raw.append(f"Title: {title}\nSnippet: {content[:400]}")
-    raw_text = "\n\n---\n\n".join(raw[:20]) if raw else "No recent results found."
+            try:
+                res2 = _tavily_search(query2, "news", time_range, use_cache=use_cache)
+                seen_urls = {r["url"] for r in results}
+                for r in res2:
+                    if r["url"] and r["url"] not in seen_urls:
+                        results.append(r)
+                        seen_urls.add(r["url"])
+            except Exception:
+                pass
+
+    if incremental:
+        from . import topic_store
+        results = topic_store.unseen_sources(niche, time_range, results)
+        if not results:
+            return []
+        count = min(count, len(results))
+
+    # Rank snippets against the niche and pack the best sentences into the prompt budget
+    with metrics.span("topics.rank_snippets", results=len(results)) as sp:
+        raw_text = build_research_context(results, niche, TOPIC_PROMPT_TOKEN_BUDGET) or "No recent results found."
+        sp["chars"] = len(raw_text)
+
+    # Ask for a few extra topics so near-duplicates of past runs can be dropped without coming up short
+    wanted = count + (max(2, count // 2) if dedupe else 0)
 
     # If Gemini is available, shape topics with the strategist prompt
+    topics, shape_error = [], "GEMINI_API_KEY is not set"
     if GEMINI_API_KEY and raw_text.strip():
-        try:
-            import google.generativeai as genai
-            genai.configure(api_key=GEMINI_API_KEY)
-            model = genai.GenerativeModel(
-                GEMINI_CHAT_MODEL,
-                system_instruction=TOPIC_STRATEGIST_SYSTEM,
-            )
-            user_prompt = f"""Based on the following Tavily web search results, output exactly {count} topic ideas for LinkedIn that match the research instructions and content scope above.
+        topics, shape_error = _shape_topics(raw_text, wanted, time_range)
+
+    # Fallback: use raw Tavily results as topics, flagged with why Gemini was skipped
+    if not topics:
+        metrics.incr("topics_fallback")
+        topics = _fallback_topics(results, wanted, time_range)
+        for t in topics:
+            t["fallback"] = shape_error or "Gemini returned no topics"
+
+    if dedupe:
+        from .topic_index import filter_new
+        with metrics.span("topics.dedupe", candidates=len(topics)) as sp:
+            topics, dropped = filter_new(topics)
+            sp["dropped"] = len(dropped)
+    if incremental and shape_error is None:
+        if seen_sources is None:
+            topic_store.mark_sources_seen(niche, time_range, results)
+        else:
+            seen_sources.extend(results)
+    topics = topics[:count]
+    for i, t in enumerate(topics, 1):
+        t["index"] = i
+    return topics
+
+
+@metrics.timed("topics.shape")
+def _shape_topics(raw_text: str, count: int, time_range: str) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Gemini topic shaping: (topics, None), or ([], reason) if the call fails or returns no parseable JSON array."""
+    try:
+        user_prompt = f"""Based on the following Tavily web search results, output exactly {count} topic ideas for LinkedIn that match the research instructions and content scope above.
 
 Web search results (recent, {time_range}):
 {raw_text}
@@ -125,39 +286,43 @@ For each topic provide a JSON array of objects with keys: "title", "reason", "su
 
 Return ONLY the JSON array, no other text. Prioritize data-backed insights and what resonates on LinkedIn."""
 
-            resp = model.generate_content(
-                user_prompt,
-                generation_config={"max_output_tokens": 65536, "temperature": 0.4},
-            )
-            content = (resp.text or "").strip()
-            content_clean = re.sub(r"^```\w*\n?", "", content)
-            content_clean = re.sub(r"\n?```\s*$", "", content_clean).strip()
-            try:
-                topics = json.loads(content_clean)
-                if isinstance(topics, list) and len(topics) > 0:
-                    result = []
-                    for i, t in enumerate(topics[:count], 1):
-                        if isinstance(t, dict):
-                            result.append({
-                                "index": i,
-                                "title": str(t.get("title", t))[:200],
-                                "reason": str(t.get("reason", ""))[:300],
-                                "summary": str(t.get("summary", ""))[:300],
-                            })
-                        else:
-                            result.append({"index": i, "title": str(t)[:200], "reason": "", "summary": ""})
-                    return result
-            except json.JSONDecodeError:
-                pass
-        except Exception:
-            pass
+        resp = generate_content(
+            TOPIC_STRATEGIST_SYSTEM,
+            user_prompt,
+            op="topics",
+            generation_config={"max_output_tokens": 65536, "temperature": 0.4},
+        )
+        metrics.add_usage(resp)
+        content = (resp.text or "").strip()
+        metrics.annotate(bytes_out=len(user_prompt.encode("utf-8")), bytes_in=len(content.encode("utf-8")))
+        content_clean = re.sub(r"^```\w*\n?", "", content)
+        content_clean = re.sub(r"\n?```\s*$", "", content_clean).strip()
+        topics = json.loads(content_clean)
+    except Exception as e:
+        reason = f"Gemini topic shaping failed ({type(e).__name__}: {e})"[:300]
+        metrics.annotate(fallback=reason)
+        return [], reason
+    result = []
+    if isinstance(topics, list):
+        for i, t in enumerate(topics[:count], 1):
+            if isinstance(t, dict):
+                result.append({
+                    "index": i,
+                    "title": str(t.get("title", t))[:200],
+                    "reason": str(t.get("reason", ""))[:300],
+                    "summary": str(t.get("summary", ""))[:300],
+                })
+            else:
+                result.append({"index": i, "title": str(t)[:200], "reason": "", "summary": ""})
+    return result, (None if result else "Gemini returned no topics")
+
 
-    # Fallback: use raw Tavily results as topics
+def _fallback_topics(results: List[Dict[str, str]], count: int, time_range: str) -> List[Dict[str, Any]]:
     seen_titles = set()
     topics = []
     for r in results:
-        title = (getattr(r, "title", None) or (r.get("title") if isinstance(r, dict) else None) or "").strip()
-        content = (getattr(r, "content", None) or (r.get("content") if isinstance(r, dict) else None) or "").strip()
+        title = r["title"].strip()
+        content = r["content"].strip()
         if not title or len(title) < 3 or title.lower() in seen_titles:
             continue
         seen_titles.add(title.lower())
@@ -168,6 +333,4 @@ Return ONLY the JSON array, no other text. Prioritize data-backed insights and w
         })
         if len(topics) >= count:
             break
-    for i, t in enumerate(topics[:count], 1):
-        t["index"] = i
-    return topics[:count]
+    return topics
@@ -0,0 +1,13 @@
+"""Test setup: state goes to a temporary directory, tracing is off and no real API key is used."""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+_state = tempfile.mkdtemp(prefix="linkedin-tests-")
+os.environ["DATA_DIR"] = os.path.join(_state, "data")
+os.environ["OUTPUT_DIR"] = os.path.join(_state, "output")
+os.environ["TRACE_ENABLED"] = "0"
+os.environ["STORAGE_BACKEND"] = "local"
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
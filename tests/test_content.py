@@ -0,0 +1,122 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from config import GEMINI_CHAT_MODEL
+from services import content, resilience
+
+FALLBACK = "fallback-model"
+
+
+def _post(model: str) -> str:
+    return content.format_post({
+        "conversation_trigger": "Who owns the roadmap?",
+        "caption": f"Written by {model}. Where does this leave your team?",
+        "hero_copy": "Silicon roadmaps now start with the software stack",
+        "hashtags": "#AI #VLSI",
+    })
+
+
+class FakeResponse:
+    """Enough of a GenerateContentResponse for content.py: text, candidates, stream chunks, usage."""
+
+    def __init__(self, model: str, kwargs):
+        config = kwargs.get("generation_config") or {}
+        n = config.get("candidate_count", 1)
+        if config.get("response_schema") is content.BATCH_RESPONSE_SCHEMA:
+            record = content.parse_sections(_post(model))
+            self.text = json.dumps([{"topic_index": i, **record} for i in (1, 2)])
+        else:
+            self.text = _post(model)
+        part = SimpleNamespace(text=self.text)
+        self.candidates = [SimpleNamespace(content=SimpleNamespace(parts=[part])) for _ in range(n)]
+        self.usage_metadata = SimpleNamespace(prompt_token_count=10, candidates_token_count=20)
+        self._chunks = [SimpleNamespace(text=line + "\n") for line in self.text.split("\n")]
+
+    def __iter__(self):
+        return iter(self._chunks)
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    """Fake Gemini with a fallback model; yields the list of models called."""
+    calls = []
+
+    def hedged(model, op, system_instruction, prompt, kwargs):
+        calls.append(model)
+        return FakeResponse(model, kwargs)
+
+    monkeypatch.setattr(resilience, "_hedged", hedged)
+    monkeypatch.setattr(resilience, "GEMINI_API_KEY", "test-key")
+    monkeypatch.setattr(resilience, "GEMINI_FALLBACK_MODEL", FALLBACK)
+    monkeypatch.setattr(content, "GEMINI_API_KEY", "test-key")
+    breaker = resilience.get_breaker(GEMINI_CHAT_MODEL)
+    yield calls
+    breaker._set("closed")
+
+
+def _single(topic):
+    return [content.generate_linkedin_content(topic)]
+
+
+def _stream(topic):
+    return [list(content.stream_linkedin_content(topic))[-1]["text"]]
+
+
+def _batch(topic):
+    return [r["content"] for r in content.generate_linkedin_content_batch([topic, topic + " (2)"])]
+
+
+def _variants(topic):
+    return [v["content"] for v in content.generate_linkedin_variants(topic, n=2)]
+
+
+@pytest.mark.parametrize("generate", [_single, _stream, _batch, _variants])
+def test_fallback_output_is_not_served_from_cache(gemini, generate):
+    topic = f"Chiplets and the {generate.__name__} path"
+    resilience.get_breaker(GEMINI_CHAT_MODEL)._set("open")
+    assert all(FALLBACK in text for text in generate(topic))
+    assert gemini == [FALLBACK]
+
+    resilience.get_breaker(GEMINI_CHAT_MODEL)._set("closed")
+    assert all(GEMINI_CHAT_MODEL in text for text in generate(topic))
+    assert gemini == [FALLBACK, GEMINI_CHAT_MODEL]
+
+    # The main model's answer is cached as usual
+    assert all(GEMINI_CHAT_MODEL in text for text in generate(topic))
+    assert gemini == [FALLBACK, GEMINI_CHAT_MODEL]
+
+
+INLINE_POST = """**Conversation Trigger:** Who owns the roadmap now?
+**LinkedIn Caption:** Hashtags are dead. Roadmaps start with software. Where does that leave your team?
+**HERO Copy (based on the LinkedIn caption):** Silicon roadmaps now start with the software stack
+**Hashtags:** #AI #VLSI
+"""
+
+
+def test_parse_sections_inline_headers():
+    sections = content.parse_sections(INLINE_POST)
+    assert sections == {
+        "conversation_trigger": "Who owns the roadmap now?",
+        "caption": "Hashtags are dead. Roadmaps start with software. Where does that leave your team?",
+        "hero_copy": "Silicon roadmaps now start with the software stack",
+        "hashtags": "#AI #VLSI",
+    }
+
+
+def test_parse_sections_header_lines_and_body_mentions():
+    text = "LinkedIn Caption\nHashtags are dead.\nHashtags matter less than you think?\n\nHashtags:\n#AI"
+    sections = content.parse_sections(text)
+    assert sections["caption"] == "Hashtags are dead.\nHashtags matter less than you think?"
+    assert sections["hashtags"] == "#AI"
+
+
+def test_section_parser_streams_inline_headers():
+    parser = content.SectionParser()
+    completed = []
+    for i in range(0, len(INLINE_POST), 7):
+        completed += parser.feed(INLINE_POST[i:i + 7])
+    completed += parser.close()
+    assert completed == content.SECTION_KEYS
+    assert parser.sections == content.parse_sections(INLINE_POST)
@@ -0,0 +1,68 @@
+import threading
+import time
+from contextlib import closing
+
+import pytest
+
+from services import jobs
+
+_gates = {}
+
+
+@jobs.job_handler("test_gated")
+def _gated(params, progress):
+    progress({"stage": "started"}, force=True)
+    _gates[params["gate"]].wait(5)
+    if params.get("report"):
+        progress({"stage": "after gate"}, force=True)
+    return {"ok": True}
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return jobs.JobQueue(workers=2, db_path=tmp_path / "jobs.sqlite")
+
+
+def _wait_for(queue, job_id, predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = queue.get(job_id)
+        if predicate(job):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"job state not reached: {queue.get(job_id)}")
+
+
+def _steal(queue, job_id):
+    """What another host does after reclaiming the job: new owner, fresh heartbeat, re-queued."""
+    with closing(queue._connect()) as conn, conn:
+        conn.execute(
+            "UPDATE jobs SET owner = 'other-host:1:abcdef12', status = 'queued', heartbeat_at = ? WHERE id = ?",
+            (time.time(), job_id),
+        )
+
+
+@pytest.mark.parametrize("report", [True, False])
+def test_reclaimed_job_is_not_overwritten_by_old_worker(queue, report):
+    gate = f"gate-{report}"
+    _gates[gate] = threading.Event()
+    job_id = queue.submit("test_gated", {"gate": gate, "report": report})
+    _wait_for(queue, job_id, lambda j: j["progress"] == {"stage": "started"})
+    _steal(queue, job_id)
+    _gates[gate].set()
+    time.sleep(0.3)
+
+    job = queue.get(job_id)
+    assert job["owner"] == "other-host:1:abcdef12"
+    assert job["status"] == "queued"
+    assert job["result"] is None
+    assert job["progress"] == {"stage": "started"}
+
+
+def test_job_finishes_when_not_reclaimed(queue):
+    _gates["gate-done"] = threading.Event()
+    _gates["gate-done"].set()
+    job_id = queue.submit("test_gated", {"gate": "gate-done", "report": True})
+    job = _wait_for(queue, job_id, lambda j: j["status"] == "done")
+    assert job["result"] == {"ok": True}
+    assert job["progress"] == {"stage": "after gate"}
@@ -0,0 +1,67 @@
+from contextlib import closing
+
+import pytest
+
+from services import ratelimit
+
+
+class Throttled(Exception):
+    code = 429
+
+
+def _in_flight(api):
+    with closing(ratelimit._connect()) as conn:
+        return conn.execute("SELECT COUNT(*) FROM leases WHERE name = ?", (ratelimit.bucket_name(api),)).fetchone()[0]
+
+
+def _rate(api):
+    with closing(ratelimit._connect()) as conn:
+        return conn.execute("SELECT rate FROM buckets WHERE name = ?", (ratelimit.bucket_name(api),)).fetchone()[0]
+
+
+def test_stream_holds_lease_until_read():
+    api = "test_stream_read"
+    stream = ratelimit.call_with_retry(api, lambda: iter(["a", "b"]), streaming=True)
+    assert _in_flight(api) == 1
+    chunks = iter(stream)
+    assert next(chunks) == "a"
+    assert _in_flight(api) == 1
+    assert list(chunks) == ["b"]
+    assert _in_flight(api) == 0
+
+
+def test_stream_close_releases_lease():
+    api = "test_stream_close"
+    stream = ratelimit.call_with_retry(api, lambda: iter(["a", "b"]), streaming=True)
+    chunks = iter(stream)
+    next(chunks)
+    chunks.close()
+    assert _in_flight(api) == 0
+
+    stream = ratelimit.call_with_retry(api, lambda: iter(["a"]), streaming=True)
+    stream.close()
+    assert _in_flight(api) == 0
+
+
+def test_throttling_mid_stream_reaches_limiter():
+    api = "test_stream_throttled"
+
+    def body():
+        yield "a"
+        raise Throttled("quota exceeded")
+
+    stream = ratelimit.call_with_retry(api, body, streaming=True)
+    rate = _rate(api)
+    with pytest.raises(Throttled):
+        list(stream)
+    assert _in_flight(api) == 0
+    assert _rate(api) == pytest.approx(rate / 2)
+
+
+def test_response_attributes_pass_through():
+    class Response(list):
+        usage_metadata = "usage"
+
+    stream = ratelimit.call_with_retry("test_stream_attrs", lambda: Response(["a"]), streaming=True)
+    assert stream.usage_metadata == "usage"
+    assert list(stream) == ["a"]
@@ -0,0 +1,49 @@
+import threading
+import time
+
+import pytest
+
+from services import storage
+from services.cache import ResponseCache, make_key
+
+
+@pytest.mark.parametrize("flock", [True, False])
+def test_removable_lock_excludes_and_cleans_up(tmp_path, flock):
+    path = tmp_path / "key.lock"
+    holders, peak, errors = [], [0], []
+
+    def worker():
+        for _ in range(50):
+            lock = storage.FileLock(path, flock=flock, remove=True)
+            if not lock.acquire(timeout=10):
+                errors.append("timeout")
+                return
+            holders.append(1)
+            peak[0] = max(peak[0], len(holders))
+            time.sleep(0.0005)
+            holders.pop()
+            lock.release()
+
+    threads = [threading.Thread(target=worker) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    assert peak[0] == 1
+    assert not path.exists()
+
+
+def test_single_flight_locks_do_not_pile_up_or_share(tmp_path):
+    cache = ResponseCache("test_locks", ttl=60)
+    locks_dir = storage.get_storage().locks_dir
+    before = set(locks_dir.glob("cache-test_locks-*"))
+    for i in range(200):
+        with cache.single_flight(make_key(i)) as acquired:
+            assert acquired
+    assert set(locks_dir.glob("cache-test_locks-*")) == before
+
+    # A different key is never blocked by one that is being computed
+    with cache.single_flight(make_key("slow")):
+        with cache.single_flight(make_key("other"), timeout=0.2) as acquired:
+            assert acquired